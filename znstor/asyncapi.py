@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Concurrent interface to znstor daemon.
+
+Znstor methods are blocking, AsyncZnstor runs them on a bounded pool of
+workers and returns futures, so independent requests can be issued at once.
+Workers are plain threads, which are green threads when running inside
+cinder-volume (eventlet monkey patching).
+"""
+
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from jobs import Future
+
+
+class AsyncZnstor(object):
+    """Concurrent facade of Znstor client.
+    Every Znstor method is available with the same arguments and returns Future.
+    Requests share connection pool of the wrapped client.
+    """
+
+    def __init__(self, storage, concurrency=10):
+        """
+        :param storage: Znstor client
+        :param concurrency: max number of requests running at once.
+        Should not exceed connection pool size of the client.
+        """
+        self.storage = storage
+        self.concurrency = concurrency
+        self._queue = queue.Queue()
+        self._workers = []
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        method = getattr(self.storage, name)
+        if not callable(method):
+            return method
+
+        def submit(*args, **kwargs):
+            return self.submit(method, *args, **kwargs)
+        submit.__name__ = name
+        submit.__doc__ = method.__doc__
+        return submit
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in background
+        :return: Future
+        """
+        future = Future()
+        with self._lock:
+            self._queue.put((future, fn, args, kwargs))
+            if self._idle > 0:
+                self._idle -= 1
+            elif len(self._workers) < self.concurrency:
+                worker = threading.Thread(target=self._work, name='znstor-async')
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+        return future
+
+    def _work(self):
+        while True:
+            future, fn, args, kwargs = self._queue.get()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            with self._lock:
+                self._idle += 1
+
+    @staticmethod
+    def gather(futures, return_exceptions=False):
+        """Wait for futures
+        :param futures: list of futures
+        :param return_exceptions: return exception of failed future instead of raising it
+        :return: list of results in order of futures
+        """
+        results = []
+        for future in futures:
+            if return_exceptions:
+                exc = future.exception()
+                results.append(exc if exc is not None else future.result())
+            else:
+                results.append(future.result())
+        return results
+
+    def call(self, calls, return_exceptions=False):
+        """Run independent calls concurrently and wait for all of them.
+        :param calls: list of (method name, args) or (method name, args, kwargs)
+        :param return_exceptions: return exception of failed call instead of raising it
+        :return: list of results in order of calls
+        """
+        futures = []
+        for call in calls:
+            name, args = call[0], call[1]
+            kwargs = call[2] if len(call) > 2 else {}
+            futures.append(getattr(self, name)(*args, **kwargs))
+        return self.gather(futures, return_exceptions)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""Backup of znstor volumes from snapshot diffs.
+
+ZnstorBackupDriver is posix chunked backup driver which does not read attached
+volume of znstor backend: volume is snapshotted as "backup-<backup id>" and
+znstord streams blocks changed since snapshot of parent backup, so incremental
+backup transfers and stores only changed data. Only the snapshot of the latest
+backup of volume is retained. Backups are restored by chunked driver as usual,
+volumes of other backends and backups of snapshots are backed up by posix driver.
+"""
+
+import hashlib
+import threading
+
+from oslo_log import log
+from oslo_utils import excutils
+from cinder import exception
+from cinder import objects
+from cinder.backup.drivers import posix
+from cinder.objects import fields
+from cinder.volume import configuration
+from cinder.volume import utils as volume_utils
+from cinder.volume.drivers.znstor import znstiscsi as znstor_iscsi
+from cinder.volume.drivers.znstor import restapi as znstor_restapi
+from cinder.volume.drivers.znstor import metrics as znstor_metrics
+from cinder.volume.drivers.znstor import pools as znstor_pools
+
+LOG = log.getLogger(__name__)
+
+# (config group, zpool) -> client, driver is instantiated per backup
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class ZnstorBackupDriver(posix.PosixBackupDriver):
+    """Posix backup driver diffing snapshots of znstor volumes"""
+
+    def _source(self, backup):
+        """Return (client, pool, volume LU) of backed up volume,
+        None if it is not znstor volume or it is backed up from snapshot"""
+        if backup.snapshot_id:
+            return None
+        volume = self.db.volume_get(self.context, backup.volume_id)
+        if not volume.get('host'):
+            return None
+        group = volume_utils.extract_host(volume['host'], 'backend').partition('@')[2] or None
+        config = configuration.Configuration(znstor_iscsi.OPTS, config_group=group)
+        if not config.management_addr or not (config.znstor_projects or config.znstor_project):
+            return None
+
+        pools = znstor_pools.parse_pools(
+            config.znstor_projects or [config.znstor_project], config.znstor_pool)
+        name = volume_utils.extract_host(volume['host'], 'pool')
+        pool = [pool for pool in pools if pool.name == name] or pools[:1]
+        pool = pool[0]
+        with _clients_lock:
+            client = _clients.get((group, pool.zpool))
+            if client is None:
+                # metrics of backup service are not forwarded to sinks of volume service
+                client = _clients[(group, pool.zpool)] = znstor_iscsi.make_client(
+                    config, pool.zpool, znstor_metrics.Metrics())
+
+        if volume.get('provider_id'):
+            lu = {'LUName': volume['provider_id']}
+        else:
+            lu = client.volume_get_by_alias(pool.project, volume['name'])
+        if lu is None:
+            LOG.warning('ZNSTOR. Volume %s not found, it is backed up by reading attached volume.',
+                        volume['name'])
+            return None
+        return client, pool, lu
+
+    def _base_snapshot(self, backup, client, pool, lu):
+        """Return (snapshot of parent backup, sha256 list of parent backup)
+        or (None, None) if volume is backed up in full"""
+        if not backup.parent_id:
+            return None, None
+        parent = objects.Backup.get_by_id(self.context, backup.parent_id)
+        shafile = self._read_sha256file(parent)
+        if shafile['chunk_size'] != self.sha_block_size_bytes or backup.size != parent.size:
+            LOG.info('ZNSTOR. Hash block or volume size changed since backup %s, backing up %s in full.',
+                     parent.id, backup.volume_id)
+            return None, None
+        name = znstor_iscsi.BACKUP_SNAPSHOT_PREFIX + parent.id
+        try:
+            client.volume_get_snapshot(pool.project, lu['LUName'], name)
+        except znstor_restapi.ZnstorBadRequest:
+            LOG.info('ZNSTOR. Snapshot %s of backup %s is gone, backing up %s in full.',
+                     name, parent.id, backup.volume_id)
+            return None, None
+        return name, shafile['sha256s']
+
+    def _sha256s(self, data):
+        block = self.sha_block_size_bytes
+        return [hashlib.sha256(data[offset:offset + block]).hexdigest()
+                for offset in range(0, len(data), block)]
+
+    def _pieces(self, extents):
+        """Split holes of diff stream into zero pieces of at most chunk size
+        :return: generator of (offset, data, hole)
+        """
+        zero = b'\0' * self.chunk_size_bytes
+        for offset, length, data in extents:
+            if data is not None:
+                yield offset, data, False
+                continue
+            end = offset + length
+            while offset < end:
+                size = min(self.chunk_size_bytes, end - offset)
+                yield offset, zero if size == len(zero) else zero[:size], True
+                offset += size
+
+    def _canceled(self, backup):
+        with backup.as_read_deleted():
+            backup.refresh()
+        return backup.status in (fields.BackupStatus.DELETING, fields.BackupStatus.DELETED)
+
+    def backup(self, backup, volume_file, backup_metadata=True):
+        """Back up znstor volume from snapshot diff.
+        Incremental backup streams blocks changed since snapshot of parent backup, backup
+        without parent or without parent snapshot streams the whole snapshot.
+        """
+        source = self._source(backup)
+        if source is None:
+            return super(ZnstorBackupDriver, self).backup(backup, volume_file, backup_metadata)
+        client, pool, lu = source
+        if self.chunk_size_bytes % self.sha_block_size_bytes:
+            raise exception.InvalidBackup(
+                reason='Chunk size is not multiple of block size for creating hash.')
+
+        base, parent_sha256s = self._base_snapshot(backup, client, pool, lu)
+        snapname = znstor_iscsi.BACKUP_SNAPSHOT_PREFIX + backup.id
+        client.volume_create_snapshot(pool.project, lu['LUName'], snapname)
+        try:
+            finished = self._backup_diff(backup, client, pool, lu, snapname, base, parent_sha256s,
+                                         backup_metadata)
+        except znstor_restapi.ZnstorNotSupported as e:
+            # diff is requested before any chunk is written
+            LOG.warning('ZNSTOR. Snapshot diff is not supported, backup %s reads attached volume. Err: %s',
+                        backup.id, e)
+            self._destroy_snapshot(client, pool, lu, snapname)
+            return super(ZnstorBackupDriver, self).backup(backup, volume_file, backup_metadata)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._destroy_snapshot(client, pool, lu, snapname)
+        if not finished:
+            # snapshot of canceled backup is destroyed by delete_backup
+            return
+        # the latest backup is the parent of the next incremental one, older bases are not needed
+        for snap in client.volume_list_snapshot(pool.project, lu['LUName']) or []:
+            name = znstor_restapi.snapshot_name(snap)
+            if name and name != snapname and name.startswith(znstor_iscsi.BACKUP_SNAPSHOT_PREFIX) \
+                    and not snap.get('clones'):
+                self._destroy_snapshot(client, pool, lu, name)
+
+    def _backup_diff(self, backup, client, pool, lu, snapname, base, parent_sha256s, backup_metadata):
+        """Write changed extents of snapshot as backup chunks
+        :return: False if backup was canceled
+        """
+        (object_meta, object_sha256, extra_metadata, container,
+         volume_size_bytes) = self._prepare_backup(backup)
+        block = self.sha_block_size_bytes
+        count = (volume_size_bytes + block - 1) // block
+        # unchanged blocks keep hashes of parent backup, full diff covers every block
+        sha256s = list(parent_sha256s[:count]) if base else [None] * count
+        zero_sha256 = hashlib.sha256(b'\0' * block).hexdigest()
+
+        extents = client.volume_diff_snapshot(pool.project, lu['LUName'], snapname, base=base,
+                                              align=block, piece_size=self.chunk_size_bytes)
+        sent = 0
+        counter = 0
+        try:
+            for offset, data, hole in self._pieces(extents):
+                if self._canceled(backup):
+                    # chunks written so far are removed like in chunked driver
+                    self.delete_backup(backup)
+                    LOG.debug('Cancel the backup process of %s.', backup.id)
+                    return False
+                if offset % block:
+                    raise exception.InvalidBackup(
+                        reason='ZNSTOR. Diff extent at %d is not aligned to %d.' % (offset, block))
+                self._backup_chunk(backup, container, data, offset, object_meta, extra_metadata)
+                if hole and not len(data) % block:
+                    hashes = [zero_sha256] * (len(data) // block)
+                else:
+                    hashes = self._sha256s(data)
+                sha256s[offset // block:offset // block + len(hashes)] = hashes
+
+                sent += len(data)
+                counter += 1
+                if counter == self.data_block_num:
+                    self._send_progress_notification(self.context, backup, object_meta,
+                                                     sent, volume_size_bytes)
+                    counter = 0
+        finally:
+            # diff response is closed when stream is not read to the end
+            extents.close()
+
+        if None in sha256s:
+            raise exception.InvalidBackup(
+                reason='ZNSTOR. Diff of snapshot %s does not cover volume.' % snapname)
+        LOG.info('ZNSTOR. Backup %s of volume %s: %d bytes %s.', backup.id, backup.volume_id, sent,
+                 'changed since %s' % base if base else 'in full')
+        self._send_progress_end(self.context, backup, object_meta)
+
+        object_sha256['sha256s'] = sha256s
+        if backup_metadata:
+            try:
+                self._backup_metadata(backup, object_meta)
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    LOG.exception("Backup volume metadata failed.")
+                    self.delete_backup(backup)
+
+        self._finalize_backup(backup, container, object_meta, object_sha256)
+        return True
+
+    def delete_backup(self, backup):
+        """Delete backup and its base snapshot"""
+        super(ZnstorBackupDriver, self).delete_backup(backup)
+        try:
+            source = self._source(backup)
+            if source is not None:
+                client, pool, lu = source
+                self._destroy_snapshot(client, pool, lu, znstor_iscsi.BACKUP_SNAPSHOT_PREFIX + backup.id)
+        except Exception as e:
+            # volume may be deleted already, snapshot is destroyed together with it
+            LOG.warning('ZNSTOR. Snapshot of deleted backup %s is not destroyed. Err: %s', backup.id, e)
+
+    @staticmethod
+    def _destroy_snapshot(client, pool, lu, name):
+        """destroy backup snapshot, it may be gone with its volume or destroyed by driver already"""
+        try:
+            client.volume_destroy_snapshot(pool.project, lu['LUName'], name)
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.debug('ZNSTOR. Backup snapshot %s is not destroyed. Err: %s', name, e)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of driver operations against znstord simulator.
+
+Drives ZNSTORISCSIDriver entry points (create_volume, initialize_connection,
+terminate_connection, delete_volume) at several project sizes and concurrency
+levels and writes ops/sec, latency percentiles and REST calls per operation
+to json file, so results of different releases can be diffed.
+
+Should be run from cinder environment the driver is installed into:
+
+    python -m cinder.volume.drivers.znstor.benchmark \
+        --volumes 100,1000,10000 --concurrency 1,10 --ops 200 --output bench.json
+"""
+
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+
+from oslo_config import cfg
+from cinder.volume import configuration
+from cinder.volume.drivers.znstor import znstiscsi
+from cinder.volume.drivers.znstor import simulator as znstor_simulator
+
+CONF = cfg.CONF
+
+CONFIG_GROUP = 'znstor-benchmark'
+
+# volume populated in project before benchmark is 1GB
+VOLUME_SIZE = 1
+
+DEFAULTS = {
+    'znstor_domain': 'default',
+    'znstor_pool': 'tank',
+    'quota': 1024 * 1024,
+    'compression': 'lz4',
+    'oversubs_ratio': '100',
+    'portal_addr': '127.0.0.1:3260',
+    'portal_iqn': 'iqn.2017-06.znstor.io:01:benchmark',
+}
+
+OPERATIONS = ['create_volume', 'initialize_connection', 'terminate_connection',
+              'delete_volume', 'initialize_connection_legacy']
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    rank = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def make_driver(address, project, overrides=None):
+    """Build driver configured for simulator at address"""
+    config = configuration.Configuration(znstiscsi.OPTS, config_group=CONFIG_GROUP)
+    values = dict(DEFAULTS, management_addr=address, znstor_project=project)
+    values.update(overrides or {})
+    for name, value in values.items():
+        CONF.set_override(name, value, group=CONFIG_GROUP)
+
+    driver = znstiscsi.ZNSTORISCSIDriver(configuration=config)
+    driver.do_setup(None)
+    driver.check_for_setup_error()
+    return driver
+
+
+def connector(index, hosts):
+    host = 'benchmark-host-%d' % (index % hosts)
+    return {'host': host, 'initiator': 'iqn.1994-05.com.redhat:%s' % host}
+
+
+def run_phase(sim, concurrency, items, fn):
+    """Run fn(item) for every item from concurrency threads
+    :return: dict with operation statistics
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    pending = iter(items)
+
+    def worker():
+        while True:
+            with lock:
+                item = next(pending, None)
+            if item is None:
+                return
+            started = time.time()
+            try:
+                fn(item)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            elapsed = time.time() - started
+            with lock:
+                latencies.append(elapsed)
+
+    sim.reset_counters()
+    started = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - started
+    requests = sim.request_count()
+
+    ops = len(latencies) + len(errors)
+    latencies.sort()
+    return {
+        'ops': ops,
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'duration': duration,
+        'ops_per_sec': ops / duration if duration else None,
+        'latency': {
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1] if latencies else None,
+        },
+        'rest_calls': requests,
+        'rest_calls_per_op': float(requests) / ops if ops else None,
+    }
+
+
+def run_case(sim, size, concurrency, ops, hosts, overrides=None):
+    """Benchmark every operation at given project size and concurrency
+    :return: dict operation -> statistics
+    """
+    project = 'benchmark-%d-%d-%s' % (size, concurrency, uuid.uuid4().hex[:8])
+    # project is populated bypassing REST, volumes of previous driver versions
+    # have no provider_id and are looked up by alias
+    legacy = [{'id': entry['Alias'][len('volume-'):], 'name': entry['Alias'], 'size': VOLUME_SIZE}
+              for entry in sim.populate(project, size, volsize=VOLUME_SIZE * 1024 ** 3)]
+    driver = make_driver(sim.address, project, overrides)
+
+    volumes = []
+    for index in range(ops):
+        volume_id = str(uuid.uuid4())
+        volumes.append({'id': volume_id, 'name': 'volume-%s' % volume_id, 'size': VOLUME_SIZE})
+
+    def create(volume):
+        volume.update(driver.create_volume(volume) or {})
+
+    attachments = [(volume, connector(index, hosts)) for index, volume in enumerate(volumes)]
+    legacy_attachments = [(volume, connector(index, hosts))
+                          for index, volume in enumerate(legacy[-ops:])]
+
+    results = {}
+    results['create_volume'] = run_phase(sim, concurrency, volumes, create)
+    results['initialize_connection'] = run_phase(
+        sim, concurrency, attachments, lambda a: driver.initialize_connection(*a))
+    results['terminate_connection'] = run_phase(
+        sim, concurrency, attachments, lambda a: driver.terminate_connection(*a))
+    results['delete_volume'] = run_phase(sim, concurrency, volumes, driver.delete_volume)
+    results['initialize_connection_legacy'] = run_phase(
+        sim, concurrency, legacy_attachments, lambda a: driver.initialize_connection(*a))
+    return results
+
+
+def parse_overrides(values):
+    overrides = {}
+    for value in values or []:
+        name, _, option = value.partition('=')
+        overrides[name.strip()] = option.strip()
+    return overrides
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='znstor driver benchmark')
+    parser.add_argument('--volumes', default='100,1000,10000',
+                        help='comma separated project sizes')
+    parser.add_argument('--concurrency', default='1,10',
+                        help='comma separated numbers of concurrent callers')
+    parser.add_argument('--ops', type=int, default=100,
+                        help='operations of every kind per case')
+    parser.add_argument('--hosts', type=int, default=4,
+                        help='number of distinct hosts volumes are attached to')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='simulated znstord latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.001)
+    parser.add_argument('--job-duration', type=float, default=0.05)
+    parser.add_argument('--option', action='append',
+                        help='driver option override, ex: znstor_async_delete=True')
+    parser.add_argument('--output', default='znstor-benchmark.json')
+    args = parser.parse_args(argv)
+
+    overrides = parse_overrides(args.option)
+    sim = znstor_simulator.Simulator(latency=args.latency, jitter=args.jitter,
+                                     job_duration=args.job_duration).start()
+    report = {
+        'started_at': time.time(),
+        'driver_version': znstiscsi.ZNSTORISCSIDriver.driver_version,
+        'simulator': {'latency': args.latency, 'jitter': args.jitter,
+                      'job_duration': args.job_duration},
+        'options': overrides,
+        'ops': args.ops,
+        'hosts': args.hosts,
+        'results': [],
+    }
+    try:
+        for size in [int(v) for v in args.volumes.split(',')]:
+            for concurrency in [int(v) for v in args.concurrency.split(',')]:
+                results = run_case(sim, size, concurrency, args.ops, args.hosts, overrides)
+                for operation in OPERATIONS:
+                    stat = results[operation]
+                    report['results'].append(dict(stat, operation=operation, volumes=size,
+                                                  concurrency=concurrency))
+                    sys.stdout.write(
+                        '%-30s volumes=%-6d concurrency=%-3d %8.1f ops/s  p50=%.4f p95=%.4f '
+                        'p99=%.4f  calls/op=%.2f errors=%d\n' % (
+                            operation, size, concurrency, stat['ops_per_sec'] or 0,
+                            stat['latency']['p50'] or 0, stat['latency']['p95'] or 0,
+                            stat['latency']['p99'] or 0, stat['rest_calls_per_op'] or 0,
+                            stat['errors']))
+    finally:
+        sim.stop()
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    sys.stdout.write('results are written to %s\n' % args.output)
+
+
+if __name__ == '__main__':
+    main()
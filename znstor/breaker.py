@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Circuit breaker of znstord connection.
+
+After failure_threshold consecutive failures (connection errors, timeouts,
+5xx responses) the circuit opens and requests fail immediately instead of
+waiting for timeouts. After reset_timeout one probe request is let through:
+its success closes the circuit, failure opens it again.
+"""
+
+import sys
+import time
+import logging
+import threading
+
+import requests
+
+LOG = logging.getLogger(__name__)
+out_hdlr = logging.StreamHandler(sys.stdout)
+out_hdlr.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+LOG.addHandler(out_hdlr)
+LOG.setLevel(logging.ERROR)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Request was not sent because daemon is considered unhealthy"""
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        """
+        :param name: name used in logs and errors, usually management address
+        :param failure_threshold: consecutive failures opening the circuit, 0 disables breaker
+        :param reset_timeout: seconds before probe request is let through open circuit
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        # number of times circuit was opened
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before(self):
+        """Check if request may be sent, raise CircuitOpenError otherwise"""
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                LOG.warning('znstord %s: probing after %s seconds', self.name, self.reset_timeout)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        raise CircuitOpenError('znstord %s is unavailable, circuit is %s after %d failures' % (
+            self.name, self.state, self.failures))
+
+    def available(self):
+        """Check if request would be let through"""
+        if not self.failure_threshold:
+            return True
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return time.time() - self.opened_at >= self.reset_timeout
+            return not self._probing
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                LOG.warning('znstord %s is back, closing circuit', self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def cancel(self):
+        """Request let through by before() failed without telling anything about daemon health,
+        the next request may probe the daemon"""
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or \
+                    (self.state == CLOSED and self.failures >= self.failure_threshold):
+                LOG.error('znstord %s failed %d times, opening circuit for %s seconds',
+                          self.name, self.failures, self.reset_timeout)
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.trips += 1
+
+    def status(self):
+        """Breaker state for backend statistics"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'opened_at': self.opened_at,
+                'trips': self.trips,
+            }
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""In-process caches of znstor objects.
+"""
+
+import time
+import threading
+
+
+def volume_lu(volume):
+    """Return logical unit structure of volume object.
+    volume_list returns logical units, while volume_create/volume_get return
+    volume objects with logical unit stored in 'lu' key.
+    :param volume: volume or logical unit object
+    :return: logical unit or None
+    """
+    if not isinstance(volume, dict):
+        return None
+    if 'LUName' in volume:
+        return volume
+    lu = volume.get('lu')
+    if isinstance(lu, dict) and 'LUName' in lu:
+        return lu
+    return None
+
+
+class VolumeIndex(object):
+    """alias -> logical unit index of project volumes.
+    Project listing is loaded at most once per ttl, between reloads the index
+    is kept up to date by volume create/destroy/clone calls. Changes made while
+    listing is being loaded are applied to the loaded listing.
+    """
+
+    def __init__(self, ttl=300):
+        """
+        :param ttl: seconds after which project listing is reloaded.
+        """
+        self.ttl = ttl
+        # project -> [loaded_at, {alias: lu}]
+        self._projects = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        # project -> [(method, argument)] changes made while listing is being loaded,
+        # method None - listing is invalidated
+        self._changes = {}
+
+    def _entry(self, project):
+        entry = self._projects.get(project)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return None
+        return entry
+
+    def _load_lock(self, project):
+        with self._lock:
+            return self._load_locks.setdefault(project, threading.Lock())
+
+    def get(self, project, alias, loader, lookup=None):
+        """Get logical unit by alias
+        :param project: projectID
+        :param alias: volume alias
+        :param loader: callable(project) returning iterable of logical units
+        :param lookup: callable(project, alias) returning logical unit or None,
+        volumes missing in cached listing are looked up with it
+        :return: logical unit or None
+        """
+        entry = self._entry(project)
+        loaded = False
+        if entry is None:
+            # only one greenthread reloads project, others wait for result
+            with self._load_lock(project):
+                entry = self._entry(project)
+                if entry is None:
+                    entry = self._load(project, loader)
+                    loaded = True
+        lu = entry[1].get(alias)
+        if lu is None and lookup is not None and not loaded:
+            # volume may be created by another client since listing was loaded
+            lu = lookup(project, alias)
+            if lu is not None:
+                self.add(project, lu)
+        return lu
+
+    def _load(self, project, loader):
+        started = time.time()
+        with self._lock:
+            changes = self._changes[project] = []
+        try:
+            volumes = dict((lu['Alias'], lu) for lu in loader(project) or [])
+        finally:
+            with self._lock:
+                del self._changes[project]
+        entry = [started, volumes]
+        with self._lock:
+            for method, argument in changes:
+                if method is None:
+                    # listing may miss changes, it serves this lookup only
+                    return entry
+                method(volumes, argument)
+            self._projects[project] = entry
+        return entry
+
+    def _change(self, project, method, argument):
+        """Apply change to cached listing and to listing being loaded, lock is held by caller"""
+        if project in self._changes:
+            self._changes[project].append((method, argument))
+        entry = self._projects.get(project)
+        if entry is None:
+            return
+        if method is None:
+            del self._projects[project]
+            return
+        method(entry[1], argument)
+
+    @staticmethod
+    def _add(volumes, lu):
+        volumes[lu['Alias']] = lu
+
+    @staticmethod
+    def _discard(volumes, lu_name):
+        for alias, lu in list(volumes.items()):
+            if lu['LUName'] == lu_name:
+                del volumes[alias]
+
+    def add(self, project, volume):
+        """Add created volume to index
+        :param project: projectID
+        :param volume: volume or logical unit object
+        """
+        lu = volume_lu(volume)
+        with self._lock:
+            if lu is None or 'Alias' not in lu:
+                # can't index unknown structure, reload listing on next lookup
+                self._change(project, None, None)
+                return
+            self._change(project, self._add, lu)
+
+    def discard(self, project, lu_name):
+        """Remove destroyed volume from index
+        :param project: projectID
+        :param lu_name: logical unit guid
+        """
+        with self._lock:
+            self._change(project, self._discard, lu_name)
+
+    def invalidate(self, project=None):
+        """Drop cached listing
+        :param project: projectID, all projects if None
+        """
+        with self._lock:
+            for name in list(self._projects) + list(self._changes) if project is None else [project]:
+                self._change(name, None, None)
+
+
+class HostgroupCache(object):
+    """hostgroup -> members cache.
+    Loaded once from hostgroup listing and updated by hostgroup calls.
+    """
+
+    def __init__(self):
+        # hostgroup -> set of member IQNs, None if not loaded yet
+        self._groups = None
+        self._lock = threading.Lock()
+
+    def get(self, hostgroup, loader):
+        """Get hostgroup members
+        :param hostgroup: hostgroupID
+        :param loader: callable() returning list of hostgroup objects
+        :return: set of members or None if hostgroup does not exist
+        """
+        if self._groups is None:
+            with self._lock:
+                if self._groups is None:
+                    self._groups = dict((hg['HostGroup'], set(hg.get('Members') or []))
+                                        for hg in loader() or [])
+        members = self._groups.get(hostgroup)
+        return None if members is None else set(members)
+
+    def update(self, hostgroup):
+        """Save hostgroup object returned by znstor"""
+        if self._groups is None:
+            return
+        if not isinstance(hostgroup, dict) or 'HostGroup' not in hostgroup:
+            # unknown structure, reload listing on next lookup
+            self._groups = None
+            return
+        self._groups[hostgroup['HostGroup']] = set(hostgroup.get('Members') or [])
+
+    def discard(self, hostgroup):
+        """Forget hostgroup"""
+        if self._groups is not None:
+            self._groups.pop(hostgroup, None)
+
+    def invalidate(self):
+        """Drop cache, hostgroups will be reloaded on next lookup"""
+        self._groups = None
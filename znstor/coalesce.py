@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Coalescing of concurrent calls made for the same object.
+"""
+
+import time
+import threading
+
+from jobs import Future
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.calls = []
+        self.prepare = None
+
+
+class Coalescer(object):
+    """Groups calls made for the same key within a short window.
+    The first caller of a batch becomes its leader. While another batch of the key
+    is running, it waits for the window to collect concurrent callers, otherwise
+    nothing is waited for. Leader runs prepare once for the whole batch and then
+    runs calls of the batch back-to-back. Every caller gets result of its own call.
+    """
+
+    def __init__(self, window=0.05):
+        """
+        :param window: seconds the leader waits for other callers. 0 disables coalescing.
+        """
+        self.window = window
+        self._batches = {}
+        # key -> number of batches being run
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn, prepare=None):
+        """Run fn in batch of key
+        :param key: batch key
+        :param fn: callable() of this caller
+        :param prepare: callable() run once before calls of the batch.
+        If it fails, every call of the batch fails with its exception.
+        :return: result of fn
+        """
+        if not self.window:
+            if prepare is not None:
+                prepare()
+            return fn()
+
+        future = Future()
+        with self._lock:
+            batch = self._batches.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._batches[key] = _Batch()
+                # lone caller is not delayed
+                busy = key in self._running
+            batch.calls.append((fn, future))
+            if batch.prepare is None:
+                batch.prepare = prepare
+
+        if leader:
+            if busy:
+                time.sleep(self.window)
+            with self._lock:
+                del self._batches[key]
+                self._running[key] = self._running.get(key, 0) + 1
+            try:
+                self._execute(batch)
+            finally:
+                with self._lock:
+                    self._running[key] -= 1
+                    if not self._running[key]:
+                        del self._running[key]
+        return future.result()
+
+    @staticmethod
+    def _execute(batch):
+        if batch.prepare is not None:
+            try:
+                batch.prepare()
+            except Exception as e:
+                for _, future in batch.calls:
+                    future.set_exception(e)
+                return
+
+        for fn, future in batch.calls:
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
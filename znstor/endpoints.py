@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Endpoints of znstord REST API.
+
+Every request made by restapi module is declared here once: method, path
+template relative to one of the base paths, expected status codes and request
+semantics. RestClientURL joins templates with its base paths once per client,
+so a request costs a single str.format of the path arguments.
+"""
+
+from errors import ZnstorObjectNotFound, ZnstorNotSupported
+
+PROJECTS = 'projects'
+HOSTS = 'hosts'
+TARGETS = 'targets'
+
+# status code -> exception raised by failed request, ZnstorBadRequest by default
+ERRORS = {404: ZnstorObjectNotFound}
+
+# endpoints added to znstord later are missing on older daemons
+NEW_ERRORS = {404: ZnstorNotSupported, 405: ZnstorNotSupported, 501: ZnstorNotSupported}
+
+
+class Endpoint(object):
+    """Declaration of znstord endpoint"""
+
+    def __init__(self, name, method, base, path='', ok=(200,), job=False,
+                 idempotent=None, timeout=None, errors=ERRORS):
+        """
+        :param name: endpoint name, usually name of Znstor method using it
+        :param method: HTTP method
+        :param base: base path endpoint belongs to: PROJECTS, HOSTS or TARGETS
+        :param path: path template relative to base path
+        :param ok: status codes of successful response
+        :param job: response is {"message": job uuid} of background job
+        :param idempotent: request may be safely repeated, it is retried on failures.
+        Default is True for GET.
+        :param timeout: read timeout in seconds, None - client default. Reads of single
+        objects and job polls are short, listings and mutations use client default.
+        :param errors: status code -> ZnstorBadRequest subclass raised by failed request
+        """
+        self.name = name
+        self.method = method
+        self.base = base
+        self.path = path
+        self.ok = ok
+        self.job = job
+        self.idempotent = method == 'GET' if idempotent is None else idempotent
+        self.timeout = timeout
+        self.errors = errors
+        # template metrics are accounted under
+        self.template = '/%s%s' % (base, path)
+
+    def __repr__(self):
+        return '<Endpoint %s: %s %s>' % (self.name, self.method, self.template)
+
+
+_VOLUME = '/{project}/volumes/{volume}'
+_SNAPSHOT = _VOLUME + '/snapshots/{snapshot}'
+
+ENDPOINTS = dict((endpoint.name, endpoint) for endpoint in [
+    # projects
+    Endpoint('project_list', 'GET', PROJECTS),
+    Endpoint('project_create', 'POST', PROJECTS, '/{project}'),
+    Endpoint('project_get', 'GET', PROJECTS, '/{project}', timeout=30),
+    Endpoint('project_set', 'PUT', PROJECTS, '/{project}'),
+    Endpoint('project_destroy', 'DELETE', PROJECTS, '/{project}'),
+    Endpoint('project_exists', 'GET', PROJECTS, '/{project}/exists', timeout=30),
+    # volumes
+    Endpoint('volume_list', 'GET', PROJECTS, '/{project}/volumes'),
+    Endpoint('volume_create', 'POST', PROJECTS, '/{project}/volumes'),
+    Endpoint('job_status', 'GET', PROJECTS, '/{project}/volumes/job/{job}', timeout=10),
+    Endpoint('volume_get', 'GET', PROJECTS, _VOLUME, timeout=30),
+    Endpoint('volume_destroy', 'DELETE', PROJECTS, _VOLUME, ok=(202,), job=True),
+    Endpoint('volume_resize', 'PUT', PROJECTS, _VOLUME + '/resize'),
+    Endpoint('volume_compression', 'PUT', PROJECTS, _VOLUME + '/compression/{compression}'),
+    Endpoint('volume_export', 'PUT', PROJECTS, _VOLUME + '/export', timeout=60),
+    Endpoint('volume_unexport', 'PUT', PROJECTS, _VOLUME + '/unexport', timeout=60),
+    Endpoint('volume_exports', 'GET', PROJECTS, _VOLUME + '/exports', timeout=30),
+    # snapshots
+    Endpoint('volume_list_snapshot', 'GET', PROJECTS, _VOLUME + '/snapshots'),
+    Endpoint('volume_create_snapshot', 'POST', PROJECTS, _SNAPSHOT),
+    Endpoint('volume_get_snapshot', 'GET', PROJECTS, _SNAPSHOT, timeout=30),
+    Endpoint('volume_destroy_snapshot', 'DELETE', PROJECTS, _SNAPSHOT, ok=(202,), job=True),
+    Endpoint('volume_create_from_snapshot', 'POST', PROJECTS, _SNAPSHOT + '/clone'),
+    Endpoint('volume_rollback_snapshot', 'PUT', PROJECTS, _SNAPSHOT + '/rollback'),
+    Endpoint('volume_send_snapshot', 'POST', PROJECTS, _SNAPSHOT + '/send', ok=(202,), job=True),
+    Endpoint('volume_diff_snapshot', 'GET', PROJECTS, _SNAPSHOT + '/diff', errors=NEW_ERRORS),
+    # snapshots of several volumes of project taken at once
+    Endpoint('project_create_snapshot', 'POST', PROJECTS, '/{project}/snapshots/{snapshot}',
+             errors=NEW_ERRORS),
+    Endpoint('project_destroy_snapshot', 'DELETE', PROJECTS, '/{project}/snapshots/{snapshot}',
+             ok=(202,), job=True, errors=NEW_ERRORS),
+    # hostgroups
+    Endpoint('hostgroup_list', 'GET', HOSTS),
+    Endpoint('hostgroup_create', 'POST', HOSTS, '/{hostgroup}'),
+    Endpoint('hostgroup_get', 'GET', HOSTS, '/{hostgroup}', timeout=30),
+    Endpoint('hostgroup_delete', 'DELETE', HOSTS, '/{hostgroup}'),
+    Endpoint('hostgroup_add_member', 'PUT', HOSTS, '/{hostgroup}/add/{member}', timeout=30),
+    Endpoint('hostgroup_add_multihost_member', 'PUT', HOSTS, '/{hostgroup}/add/{member}/force'),
+    Endpoint('hostgroup_remove_member', 'PUT', HOSTS, '/{hostgroup}/remove/{member}', timeout=30),
+    # targets
+    Endpoint('targetgroup_list', 'GET', TARGETS, '/tg'),
+    Endpoint('targetgroup_create', 'POST', TARGETS, '/tg/{targetgroup}'),
+    Endpoint('targetgroup_get', 'GET', TARGETS, '/tg/{targetgroup}'),
+    Endpoint('targetgroup_delete', 'DELETE', TARGETS, '/tg/{targetgroup}'),
+    Endpoint('targetgroup_add_member', 'PUT', TARGETS, '/tg/{targetgroup}/add/{member}'),
+    Endpoint('targetgroup_remove_member', 'PUT', TARGETS, '/tg/{targetgroup}/remove/{member}'),
+    Endpoint('targetportgroup_create', 'POST', TARGETS, '/tpg/{tpg}'),
+    Endpoint('targetportgroup_delete', 'DELETE', TARGETS, '/tpg/{tpg}'),
+])
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Errors of znstord requests.
+
+Endpoints map status codes of failed responses to these exceptions, every
+one of them is ZnstorBadRequest, so callers not interested in the reason
+catch just it.
+"""
+
+
+class ZnstorBadRequest(Exception):
+    def __init__(self, object=None, debug=None, payload=None, status=None):
+        self.object = object
+        self.debug = debug
+        self.payload = payload
+        self.status = status
+
+    def __str__(self):
+        return "Bad request. Object %s, Debug: %s, Payload: %s" % (
+            self.object,
+            self.debug,
+            self.payload
+        )
+
+
+class ZnstorObjectNotFound(ZnstorBadRequest):
+    def __str__(self):
+        return "Object not found. Object %s, Debug: %s, Payload: %s" % (
+            self.object,
+            self.debug,
+            self.payload
+        )
+
+
+class ZnstorNotSupported(ZnstorBadRequest):
+    """Endpoint is not implemented by znstord version"""
+
+    def __str__(self):
+        return "Not supported. Object %s, Debug: %s, Payload: %s" % (
+            self.object,
+            self.debug,
+            self.payload
+        )
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Bookkeeping of backend image cache.
+
+Every cached glance image is a volume with alias "image-<image id>" and a
+snapshot named after image checksum; volumes created from the image are
+clones of the snapshot. ImageCache keeps cache entries in LRU order, chooses
+entries to evict and serializes work on the same image.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+ALIAS_PREFIX = 'image-'
+
+
+def image_alias(image_id):
+    """alias of cache volume of image"""
+    return ALIAS_PREFIX + image_id
+
+
+class CacheEntry(object):
+
+    def __init__(self, image_id, lu, size, snapshot=None):
+        """
+        :param image_id: glance image id
+        :param lu: dict with LUName and SerialNum of cache volume
+        :param size: size of cache volume in bytes
+        :param snapshot: name of snapshot volumes are cloned from, None if not known yet
+        """
+        self.image_id = image_id
+        self.lu = lu
+        self.size = size
+        self.snapshot = snapshot
+        self.last_used = 0
+
+    def __repr__(self):
+        return '<CacheEntry %s: %s@%s>' % (self.image_id, self.lu['LUName'], self.snapshot)
+
+
+class ImageCache(object):
+    """LRU set of cached images bounded by count and capacity"""
+
+    def __init__(self, max_count=10, max_size=None):
+        """
+        :param max_count: max number of cached images, 0 - unlimited
+        :param max_size: max total size of cache volumes in bytes, None - unlimited
+        """
+        self.max_count = max_count
+        self.max_size = max_size
+        # image id -> CacheEntry, least recently used first
+        self._entries = OrderedDict()
+        # image id -> lock held while image is filled, cloned or evicted
+        self._image_locks = {}
+        self._lock = threading.Lock()
+
+    def lock(self, image_id):
+        """Return lock of image"""
+        with self._lock:
+            lock = self._image_locks.get(image_id)
+            if lock is None:
+                lock = self._image_locks[image_id] = threading.Lock()
+            return lock
+
+    def load(self, entries):
+        """Add entries found on backend, they are considered least recently used"""
+        with self._lock:
+            loaded = [(entry.image_id, entry) for entry in entries if entry.image_id not in self._entries]
+            self._entries = OrderedDict(loaded + list(self._entries.items()))
+
+    def get(self, image_id):
+        """Return entry of image and mark it as recently used"""
+        with self._lock:
+            entry = self._entries.pop(image_id, None)
+            if entry is not None:
+                entry.last_used = time.time()
+                self._entries[image_id] = entry
+            return entry
+
+    def put(self, entry):
+        with self._lock:
+            self._entries.pop(entry.image_id, None)
+            entry.last_used = time.time()
+            self._entries[entry.image_id] = entry
+
+    def remove(self, image_id):
+        with self._lock:
+            self._entries.pop(image_id, None)
+
+    def entries(self):
+        """Return entries, least recently used first"""
+        with self._lock:
+            return list(self._entries.values())
+
+    def victims(self, size, busy=()):
+        """Return least recently used entries to evict before image of size is added.
+        :param size: size of new cache volume in bytes
+        :param busy: ids of images which can not be evicted now
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+        count = len(entries) + 1
+        total = sum(entry.size for entry in entries) + size
+        victims = []
+        for entry in entries:
+            over_count = self.max_count and count > self.max_count
+            over_size = self.max_size is not None and total > self.max_size
+            if not over_count and not over_size:
+                break
+            if entry.image_id in busy:
+                continue
+            victims.append(entry)
+            count -= 1
+            total -= entry.size
+        return victims
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""Tracking of asynchronous znstor jobs.
+
+Volume and snapshot destroy are executed by znstord in background. Daemon
+replies 202 with job uuid which should be polled until job is finished.
+"""
+
+import sys
+import time
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+LOG = logging.getLogger(__name__)
+out_hdlr = logging.StreamHandler(sys.stdout)
+out_hdlr.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+LOG.addHandler(out_hdlr)
+LOG.setLevel(logging.ERROR)
+
+
+class Future(object):
+    """Result of operation which will be available later"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """Wait for operation and return its result
+        :param timeout: seconds to wait, None - wait forever
+        :return: operation result, exception is raised if operation failed
+        """
+        if not self._event.wait(timeout):
+            raise RuntimeError('timed out waiting for result')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """Wait for operation and return exception raised by it or None"""
+        if not self._event.wait(timeout):
+            raise RuntimeError('timed out waiting for result')
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """Call fn(future) when operation is finished.
+        If operation is already finished fn is called immediately.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        self._call(fn)
+
+    def _call(self, fn):
+        try:
+            fn(self)
+        except Exception:
+            LOG.exception('future callback %s failed', fn)
+
+    def _finish(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            self._dispatch(fn)
+
+    def _dispatch(self, fn):
+        """Run callback of finished future, in the thread which finished it by default"""
+        self._call(fn)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+
+
+class JobFuture(Future):
+    """Future of znstor job. Result is the final job status message"""
+
+    def __init__(self, project, job, deadline, object=None, dispatch=None, node=None):
+        super(JobFuture, self).__init__()
+        self.project = project
+        self.job = job
+        # management address of node which accepted the job, jobs are known only to it
+        self.node = node
+        # object job is running for
+        self.object = object
+        self.deadline = deadline
+        # callable(future, fn) running callbacks outside of polling thread
+        self.dispatcher = dispatch
+        self.submitted = time.time()
+        self.status = None
+        # job is still in progress when deadline has been reached
+        self.expired = False
+
+    def __repr__(self):
+        return '<JobFuture %s/%s: %s>' % (self.project, self.job, self.status)
+
+    def _dispatch(self, fn):
+        if self.dispatcher is None:
+            self._call(fn)
+        else:
+            self.dispatcher(self, fn)
+
+
+class JobTracker(object):
+    """Polls outstanding znstor jobs from a single background thread.
+    Every job is polled with its own exponential backoff starting from
+    min_interval, so short jobs are noticed within tens of milliseconds while
+    long ones do not flood the daemon. All jobs due in a cycle are polled
+    back-to-back over the same keep-alive session. Callbacks of finished jobs
+    are run by a separate thread, so a callback may wait for another job.
+    """
+
+    def __init__(self, poll, completed, inprogress, **kwargs):
+        """
+        :param poll: callable(project, job, node) returning job status message,
+        node is management address which accepted the job or None
+        :param completed: status of successfully finished job
+        :param inprogress: status of running job
+        :key min_interval: first poll delay in seconds. Default is 0.05.
+        :key max_interval: max poll delay in seconds. Default is 2.
+        :key timeout: give up polling job after this number of seconds. Default is 60.
+        """
+        self.poll = poll
+        self.completed = completed
+        self.inprogress = inprogress
+        self.min_interval = kwargs.get('min_interval', 0.05)
+        self.max_interval = kwargs.get('max_interval', 2)
+        self.timeout = kwargs.get('timeout', 60)
+
+        # job future -> [next poll time, current interval]
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        # (future, fn) of finished jobs
+        self._callbacks = queue.Queue()
+        self._callback_thread = None
+
+    def submit(self, project, job, timeout=None, object=None, node=None):
+        """Start tracking job
+        :param project: projectID job belongs to
+        :param job: job uuid
+        :param timeout: override default job timeout
+        :param object: object job is running for, used in errors
+        :param node: management address which accepted the job, job is polled there
+        :return: JobFuture
+        """
+        now = time.time()
+        future = JobFuture(project, job, now + (timeout or self.timeout), object,
+                           dispatch=self._dispatch, node=node)
+        with self._cond:
+            self._jobs[future] = [now + self.min_interval, self.min_interval]
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='znstor-jobs')
+                self._thread.daemon = True
+                self._thread.start()
+            if self._callback_thread is None or not self._callback_thread.is_alive():
+                self._callback_thread = threading.Thread(target=self._run_callbacks,
+                                                         name='znstor-job-callbacks')
+                self._callback_thread.daemon = True
+                self._callback_thread.start()
+            self._cond.notify()
+        return future
+
+    def _dispatch(self, future, fn):
+        self._callbacks.put((future, fn))
+
+    def _run_callbacks(self):
+        while True:
+            future, fn = self._callbacks.get()
+            future._call(fn)
+
+    def pending(self):
+        """Return list of jobs which are not finished yet"""
+        with self._cond:
+            return list(self._jobs)
+
+    def _due(self):
+        """Wait until at least one job should be polled and return due jobs"""
+        with self._cond:
+            while True:
+                if not self._jobs:
+                    self._cond.wait()
+                    continue
+                now = time.time()
+                due = [job for job, sched in self._jobs.items() if sched[0] <= now]
+                if due:
+                    return due
+                self._cond.wait(min(sched[0] for sched in self._jobs.values()) - now)
+
+    def _done(self, future):
+        with self._cond:
+            self._jobs.pop(future, None)
+
+    def _run(self):
+        while True:
+            for future in self._due():
+                try:
+                    status = self.poll(future.project, future.job, future.node)
+                except Exception as e:
+                    self._done(future)
+                    future.set_exception(e)
+                    continue
+
+                future.status = status
+                now = time.time()
+                if status == self.inprogress and now < future.deadline:
+                    with self._cond:
+                        sched = self._jobs[future]
+                        sched[1] = min(sched[1] * 2, self.max_interval)
+                        sched[0] = now + sched[1]
+                    continue
+
+                if status == self.inprogress:
+                    LOG.warning('job %s/%s still in progress after %d seconds',
+                                future.project, future.job, now - future.submitted)
+                    future.expired = True
+                self._done(future)
+                future.set_result(status)
+
+
+class DeleteReaper(object):
+    """Confirms completion of destroy jobs nobody waits for.
+    Failed jobs are reissued up to retries times, jobs which are still in
+    progress after tracker timeout are reported and watched again.
+    """
+
+    def __init__(self, tracker, retries=3):
+        """
+        :param tracker: JobTracker destroy jobs are submitted to
+        :param retries: number of times failed or stuck destroy is retried
+        """
+        self.tracker = tracker
+        self.retries = retries
+        # key -> [future, size in bytes]
+        self._pending = {}
+        # notified when destroy is finished
+        self._cond = threading.Condition()
+
+    def track(self, key, future, retry, size=0, attempt=0):
+        """Watch destroy job
+        :param key: unique name of object being destroyed
+        :param future: JobFuture of destroy job
+        :param retry: callable reissuing destroy and returning new JobFuture
+        :param size: space in bytes which will be freed by destroy
+        :param attempt: number of previous attempts
+        """
+        with self._cond:
+            self._pending[key] = [future, size]
+        future.add_done_callback(
+            lambda f: self._finished(key, f, retry, size, attempt))
+
+    def _finished(self, key, future, retry, size, attempt):
+        exc = future.exception()
+        if exc is None and future.status == self.tracker.completed:
+            LOG.debug('destroy of %s completed', key)
+            self._forget(key)
+            return
+
+        if attempt >= self.retries:
+            LOG.error('destroy of %s is not completed after %d attempts, giving up. '
+                      'Status: %s, Err: %s', key, attempt + 1, future.status, exc)
+            self._forget(key)
+            return
+
+        try:
+            if exc is None and future.expired:
+                LOG.error('destroy of %s is stuck in job %s, keep watching',
+                          key, future.job)
+                new_future = self.tracker.submit(future.project, future.job, object=future.object,
+                                                 node=future.node)
+            else:
+                LOG.warning('destroy of %s failed, retrying. Status: %s, Err: %s',
+                            key, future.status, exc)
+                new_future = retry()
+        except Exception as e:
+            LOG.error('destroy of %s failed, giving up. Err: %s', key, e)
+            self._forget(key)
+            return
+        self.track(key, new_future, retry, size, attempt + 1)
+
+    def _forget(self, key):
+        with self._cond:
+            self._pending.pop(key, None)
+            self._cond.notify_all()
+
+    def wait(self, prefix, timeout=None):
+        """Wait for pending destroys of objects which key starts with prefix,
+        retried destroys are waited for too
+        :param timeout: seconds to wait, None - wait forever
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while any(key.startswith(prefix) for key in self._pending):
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                self._cond.wait(remaining)
+
+    def pending(self):
+        """Return number of pending destroys and space in bytes they will free"""
+        with self._cond:
+            return len(self._pending), sum(size for _, size in self._pending.values())
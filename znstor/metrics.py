@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""Instrumentation of requests made to znstor daemon.
+
+Every request is accounted under its endpoint: request method and URL template,
+ex: "PUT /projects/{project}/volumes/{volume}/export". Latency histogram, bytes
+sent/received, status codes and number of requests in flight are kept in memory
+and optionally forwarded to statsd or written to prometheus textfile.
+"""
+
+import os
+import re
+import sys
+import time
+import socket
+import logging
+import threading
+
+LOG = logging.getLogger(__name__)
+out_hdlr = logging.StreamHandler(sys.stdout)
+out_hdlr.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+LOG.addHandler(out_hdlr)
+LOG.setLevel(logging.ERROR)
+
+# upper bounds of latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 180)
+
+# status of request failed without response
+STATUS_ERROR = 'error'
+
+# (pattern, replacement) turning request url into endpoint template
+_TEMPLATE_RULES = [
+    (re.compile(r'^([a-z]+://[^/]+)?/api/[^/]+/storage(/domains/[^/]+/pools/[^/]+)?'), ''),
+    (re.compile(r'/projects/[^/]+'), '/projects/{project}'),
+    (re.compile(r'/volumes/job/[^/]+'), '/volumes/job/{job}'),
+    (re.compile(r'/volumes/(?!job/)[^/]+'), '/volumes/{volume}'),
+    (re.compile(r'/snapshots/[^/]+'), '/snapshots/{snapshot}'),
+    (re.compile(r'/compression/[^/]+'), '/compression/{compression}'),
+    (re.compile(r'^/hosts/[^/]+'), '/hosts/{hostgroup}'),
+    (re.compile(r'^/targets/tg/[^/]+'), '/targets/tg/{targetgroup}'),
+    (re.compile(r'^/targets/tpg/[^/]+'), '/targets/tpg/{tpg}'),
+    (re.compile(r'/(add|remove)/[^/]+'), r'/\1/{member}'),
+]
+
+
+def url_template(url):
+    """Return endpoint template of request url"""
+    path = url.split('?', 1)[0]
+    for pattern, replacement in _TEMPLATE_RULES:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+class Histogram(object):
+    """Latency histogram with fixed buckets"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, pct):
+        """Estimate percentile as upper bound of bucket containing it"""
+        if not self.count:
+            return None
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'buckets': list(zip(self.bounds + ('+Inf',), self.counts)),
+        }
+
+
+class _Endpoint(object):
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.status = {}
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.inflight = 0
+
+    def snapshot(self):
+        errors = sum(count for status, count in self.status.items()
+                     if status == STATUS_ERROR or status >= 400)
+        return {
+            'latency': self.latency.snapshot(),
+            'status': dict((str(status), count) for status, count in self.status.items()),
+            'errors': errors,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'inflight': self.inflight,
+        }
+
+
+class Metrics(object):
+    """In-memory request metrics with optional sinks"""
+
+    def __init__(self, sinks=None):
+        """
+        :param sinks: list of sinks, every sink has observe(endpoint, status, elapsed,
+        bytes_out, bytes_in, inflight) and flush(metrics) methods
+        """
+        self.sinks = list(sinks or [])
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint):
+        stat = self._endpoints.get(endpoint)
+        if stat is None:
+            stat = self._endpoints[endpoint] = _Endpoint()
+        return stat
+
+    def start(self, endpoint):
+        """Account request in flight"""
+        with self._lock:
+            stat = self._endpoint(endpoint)
+            stat.inflight += 1
+
+    def finish(self, endpoint, status, elapsed, bytes_out=0, bytes_in=0):
+        """Account finished request
+        :param endpoint: "METHOD template"
+        :param status: http status code or STATUS_ERROR
+        :param elapsed: seconds
+        """
+        with self._lock:
+            stat = self._endpoint(endpoint)
+            stat.inflight -= 1
+            stat.latency.observe(elapsed)
+            stat.status[status] = stat.status.get(status, 0) + 1
+            stat.bytes_out += bytes_out
+            stat.bytes_in += bytes_in
+            inflight = stat.inflight
+        for sink in self.sinks:
+            try:
+                sink.observe(endpoint, status, elapsed, bytes_out, bytes_in, inflight)
+                sink.flush(self)
+            except Exception as e:
+                LOG.error('metrics sink %s failed. Err: %s', sink, e)
+
+    def snapshot(self):
+        """Return dict endpoint -> statistics"""
+        with self._lock:
+            return dict((endpoint, stat.snapshot()) for endpoint, stat in self._endpoints.items())
+
+    def summary(self, top=5):
+        """Short summary for backend statistics: totals and endpoints
+        which took most of the time"""
+        endpoints = self.snapshot()
+        ranked = sorted(endpoints.items(), key=lambda item: item[1]['latency']['sum'], reverse=True)
+        return {
+            'requests': sum(stat['latency']['count'] for stat in endpoints.values()),
+            'errors': sum(stat['errors'] for stat in endpoints.values()),
+            'inflight': sum(stat['inflight'] for stat in endpoints.values()),
+            'top': [{
+                'endpoint': endpoint,
+                'count': stat['latency']['count'],
+                'errors': stat['errors'],
+                'total': stat['latency']['sum'],
+                'mean': stat['latency']['mean'],
+                'p95': stat['latency']['p95'],
+            } for endpoint, stat in ranked[:top]],
+        }
+
+
+class StatsdSink(object):
+    """Sends every request to statsd over UDP"""
+
+    def __init__(self, address='127.0.0.1:8125', prefix='znstor'):
+        host, _, port = address.rpartition(':')
+        self.address = (host or '127.0.0.1', int(port))
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    @staticmethod
+    def _name(endpoint):
+        return re.sub(r'[^A-Za-z0-9_]+', '_', endpoint.replace('/', '.')).strip('_.')
+
+    def observe(self, endpoint, status, elapsed, bytes_out, bytes_in, inflight):
+        name = '%s.%s' % (self.prefix, self._name(endpoint))
+        packet = '\n'.join([
+            '%s.latency:%.3f|ms' % (name, elapsed * 1000),
+            '%s.status.%s:1|c' % (name, status),
+            '%s.bytes_out:%d|c' % (name, bytes_out),
+            '%s.bytes_in:%d|c' % (name, bytes_in),
+            '%s.inflight:%d|g' % (name, inflight),
+        ])
+        self._socket.sendto(packet.encode('utf-8'), self.address)
+
+    def flush(self, metrics):
+        pass
+
+
+class PrometheusTextfileSink(object):
+    """Writes metrics in prometheus text format for node_exporter textfile collector"""
+
+    # (family, type, help) in order of rendering
+    FAMILIES = [
+        ('znstor_request_duration_seconds', 'histogram', 'Latency of znstord requests.'),
+        ('znstor_requests_total', 'counter', 'Finished znstord requests by response status.'),
+        ('znstor_request_bytes_total', 'counter', 'Bytes of request bodies sent to znstord.'),
+        ('znstor_response_bytes_total', 'counter', 'Bytes of response bodies received from znstord.'),
+        ('znstor_requests_in_flight', 'gauge', 'Requests to znstord waiting for response.'),
+    ]
+
+    def __init__(self, path, interval=15):
+        """
+        :param path: file to write, replaced atomically
+        :param interval: write at most once per this number of seconds
+        """
+        self.path = path
+        self.interval = interval
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, status, elapsed, bytes_out, bytes_in, inflight):
+        pass
+
+    @staticmethod
+    def _labels(endpoint, **extra):
+        method, _, template = endpoint.partition(' ')
+        labels = [('method', method), ('endpoint', template)] + sorted(extra.items())
+        return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in labels)
+
+    def render(self, metrics):
+        # family -> sample lines, every family is rendered as one block
+        samples = dict((family, []) for family, _, _ in self.FAMILIES)
+        for endpoint, stat in sorted(metrics.snapshot().items()):
+            latency = stat['latency']
+            duration = samples['znstor_request_duration_seconds']
+            cumulative = 0
+            for bound, count in latency['buckets']:
+                cumulative += count
+                duration.append('znstor_request_duration_seconds_bucket%s %d' % (
+                    self._labels(endpoint, le=bound), cumulative))
+            duration.append('znstor_request_duration_seconds_sum%s %f' % (
+                self._labels(endpoint), latency['sum']))
+            duration.append('znstor_request_duration_seconds_count%s %d' % (
+                self._labels(endpoint), latency['count']))
+            for status, count in sorted(stat['status'].items()):
+                samples['znstor_requests_total'].append('znstor_requests_total%s %d' % (
+                    self._labels(endpoint, status=status), count))
+            samples['znstor_request_bytes_total'].append('znstor_request_bytes_total%s %d' % (
+                self._labels(endpoint), stat['bytes_out']))
+            samples['znstor_response_bytes_total'].append('znstor_response_bytes_total%s %d' % (
+                self._labels(endpoint), stat['bytes_in']))
+            samples['znstor_requests_in_flight'].append('znstor_requests_in_flight%s %d' % (
+                self._labels(endpoint), stat['inflight']))
+
+        lines = []
+        for family, kind, text in self.FAMILIES:
+            lines.append('# HELP %s %s' % (family, text))
+            lines.append('# TYPE %s %s' % (family, kind))
+            lines.extend(samples[family])
+        return '\n'.join(lines) + '\n'
+
+    def flush(self, metrics, force=False):
+        now = time.time()
+        with self._lock:
+            if not force and now - self._written < self.interval:
+                return
+            self._written = now
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.render(metrics))
+        os.rename(tmp, self.path)
+
+
+def make_sinks(statsd_address=None, prometheus_textfile=None):
+    """Build sinks from driver configuration"""
+    sinks = []
+    if statsd_address:
+        sinks.append(StatsdSink(statsd_address))
+    if prometheus_textfile:
+        sinks.append(PrometheusTextfileSink(prometheus_textfile))
+    return sinks
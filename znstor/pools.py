@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Cinder pools of znstor backend.
+
+Every configured project is reported to cinder as its own pool. Project is
+given as "project" (located in the default zpool) or "zpool/project"; the
+configured string is the cinder pool name, so volumes of single project
+backends keep their pool when more projects are added.
+"""
+
+
+class Pool(object):
+    """znstor project reported as cinder pool"""
+
+    def __init__(self, name, zpool, project):
+        """
+        :param name: cinder pool name
+        :param zpool: zpool id project is located in
+        :param project: project id
+        """
+        self.name = name
+        self.zpool = zpool
+        self.project = project
+        # set up by driver: Znstor client of zpool, DeleteReaper and ImageCache of project
+        self.storage = None
+        self.reaper = None
+        self.image_cache = None
+
+    def __repr__(self):
+        return '<Pool %s: %s/%s>' % (self.name, self.zpool, self.project)
+
+
+def parse_pools(projects, default_zpool):
+    """Parse list of configured projects
+    :param projects: list of "project" or "zpool/project"
+    :param default_zpool: zpool of projects given without zpool
+    :return: list of Pool in configured order
+    """
+    pools = []
+    names = set()
+    for entry in projects:
+        entry = entry.strip()
+        if not entry:
+            continue
+        zpool, _, project = entry.rpartition('/')
+        if not project:
+            raise ValueError('invalid project %r' % entry)
+        if entry in names:
+            raise ValueError('project %r is listed twice' % entry)
+        names.add(entry)
+        pools.append(Pool(entry, zpool or default_zpool, project))
+    return pools
@@ -1,37 +1,42 @@
 # -*- coding: utf-8 -*-
 """Module restapi - implement simple interface to communicate with znstor daemon.
 """
-from restclient import RestClientURL
-import time
+from restclient import RestClientURL, iter_json_array, iter_extents
+from cache import VolumeIndex, HostgroupCache, volume_lu
+from jobs import JobTracker
+from endpoints import ENDPOINTS
+# exceptions are used by callers as restapi.Znstor*
+from errors import ZnstorBadRequest, ZnstorObjectNotFound, ZnstorNotSupported
 # TODO: replace pointer to array in GO
 
 
-class ZnstorObjectNotFound(Exception):
-    def __init__(self, object=None, debug=None, payload=None):
-        self.object = object
-        self.debug = debug
-        self.payload = payload
-
-    def __str__(self):
-        return "Object not found. Object %s, Debug: %s, Payload: %s" % (
-            self.object,
-            self.debug,
-            self.payload
-        )
-
-
-class ZnstorBadRequest(Exception):
-    def __init__(self, object=None, debug=None, payload=None):
-        self.object = object
-        self.debug = debug
-        self.payload = payload
-
-    def __str__(self):
-        return "Bad request. Object %s, Debug: %s, Payload: %s" % (
-            self.object,
-            self.debug,
-            self.payload
-        )
+def find_view(exports, hostgroup, targetgroup):
+    """
+    Find view of volume exported to hostgroup through targetgroup
+    :param exports: list of views or volume object with views
+    :param hostgroup: hostgroup name
+    :param targetgroup: targetgroup name
+    :return: view or None
+    """
+    if isinstance(exports, dict):
+        exports = exports.get('views')
+    if not isinstance(exports, list):
+        return None
+    for view in exports:
+        if view.get('HostGroup') == hostgroup and view.get('TargetGroup') == targetgroup:
+            return view
+    return None
+
+
+def snapshot_name(snapshot):
+    """
+    Name of snapshot
+    :param snapshot: snapshot object
+    :return: snapshot name or None
+    """
+    if 'name' in snapshot:
+        return snapshot['name']
+    return snapshot.get('dataset', '').rpartition('@')[2] or None
 
 
 class Znstor(object):
@@ -41,89 +46,124 @@ class Znstor(object):
 
     def __init__(self, **kwargs):
         """
-        :key management_address: Storage management interface (ip or dns)
+        :key management_address: Storage management interface (ip or dns), comma separated list
+        of cluster node addresses is allowed
         :key api_version: Storage RestApi version (only v1 supported)
         :key pool: zpoolID
         :key domain: znstor domainID, actually is first level dataset in pool.
-        :key timeout: request timeout. Default is 180 seconds.
+        :key timeout: read timeout of request, overridden by endpoint timeout. Default is 180 seconds.
+        :key connect_timeout: connect timeout of request. Default is 5 seconds.
+        :key failover_connect_timeout: connect timeout with several management addresses. Default is 0.5.
+        :key retries: number of times failed idempotent request is retried. Default is 3.
+        :key breaker_threshold: consecutive failures making client fail fast. Default is 5.
+        :key breaker_reset: seconds before failing client probes daemon again. Default is 30.
         :key user: znstor user
         :key passwd: znstor password
+        :key pool_size: keep-alive connection pool size. Default is 10.
+        :key idle_timeout: drop pooled connections idle for this number of seconds.
+        :key index_ttl: reload alias index of project volumes after this number of seconds.
+        Default is 300 seconds, 0 disables index.
+        :key job_timeout: wait for destroy job for this number of seconds. Default is 60 seconds.
+        :key page_size: number of volumes requested at once by volume_iter. Default is 500.
         """
         self.rest = RestClientURL(**kwargs)
+        self.page_size = kwargs.get('page_size', 500)
+        self.volumes = VolumeIndex(kwargs.get('index_ttl', 300))
+        self.hostgroups = HostgroupCache()
+        self.jobs = JobTracker(self.job_status, self.job_completed, self.job_inprogress,
+                               timeout=kwargs.get('job_timeout', 60))
+
+    def _call(self, name, body=None, params=None, stream=False, job_timeout=None, node=None, **kwargs):
+        """
+        Make request to endpoint
+        :param name: endpoint name, see endpoints.ENDPOINTS
+        :param body: request body
+        :param params: query string parameters
+        :param stream: do not read response body. Response must be closed by caller.
+        :param job_timeout: seconds to track job started by request, None - tracker default
+        :param node: management address request is pinned to, None - chosen by client
+        :param kwargs: path arguments of endpoint
+        :return: response or JobFuture if endpoint starts background job
+        """
+        endpoint = ENDPOINTS[name]
+        url = self.rest.url(endpoint, **kwargs)
+        result = self.rest.request(url, endpoint.method, body, params=params, stream=stream,
+                                   template=endpoint.template, timeout=endpoint.timeout,
+                                   idempotent=endpoint.idempotent, node=node)
+
+        if result.status_code not in endpoint.ok:
+            error = endpoint.errors.get(result.status_code, ZnstorBadRequest)
+            try:
+                raise error(object=url, payload=body or params, debug=result.text,
+                            status=result.status_code)
+            finally:
+                result.close()
+        if endpoint.job:
+            # job exists only on the node which accepted it
+            return self.jobs.submit(kwargs['project'], result.json()['message'],
+                                    timeout=job_timeout, object=url,
+                                    node=getattr(result, 'node', None))
+        return result
+
+    def job_status(self, project, job, node=None):
+        """
+        Get status of background job
+        :param project: projectID
+        :param job: job uuid
+        :param node: management address which accepted the job, see JobFuture.node
+        :return: job status message
+        """
+        return self._call('job_status', node=node, project=project, job=job).json()['message']
+
+    def job_progress(self, project, job, node=None):
+        """
+        Get progress of background job
+        :param project: project ID
+        :param job: job uuid
+        :param node: management address which accepted the job, see JobFuture.node
+        :return: dict with bytes and total of transferred data, empty if job does not report it
+        """
+        return self._call('job_status', node=node, project=project,
+                          job=job).json().get('progress') or {}
+
+    def job_wait(self, future, object=None):
+        """
+        Wait until job is finished.
+        Job which is still in progress after job_timeout is considered as successful.
+        :param future: JobFuture returned by JobTracker
+        :param object: object name for exception
+        """
+        status = future.result()
+        if status != self.job_completed and status != self.job_inprogress:
+            raise ZnstorBadRequest(object=object or future.object, debug=status)
 
     def project_create(self, project, **kwargs):
         """
         :param project: Project name to create
         :return: Created project structure
         """
-        result = self.rest.post(
-            "{base_path}/{project_name}".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project
-            ), kwargs
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(object="{base_path}/{project_name}".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project
-                ),
-                debug=result.text
-            )
+        return self._call('project_create', kwargs, project=project).json()
 
     def project_destroy(self, project):
         """
         :param project: Project name to destroy
         :return: None in case of operation completed successfully and raise exception in case of failed 
         """
-        result = self.rest.delete(
-            "{base_path}/{project_name}".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project
-            ),
-        )
-
-        if result.status_code != 200:
-            raise ZnstorBadRequest(object="{base_path}/{project_name}".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project
-                ),
-                debug=result.text
-            )
+        self._call('project_destroy', project=project)
+        self.volumes.invalidate(project)
 
     def project_list(self):
         """
         :return: project list in case of completed successfully and raise exception in case of failed 
         """
-        result = self.rest.get(self.rest.projects_base_path())
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(object=self.rest.projects_base_path(), debug=result.text)
+        return self._call('project_list').json()
 
     def project_get(self, project):
         """
         :param: project_name: project name
         :return: project list in case of completed successfully and raise exception in case of failed 
         """
-        result = self.rest.get(
-            "{base_path}/{project_name}".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project
-            )
-        )
-
-        if result.status_code != 200:
-            raise ZnstorBadRequest("{base_path}/{project_name}".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project
-                ),
-                debug=result.text
-            )
-        return result.json()
+        return self._call('project_get', project=project).json()
 
     def project_set(self, project, **kwargs):
         """
@@ -139,42 +179,18 @@ class Znstor(object):
         :key: atime: enable/disable access time. [on|off]
         :return: project structure
         """
-        result = self.rest.put(
-            "{base_path}/{project_name}".format(
-                base_path=self.rest.projects_base_path(),
-                project_name = project
-            ),
-            kwargs
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name = project
-                ),
-                debug=result.text,
-                payload=kwargs
-            )
+        return self._call('project_set', kwargs, project=project).json()
 
     def project_exists(self, project):
         """Check if project exists
         :param: project_name: project name to check
         :return: boolean
         """
-        result = self.rest.get(
-            "{base_path}/{project_name}/exists".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project
-            )
-        )
-
-        if result.status_code == 200:
-            return True
-        else:
+        try:
+            self._call('project_exists', project=project)
+        except ZnstorBadRequest:
             return False
+        return True
 
     def volume_create(self, project, **kwargs):
         """
@@ -189,74 +205,26 @@ class Znstor(object):
         :key: thin: create thin volume
         :return: volume object
         """
-        result = self.rest.post(
-            "{base_path}/{project_name}/volumes".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project
-            ), kwargs
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(object= "{base_path}/{project_name}/volumes".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project
-            ),
-                payload=kwargs,
-                debug=result.text
-            )
+        volume = self._call('volume_create', kwargs, project=project).json()
+        self.volumes.add(project, volume)
+        return volume
 
-    def volume_destroy(self, project, volume):
+    def volume_destroy(self, project, volume, wait=True):
         """
         :param project: projectID
         :param volume: volumeID
-        :return: 
-        """
-        result = self.rest.delete(
-            "{base_path}/{project_name}/volumes/{volume_name}".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume
-            )
-        )
-
-        if result.status_code == 202:
-            retry_count = 60
-            time_to_sleep = 1
-            # We observe the change of status for 30 seconds
-            # if it still "in progress" or "completed" We assume that the operation was successfully completed
-            for x in xrange(retry_count):
-                time.sleep(time_to_sleep)
-                job_uuid = result.json()['message']
-                job_result = self.rest.get(
-                    "{base_path}/{project_name}/volumes/job/{uuid}".format(
-                        base_path=self.rest.projects_base_path(),
-                        project_name=project,
-                        uuid = job_uuid,
-                    )
-                )
-                job_status = job_result.json()['message']
-                if job_status == self.job_completed:
-                    return
-                if job_status != self.job_completed and job_status != self.job_inprogress:
-                    raise ZnstorBadRequest(
-                        object="{base_path}/{project_name}/volumes/{volume_name}".format(
-                            base_path=self.rest.projects_base_path(),
-                            project_name=project,
-                            volume_name=volume
-                        ),
-                        debug=result.text
-                    )
-        else:
-           raise ZnstorBadRequest(
-               object="{base_path}/{project_name}/volumes/{volume_name}".format(
-                   base_path=self.rest.projects_base_path(),
-                   project_name=project,
-                   volume_name=volume
-               ),
-               debug=result.text
-           )
+        :param wait: wait until destroy job is finished
+        :return: None or JobFuture of destroy job if wait is False
+        """
+        job = self._call('volume_destroy', project=project, volume=volume)
+        if not wait:
+            job.add_done_callback(
+                lambda f: f.status == self.job_completed and self.volumes.discard(project, volume))
+            return job
+        # if job is still "in progress" after job_timeout
+        # We assume that the operation was successfully completed
+        self.job_wait(job)
+        self.volumes.discard(project, volume)
 
     def volume_list(self, project):
         """
@@ -264,23 +232,65 @@ class Znstor(object):
         :param project: list all volumes within a project 
         :return: volumes array
         """
-        result = self.rest.get(
-            "{base_path}/{project_name}/volumes".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-            )
-        )
+        return self._call('volume_list', project=project).json()
 
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project,
-                ),
-                debug=result.text
-            )
+    def volume_iter(self, project, alias=None, page_size=None):
+        """
+        Iterate over project volumes.
+        Volumes are requested by pages with offset/limit query parameters and decoded
+        from response stream one by one, so the whole listing is never kept in memory.
+        Daemon which does not support paging or filtering returns whole listing,
+        which is handled as a single page and filtered on client side.
+        :param project: projectID
+        :param alias: yield only volume with this alias
+        :param page_size: number of volumes per request
+        :return: generator of volumes
+        """
+        limit = page_size or self.page_size
+        offset = 0
+        first = None
+        while True:
+            params = {'offset': offset, 'limit': limit}
+            if alias is not None:
+                params['alias'] = alias
+
+            result = self._call('volume_list', params=params, stream=True, project=project)
+            try:
+                count = 0
+                for vol in iter_json_array(result):
+                    if count == 0:
+                        if offset and vol['LUName'] == first:
+                            # offset is ignored, the listing was already returned
+                            return
+                        first = first or vol['LUName']
+                    count += 1
+                    if alias is None or vol['Alias'] == alias:
+                        yield vol
+            finally:
+                result.close()
+
+            # last page or paging is not supported
+            if count != limit:
+                return
+            offset += limit
+
+    def volume_count(self, project):
+        """
+        Get number of volumes in project
+        :param project: projectID
+        :return: volumes count
+        """
+        result = self._call('volume_list', params={'count': 'true'}, stream=True, project=project)
+        try:
+            count = 0
+            for vol in iter_json_array(result):
+                if count == 0 and 'count' in vol and 'LUName' not in vol:
+                    return vol['count']
+                # count is not supported, count streamed listing
+                count += 1
+            return count
+        finally:
+            result.close()
 
     def volume_get(self, project, volume):
         """
@@ -289,39 +299,29 @@ class Znstor(object):
         :param volume:  volumeID
         :return: volume object
         """
-        #result = self.rest.get(self.rest.projects_base_path() + "/" + project + "/volumes/" + volume)
-        result = self.rest.get(
-            "{base_name}/{project_name}/volumes/{volume_name}".format(
-                base_name=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{base_name}/{project_name}/volumes/{volume_name}".format(
-                    base_name=self.rest.projects_base_path(),
-                    project_name=project,
-                    volume_name=volume
-                ),
-                debug=result.text
-            )
-
+        return self._call('volume_get', project=project, volume=volume).json()
 
-    def volume_get_by_alias(self, project, alias):
+    def volume_get_by_alias(self, project, alias, refresh=False):
         """
         Get Volume by alias
         :param project: projectID
         :param alias: volume alias
+        :param refresh: look volume up on daemon, for volumes created by jobs or other clients
         :return: volume object
         """
-        volumes = self.volume_list(project)
-        for vol in volumes:
-            if vol['Alias'] == alias:
-                return vol
+        if not self.volumes.ttl:
+            return self._volume_lookup(project, alias)
+        if refresh:
+            vol = self._volume_lookup(project, alias)
+            if vol is not None:
+                self.volumes.add(project, vol)
+            return vol
+        return self.volumes.get(project, alias, self.volume_iter, self._volume_lookup)
+
+    def _volume_lookup(self, project, alias):
+        for vol in self.volume_iter(project, alias=alias):
+            return vol
+        return None
 
     def volume_resize(self, project, volume, volume_size):
         """
@@ -331,26 +331,10 @@ class Znstor(object):
         :param volume_size: new size in bytes
         :return: volume object
         """
-        result = self.rest.put(
-            "{base_path}/{project_name}/volumes/{volume_name}/resize".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume,
-            ),
-            {'volsize': volume_size}
-        )
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes/{volume_name}/resize".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project,
-                    volume_name=volume,
-                ),
-                payload={'volsize': volume_size},
-                debug=result.text
-            )
+        volume = self._call('volume_resize', {'volsize': volume_size},
+                            project=project, volume=volume).json()
+        self.volumes.add(project, volume)
+        return volume
 
     def volume_compression(self, project, volume, compression):
         """
@@ -360,25 +344,8 @@ class Znstor(object):
         :param key compression: [lz4|lzjb|gzip|off]
         :return:
         """
-        result = self.rest.put(
-            "{base_path}/{project_name}/volumes/{volume_name}/compression/{compression_type}".format(
-                base_path=self.rest.projects_base_path(),
-                volume_name=volume,
-                compression_type=compression
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes/{volume_name}/compression/{compression_type}".format(
-                    base_path=self.rest.projects_base_path(),
-                    volume_name=volume,
-                    compression_type=compression
-                ),
-                debug=result.text
-            )
+        return self._call('volume_compression', project=project, volume=volume,
+                          compression=compression).json()
 
     def volume_create_snapshot(self, project, volume, snapshot):
         """
@@ -388,27 +355,8 @@ class Znstor(object):
         :param snapshot: Snapshot name
         :return:
         """
-        result = self.rest.post(
-            "{base_path}/{project_name}/volumes/{volume_name}/snapshots/{snapshot_name}".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume,
-                snapshot_name=snapshot
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes/{volume_name}/snapshots/{snapshot_name}".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project,
-                    volume_name=volume,
-                    snapshot_name=snapshot
-                ),
-                debug=result.text
-            )
+        return self._call('volume_create_snapshot', project=project, volume=volume,
+                          snapshot=snapshot).json()
 
     def volume_create_from_snapshot(self, project, volume, snapshot, clone_alias):
         """
@@ -419,85 +367,51 @@ class Znstor(object):
         :param clone_alias: Snapshot name
         :return:
         """
-        result = self.rest.post(
-            "{base_path}/{project_name}/volumes/{volume_name}/snapshots/{snapshot_name}/clone".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume,
-                snapshot_name=snapshot,
-            ),
-            {'alias': clone_alias}
-        )
+        clone = self._call('volume_create_from_snapshot', {'alias': clone_alias},
+                           project=project, volume=volume, snapshot=snapshot).json()
+        self.volumes.add(project, clone)
+        return clone
 
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes/{volume_name}/snapshots/{snapshot_name}/clone".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project,
-                    volume_name=volume,
-                    snapshot_name=snapshot,
-                ),
-                debug=result.text,
-                payload={'alias': clone_alias}
-            )
-
-    def volume_destroy_snapshot(self, project, volume, snapshot):
+    def volume_destroy_snapshot(self, project, volume, snapshot, wait=True):
         """
         Destroy snapshot
         :param project: Project ID
         :param volume:  Volume ID
         :param snapshot: Snapshot name
-        :return:
+        :param wait: wait until destroy job is finished
+        :return: None or JobFuture of destroy job if wait is False
         """
-        result = self.rest.delete(
-            "{base_path}/{project_name}/volumes/{volume_name}/snapshots/{snapshot_name}".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume,
-                snapshot_name=snapshot,
-            )
-        )
+        job = self._call('volume_destroy_snapshot', project=project, volume=volume,
+                         snapshot=snapshot)
+        if not wait:
+            return job
+        self.job_wait(job)
 
-        if result.status_code == 202:
-            retry_count = 60
-            time_to_sleep = 1
-            # We observe the change of status for 30 seconds
-            # if it still "in progress" or "completed" We assume that the operation was successfully completed
-            for x in xrange(retry_count):
-                time.sleep(time_to_sleep)
-                job_uuid = result.json()['message']
-                job_result = self.rest.get(
-                    "{base_path}/{project_name}/volumes/job/{uuid}".format(
-                        base_path=self.rest.projects_base_path(),
-                        project_name=project,
-                        uuid = job_uuid,
-                    )
-                )
-                job_status = job_result.json()['message']
-                if job_status == self.job_completed:
-                    return
-                if job_status != self.job_completed and job_status != self.job_inprogress:
-                    raise ZnstorBadRequest(
-                        object="{base_path}/{project_name}/volumes/{volume_name}/snapshots/{snapshot_name}".format(
-                            base_path=self.rest.projects_base_path(),
-                            project_name=project,
-                            volume_name=volume,
-                            snapshot_name=snapshot,
-                        ),
-                        debug=result.text
-                    )
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes/{volume_name}/snapshots/{snapshot_name}".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project,
-                    volume_name=volume,
-                    snapshot_name=snapshot,
-                ),
-                debug=result.text
-            )
+    def project_create_snapshot(self, project, snapshot, volumes):
+        """
+        Snapshot several volumes of project at once, snapshots are point-in-time consistent
+        :param project: Project ID
+        :param snapshot: Snapshot name, the same for every volume
+        :param volumes: list of Volume IDs
+        :return: array of snapshot objects
+        """
+        return self._call('project_create_snapshot', {'volumes': volumes},
+                          project=project, snapshot=snapshot).json()
+
+    def project_destroy_snapshot(self, project, snapshot, volumes, wait=True):
+        """
+        Destroy snapshot of several volumes of project
+        :param project: Project ID
+        :param snapshot: Snapshot name
+        :param volumes: list of Volume IDs
+        :param wait: wait until destroy job is finished
+        :return: None or JobFuture of destroy job if wait is False
+        """
+        job = self._call('project_destroy_snapshot', {'volumes': volumes},
+                         project=project, snapshot=snapshot)
+        if not wait:
+            return job
+        self.job_wait(job)
 
     def volume_list_snapshot(self, project, volume):
         """
@@ -506,25 +420,7 @@ class Znstor(object):
         :param volume:  volume ID
         :return: array of snapshot objects
         """
-        result = self.rest.get(
-            "{base_path}/{project_name}/volumes/{volume_name}/snapshots".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume,
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes/{volume_name}/snapshots".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project,
-                    volume_name=volume,
-                ),
-                debug=result.text
-            )
+        return self._call('volume_list_snapshot', project=project, volume=volume).json()
 
     def volume_get_snapshot(self, project, volume, snapshot):
         """
@@ -534,27 +430,8 @@ class Znstor(object):
         :param snapshot: snapshot ID
         :return: snapshot object
         """
-        result = self.rest.get(
-            "{base_path}/{project_name}/volumes/{volume_name}/snapshots/{snapshot_name}".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume,
-                snapshot_name=snapshot
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes/{volume_name}/snapshots/{snapshot_name}".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project,
-                    volume_name=volume,
-                    snapshot_name=snapshot
-                ),
-                debug=result.text
-            )
+        return self._call('volume_get_snapshot', project=project, volume=volume,
+                          snapshot=snapshot).json()
 
     def volume_rollback_snapshot(self, project, volume, snapshot):
         """
@@ -564,33 +441,55 @@ class Znstor(object):
         :param snapshot: snapshot ID
         :return:
         """
-        #result = self.rest.put(
-        #    self.rest.projects_base_path() + "/" + project + "/volumes/" + volume +
-        #    "/snapshots/" + snapshot + "/rollback"
-        #)
-        result = self.rest.put(
-            "{base_path}/{project_name}/volumes/{volume_name}/snapshots/{snapshot_name}/rollback".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume,
-                snapshot_name=snapshot
-            )
-        )
+        return self._call('volume_rollback_snapshot', project=project, volume=volume,
+                          snapshot=snapshot).json()
 
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes/{volume_name}/snapshots/{snapshot_name}/rollback".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project,
-                    volume_name=volume,
-                    snapshot_name=snapshot
-                ),
-                debug=result.text
-            )
-
-    def volume_export(self, project, volume, hostgroup, targetgroup, lun=-1):
+    def volume_send_snapshot(self, project, volume, snapshot, target, base=None, timeout=None):
+        """
+        Send snapshot to volume of another project, zpool or domain of the cluster
+        (zfs send | zfs receive) in background
+        :param project: project ID
+        :param volume: volume ID
+        :param snapshot: snapshot name
+        :param target: dict with domain, pool, project and alias of received volume
+        :param base: send changes made since this snapshot, which was sent to target before
+        :param timeout: seconds to track send job
+        :return: JobFuture of send job
+        """
+        body = dict(target)
+        if base is not None:
+            body['base'] = base
+        return self._call('volume_send_snapshot', body, job_timeout=timeout,
+                          project=project, volume=volume, snapshot=snapshot)
+
+    def volume_diff_snapshot(self, project, volume, snapshot, base=None, align=None,
+                             piece_size=4 * 1024 ** 2):
+        """
+        Stream blocks of snapshot changed since base snapshot.
+        Extents are decoded from response stream, so only one piece of data is kept in memory.
+        :param project: project ID
+        :param volume: volume ID
+        :param snapshot: snapshot name
+        :param base: older snapshot of the volume, None - stream the whole snapshot
+        :param align: extents are widened to multiples of this number of bytes
+        :param piece_size: max size of yielded data
+        :return: generator of (offset, length, data), data is None for unallocated
+        ranges which read as zeros
+        """
+        params = {}
+        if base is not None:
+            params['base'] = base
+        if align:
+            params['align'] = align
+        result = self._call('volume_diff_snapshot', params=params, stream=True,
+                            project=project, volume=volume, snapshot=snapshot)
+        try:
+            for extent in iter_extents(result, piece_size):
+                yield extent
+        finally:
+            result.close()
+
+    def volume_export(self, project, volume, hostgroup, targetgroup, lun=-1, readback=True):
         """
         Export volume aka add view
         :param project: ProjectID
@@ -598,62 +497,36 @@ class Znstor(object):
         :param hostgroup: Hostgroup name
         :param targetgroup: Targetgroup name
         :param lun: logical unit number
+        :param readback: return volume object, export response is returned otherwise
         :return: volume object
         """
-        #result = self.rest.put(
-        result = self.rest.put(
-            "{base_path}/{project_name}/volumes/{volume_name}/export".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume
-            ),
-            {'hostgroup': hostgroup, 'targetgroup': targetgroup, 'lun': lun}
-        )
-
-        if result.status_code == 200:
-            return self.volume_get(project, volume)
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes/{volume_name}/export".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project,
-                    volume_name=volume
-                ),
-                payload={'hostgroup': hostgroup, 'targetgroup': targetgroup, 'lun': lun},
-                debug=result.text
-            )
+        result = self._call('volume_export', {'hostgroup': hostgroup, 'targetgroup': targetgroup, 'lun': lun},
+                            project=project, volume=volume)
+        return self._readback(result, project, volume, readback)
 
-    def volume_unexport(self, project, volume, hostgroup, targetgroup, lun=-1):
+    def volume_unexport(self, project, volume, hostgroup, targetgroup, lun=-1, readback=True):
         """
-        Export volume aka add view
+        Unexport volume aka remove view
         :param project: ProjectID
         :param volume: Volume guid
         :param hostgroup: Hostgroup name
         :param targetgroup: Targetgroup name
         :param lun: logical unit number
+        :param readback: return volume object, unexport response is returned otherwise
         :return: volume object
         """
-        result = self.rest.put(
-            "{base_path}/{project_name}/volumes/{volume_name}/unexport".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume
-            ),
-            {'hostgroup': hostgroup, 'targetgroup': targetgroup, 'lun': lun}
-        )
+        result = self._call('volume_unexport', {'hostgroup': hostgroup, 'targetgroup': targetgroup, 'lun': lun},
+                            project=project, volume=volume)
+        return self._readback(result, project, volume, readback)
+
+    def _readback(self, result, project, volume, readback):
+        if not readback:
+            try:
+                return result.json()
+            except ValueError:
+                return None
+        return self.volume_get(project, volume)
 
-        if result.status_code == 200:
-            return self.volume_get(project, volume)
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes/{volume_name}/unexport".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project,
-                    volume_name=volume
-                ),
-                payload={'hostgroup': hostgroup, 'targetgroup': targetgroup, 'lun': lun},
-                debug=result.text
-            )
     def volume_exports(self, project, volume):
         """
         Get exports list
@@ -661,22 +534,7 @@ class Znstor(object):
         :param volume: VolumeID
         :return: []exports array
         """
-        result = self.rest.get(
-            "{base_path}/{project_name}/volumes/{volume_name}/exports".format(
-                base_path=self.rest.projects_base_path(),
-                project_name=project,
-                volume_name=volume
-            ))
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{base_path}/{project_name}/volumes/{volume_name}/exports".format(
-                    base_path=self.rest.projects_base_path(),
-                    project_name=project,
-                    volume_name=volume
-                ))
+        return self._call('volume_exports', project=project, volume=volume).json()
 
     def hostgroup_create(self, hostgroup):
         """
@@ -684,38 +542,19 @@ class Znstor(object):
         :param hostgroup: hostgroup id
         :return: hostgroup object
         """
-        result = self.rest.post(
-            "{host_base_path}/{hostgroup_name}".format(
-                host_base_path=self.rest.hosts_base_path(),
-                hostgroup_name=hostgroup
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{host_base_path}/{hostgroup_name}".format(
-                    host_base_path=self.rest.hosts_base_path(),
-                    hostgroup_name=hostgroup
-                ),
-                debug=result.text
-            )
+        hg = self._call('hostgroup_create', hostgroup=hostgroup).json()
+        self.hostgroups.update(hg)
+        return hg
 
     def hostgroup_list(self):
         """
         Get all available hostgroups
         :return: return hostgroup objects
         """
-        result = self.rest.get(self.rest.hosts_base_path())
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object=self.rest.hosts_base_path(),
-                debug=result.text
-            )
+        hostgroups = self._call('hostgroup_list').json()
+        for hg in hostgroups or []:
+            self.hostgroups.update(hg)
+        return hostgroups
 
     def hostgroup_get(self, hostgroup):
         """
@@ -723,23 +562,9 @@ class Znstor(object):
         :param hostgroup:  HostgroupID
         :return: hostgroup object
         """
-        result = self.rest.get(
-            "{host_base_path}/{hostgroup_name}".format(
-                host_base_path=self.rest.hosts_base_path(),
-                hostgroup_name=hostgroup
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{host_base_path}/{hostgroup_name}".format(
-                    host_base_path=self.rest.hosts_base_path(),
-                    hostgroup_name=hostgroup
-                ),
-                debug=result.text
-            )
+        hg = self._call('hostgroup_get', hostgroup=hostgroup).json()
+        self.hostgroups.update(hg)
+        return hg
 
     def hostgroup_add_member(self, hostgroup, member):
         """
@@ -748,75 +573,63 @@ class Znstor(object):
         :param member: member IQN (wwn in case of FC)
         :return: hostgroup object
         """
-        result = self.rest.put(
-            "{host_base_path}/{hostgroup_name}/add/{member_iqn}".format(
-                host_base_path=self.rest.hosts_base_path(),
-                hostgroup_name=hostgroup,
-                member_iqn=member
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{host_base_path}/{hostgroup_name}/add/{member_iqn}".format(
-                    host_base_path=self.rest.hosts_base_path(),
-                    hostgroup_name=hostgroup,
-                    member_iqn=member
-                ),
-                debug=result.text
-            )
+        hg = self._call('hostgroup_add_member', hostgroup=hostgroup, member=member).json()
+        self.hostgroups.update(hg)
+        return hg
 
     def hostgroup_remove_member(self, hostgroup, member):
         """
-        Add member (IQN) to hostgroup.
+        Remove member (IQN) from hostgroup.
         :param hostgroup: hostgroupID
         :param member: member IQN (wwn in case of FC)
         :return: hostgroup object
         """
-        result = self.rest.put(
-            "{host_base_path}/{hostgroup}/remove/{member_iqn}".format(
-                host_base_path=self.rest.hosts_base_path(),
-                hostgroup_name=hostgroup,
-                member_iqn=member
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{host_base_path}/{hostgroup}/remove/{member_iqn}".format(
-                    host_base_path=self.rest.hosts_base_path(),
-                    hostgroup_name=hostgroup,
-                    member_iqn=member
-                ),
-                debug=result.text
-            )
+        hg = self._call('hostgroup_remove_member', hostgroup=hostgroup, member=member).json()
+        self.hostgroups.update(hg)
+        return hg
 
     def hostgroup_delete(self, hostgroup):
         """
         Delete hostgroup
         :return: return null
         """
-        result = self.rest.delete(
-            "{host_base_path}/{hostgroup_name}".format(
-                host_base_path=self.rest.hosts_base_path(),
-                hostgroup_name=hostgroup
-            )
-        )
+        result = self._call('hostgroup_delete', hostgroup=hostgroup)
+        self.hostgroups.discard(hostgroup)
+        return result.json()
 
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{host_base_path}/{hostgroup_name}".format(
-                    host_base_path=self.rest.hosts_base_path(),
-                    hostgroup_name=hostgroup
-                ),
-                debug=result.text
-            )
+    def hostgroup_ensure(self, hostgroup, member):
+        """
+        Ensure that hostgroup exists and member is in it.
+        Other members are left in place: they may be initiators of the same host
+        attached through another path or used by another backend.
+        Hostgroup cache is used, so no requests are made if hostgroup is up to date.
+        :param hostgroup: hostgroupID
+        :param member: member IQN
+        :return: list of other members of hostgroup member was added to, empty if
+        hostgroup already had member
+        """
+        members = self.hostgroups.get(hostgroup, self.hostgroup_list)
+        if members is not None and member in members:
+            return []
+        try:
+            return self._hostgroup_sync(hostgroup, member, members)
+        except ZnstorBadRequest:
+            # hostgroup was changed outside of this client ("not found" or
+            # "already exists"), reread it and try again
+            self.hostgroups.discard(hostgroup)
+            try:
+                members = set(self.hostgroup_get(hostgroup).get('Members') or [])
+            except ZnstorBadRequest:
+                members = None
+            return self._hostgroup_sync(hostgroup, member, members)
+
+    def _hostgroup_sync(self, hostgroup, member, members):
+        if members is None:
+            self.hostgroup_create(hostgroup)
+            members = set()
+        if member not in members:
+            self.hostgroup_add_member(hostgroup, member)
+        return sorted(members - set([member]))
 
     def hostgroup_add_multihost_member(self, hostgroup, member):
         """
@@ -825,25 +638,7 @@ class Znstor(object):
         :param member: member
         :return: hostgroup object
         """
-        result = self.rest.put(
-            "{host_base_path}/{hostgroup_name}/add/{member_iqn}/force".format(
-                host_base_path=self.rest.hosts_base_path(),
-                hostgroup_name=hostgroup,
-                member_iqn=member
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{host_base_path}/{hostgroup_name}/add/{member_iqn}/force".format(
-                    host_base_path=self.rest.hosts_base_path(),
-                    hostgroup_name=hostgroup,
-                    member_iqn=member
-                ),
-                debug=result.text
-            )
+        return self._call('hostgroup_add_multihost_member', hostgroup=hostgroup, member=member).json()
 
     # targetgroup
     def targetgroup_create(self, targetgroup):
@@ -852,44 +647,14 @@ class Znstor(object):
         :param targetgroup: targetgroup id
         :return: targetgroup object
         """
-        result = self.rest.post(
-            "{target_base_path}/tg/{targetgroup_name}".format(
-                target_base_path=self.rest.targets_base_path(),
-                targetgroup_name=targetgroup
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{target_base_path}/tg/{targetgroup_name}".format(
-                    target_base_path=self.rest.targets_base_path(),
-                    targetgroup_name=targetgroup
-                ),
-                debug=result.text
-            )
+        return self._call('targetgroup_create', targetgroup=targetgroup).json()
 
     def targetgroup_list(self):
         """
         Get all available targetgroups
         :return: return targetgroup objects
         """
-        result = self.rest.get(
-            "{target_base_path}/tg".format(
-                target_base_path=self.rest.targets_base_path()
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{target_base_path}/tg".format(
-                    target_base_path=self.rest.targets_base_path()
-                ),
-                debug=result.text
-            )
+        return self._call('targetgroup_list').json()
 
     def targetgroup_get(self, targetgroup):
         """
@@ -897,23 +662,7 @@ class Znstor(object):
         :param targetgroup:  TargetGroupID
         :return: targetgroup object
         """
-        result = self.rest.get(
-            "{target_base_path}/tg/{targetgroup_name}".format(
-                target_base_path=self.rest.targets_base_path(),
-                targetgroup_name=targetgroup
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{target_base_path}/tg/{targetgroup_name}".format(
-                    target_base_path=self.rest.targets_base_path(),
-                    targetgroup_name=targetgroup
-                ),
-                debug=result.text
-            )
+        return self._call('targetgroup_get', targetgroup=targetgroup).json()
 
     def targetgroup_add_member(self, targetgroup, member):
         """
@@ -922,25 +671,7 @@ class Znstor(object):
         :param member: target
         :return: hostgroup object
         """
-        result = self.rest.put(
-            "{target_base_path}/tg/{targetgroup_name}/add/{member_iqn}".format(
-                target_base_path=self.rest.targets_base_path(),
-                targetgroup_name=targetgroup,
-                member_iqn=member
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{target_base_path}/tg/{targetgroup_name}/add/{member_iqn}".format(
-                    target_base_path=self.rest.targets_base_path(),
-                    targetgroup_name=targetgroup,
-                    member_iqn=member
-                ),
-                debug=result.text
-            )
+        return self._call('targetgroup_add_member', targetgroup=targetgroup, member=member).json()
 
     def targetgroup_remove_member(self, targetgroup, member):
         """
@@ -949,48 +680,14 @@ class Znstor(object):
         :param member: member
         :return: targetgroup object
         """
-        result = self.rest.put(
-            "{target_base_path}/tg/{targetgroup_name}/remove/{member_iqn}".format(
-                target_base_path=self.rest.targets_base_path(),
-                targetgroup_name=targetgroup,
-                member_iqn=member
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{target_base_path}/tg/{targetgroup_name}/remove/{member_iqn}".format(
-                    target_base_path=self.rest.targets_base_path(),
-                    targetgroup_name=targetgroup,
-                    member_iqn=member
-                ),
-                debug=result.text
-            )
+        return self._call('targetgroup_remove_member', targetgroup=targetgroup, member=member).json()
 
     def targetgroup_delete(self, targetgroup):
         """
         Delete targetgroup
         :return: return null
         """
-        result = self.rest.delete(
-            "{target_base_path}/tg/{targetgroup_name}".format(
-                target_base_path=self.rest.targets_base_path(),
-                targetgroup_name=targetgroup
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{target_base_path}/tg/{targetgroup_name}".format(
-                    target_base_path=self.rest.targets_base_path(),
-                    targetgroup_name=targetgroup,
-                ),
-                debug=result.text
-            )
+        return self._call('targetgroup_delete', targetgroup=targetgroup).json()
 
     def targetportgroup_create(self, tpg, ipaddrs):
         """
@@ -999,45 +696,11 @@ class Znstor(object):
         :param ipaddrs: list of ip addresses
         :return: target port group object
         """
-        result = self.rest.post(
-            "{target_base_path}/tpg/{targetportgroup_name}".format(
-                target_base_path=self.rest.targets_base_path(),
-                targetportgroup_name=tpg
-            ),
-            ipaddrs
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{target_base_path}/tpg/{targetportgroup_name}".format(
-                    target_base_path=self.rest.targets_base_path(),
-                    targetportgroup_name=tpg
-                ),
-                payload=ipaddrs,
-                debug=result.text
-            )
+        return self._call('targetportgroup_create', ipaddrs, tpg=tpg).json()
 
     def targetportgroup_delete(self, tpg):
         """
         Delete target port group
         :return: null
         """
-        result = self.rest.delete(
-            "{target_base_path}/tpg/{targetportgroup_name}".format(
-                target_base_path=self.rest.targets_base_path(),
-                targetportgroup_name=tpg
-            )
-        )
-
-        if result.status_code == 200:
-            return result.json()
-        else:
-            raise ZnstorBadRequest(
-                object="{target_base_path}/tpg/{targetportgroup_name}".format(
-                    target_base_path=self.rest.targets_base_path(),
-                    targetportgroup_name=tpg
-                ),
-                debug=result.text
-            )
+        return self._call('targetportgroup_delete', tpg=tpg).json()
@@ -1,8 +1,32 @@
+import os
+import socket
+import time
 import uuid
+import metrics
 import restapi
+import endpoints
+import breaker
+import simulator
+import pools
+import jobs
+import coalesce
+import asyncapi
+import threading
+import requests
+import stats
+import cache
+
+# Tests run against in-process znstord simulator.
+# Set ZNSTOR_ADDRESS=host:port to run them against real array.
+if os.environ.get('ZNSTOR_ADDRESS'):
+    management_address = os.environ['ZNSTOR_ADDRESS']
+    sim = None
+else:
+    sim = simulator.Simulator().start()
+    management_address = sim.address
 
 storage = restapi.Znstor(
-    managment_address='172.30.50.82:10987',
+    management_address=management_address,
     pool='tank',
     domain='default',
     user='znstor',
@@ -270,3 +294,835 @@ def test_hostgroup():
 #         for targetgroup in targetgroups:
 #             if targetgroup['TargetGroup'][:12] == 'targetgroup':
 #                 storage.targetgroup_delete(targetgroup['TargetGroup'])
+
+
+def test_volume_iter():
+    project_name = str(uuid.uuid4())
+    storage.project_create(project_name, quota=500 * 1024 ** 3)
+    for index in xrange(7):
+        storage.volume_create(project_name, alias="vol_%d" % index, volsize=1024 ** 2)
+
+    aliases = sorted(vol['Alias'] for vol in storage.volume_iter(project_name, page_size=3))
+    assert aliases == ["vol_%d" % index for index in xrange(7)]
+    assert storage.volume_count(project_name) == 7
+    assert storage.volume_get_by_alias(project_name, "vol_5")['Alias'] == "vol_5"
+    assert storage.volume_get_by_alias(project_name, "missing") is None
+
+    for vol in storage.volume_iter(project_name):
+        storage.volume_destroy(project_name, vol['LUName'])
+    assert storage.volume_count(project_name) == 0
+    storage.project_destroy(project_name)
+
+
+def test_volume_iter_without_paging():
+    sim = simulator.Simulator(paging=False).start()
+    client = restapi.Znstor(management_address=sim.address)
+    sim.populate('unpaged', 5)
+
+    assert len(list(client.volume_iter('unpaged', page_size=2))) == 5
+    assert client.volume_count('unpaged') == 5
+    assert [vol['Alias'] for vol in client.volume_iter('unpaged', alias='volume-3')] == ['volume-3']
+    sim.stop()
+
+
+def test_hostgroup_ensure():
+    hostgroup = str(uuid.uuid4())
+    assert storage.hostgroup_ensure(hostgroup, 'iqn.1994-05.com.redhat:aa01') == []
+    assert storage.hostgroup_get(hostgroup)['Members'] == ['iqn.1994-05.com.redhat:aa01']
+
+    # another initiator of the host is added, existing members are kept
+    assert storage.hostgroup_ensure(hostgroup, 'iqn.1994-05.com.redhat:aa02') == \
+        ['iqn.1994-05.com.redhat:aa01']
+    assert storage.hostgroup_get(hostgroup)['Members'] == \
+        ['iqn.1994-05.com.redhat:aa01', 'iqn.1994-05.com.redhat:aa02']
+    assert storage.hostgroup_ensure(hostgroup, 'iqn.1994-05.com.redhat:aa01') == []
+    storage.hostgroup_delete(hostgroup)
+
+
+def test_metrics():
+    project_name = str(uuid.uuid4())
+    storage.project_create(project_name, quota=500 * 1024 ** 3)
+    storage.volume_create(project_name, alias="vol_metrics", volsize=1024 ** 2)
+    try:
+        storage.project_get(str(uuid.uuid4()))
+    except Exception:
+        pass
+
+    endpoints = storage.rest.metrics.snapshot()
+    created = endpoints['POST /projects/{project}/volumes']
+    assert created['latency']['count'] >= 1
+    assert created['bytes_out'] > 0 and created['bytes_in'] > 0
+    assert created['inflight'] == 0
+    assert endpoints['GET /projects/{project}']['errors'] >= 1
+    assert storage.rest.metrics.summary()['requests'] == \
+        sum(stat['latency']['count'] for stat in endpoints.values())
+
+    vol = storage.volume_get_by_alias(project_name, "vol_metrics")
+    storage.volume_destroy(project_name, vol['LUName'])
+    storage.project_destroy(project_name)
+
+
+def test_prometheus_families():
+    client = restapi.Znstor(management_address=management_address)
+    client.project_list()
+    try:
+        client.project_get(str(uuid.uuid4()))
+    except restapi.ZnstorBadRequest:
+        pass
+    text = metrics.PrometheusTextfileSink('/dev/null').render(client.rest.metrics)
+
+    # samples of every family follow its HELP and TYPE lines as one block
+    seen = []
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            seen.append(line.split()[2])
+            continue
+        if line.startswith('# TYPE '):
+            assert line.split()[2] == seen[-1]
+            continue
+        name = line.partition('{')[0]
+        assert name == seen[-1] or name.rpartition('_')[0] == seen[-1], line
+    assert seen == [family for family, _, _ in metrics.PrometheusTextfileSink.FAMILIES]
+    assert 'znstor_requests_total{method="GET",endpoint="/projects/{project}",status="404"} 1' in text
+
+
+def test_endpoints():
+    for name, endpoint in endpoints.ENDPOINTS.items():
+        assert hasattr(restapi.Znstor, name), name
+        assert endpoint.template == metrics.url_template(storage.rest.url(endpoint)), name
+
+
+def test_endpoint_errors():
+    project_name = str(uuid.uuid4())
+    storage.project_create(project_name, quota=500 * 1024 ** 3)
+    volume = storage.volume_create(project_name, alias="vol_errors", volsize=1024 ** 2)['id']
+    try:
+        storage.volume_get(project_name, str(uuid.uuid4()))
+        assert False, 'missing volume should raise'
+    except restapi.ZnstorObjectNotFound as e:
+        assert e.status == 404 and isinstance(e, restapi.ZnstorBadRequest)
+    try:
+        storage.volume_create_from_snapshot(project_name, volume, 'missing', 'vol_errors_clone')
+        assert False, 'clone of missing snapshot should raise'
+    except restapi.ZnstorObjectNotFound:
+        pass
+    storage.volume_create_snapshot(project_name, volume, 'snap')
+    try:
+        storage.volume_destroy(project_name, volume)
+        assert False, 'volume with snapshots should not be destroyed'
+    except restapi.ZnstorBadRequest as e:
+        assert type(e) is restapi.ZnstorBadRequest and e.status == 400
+    storage.volume_destroy_snapshot(project_name, volume, 'snap')
+    storage.volume_destroy(project_name, volume)
+    storage.project_destroy(project_name)
+
+    if sim is None:
+        return
+    # daemon without batched snapshots does not route them
+    old = simulator.Simulator()
+    old._routes = [route for route in old._routes if not route[2].__name__.startswith('project_snapshot')]
+    old.start()
+    client = restapi.Znstor(management_address=old.address)
+    old.populate('old', 1)
+    for call in (lambda: client.project_create_snapshot('old', 'group-1', ['volume-0']),
+                 lambda: client.project_destroy_snapshot('old', 'group-1', ['volume-0'])):
+        try:
+            call()
+            assert False, 'batched snapshot should not be supported'
+        except restapi.ZnstorNotSupported as e:
+            assert e.status == 404
+    old.stop()
+
+
+def test_retries():
+    sim = simulator.Simulator(seed=1).start()
+    client = restapi.Znstor(management_address=sim.address, retries=5, retry_backoff=0.001,
+                            breaker_threshold=0)
+    sim.populate('flaky', 3)
+
+    sim.failure_rate = 0.3
+    for _ in xrange(20):
+        assert client.volume_count('flaky') == 3
+
+    # mutations are never repeated
+    sim.failure_rate = 1
+    sim.reset_counters()
+    try:
+        client.volume_create('flaky', alias='vol_flaky', volsize=1024 ** 2)
+        assert False, 'volume_create should fail'
+    except restapi.ZnstorBadRequest:
+        pass
+    assert sim.request_count() == 1
+    sim.stop()
+
+
+def test_circuit_breaker():
+    sim = simulator.Simulator().start()
+    client = restapi.Znstor(management_address=sim.address, retries=0,
+                            breaker_threshold=2, breaker_reset=0.2)
+    sim.populate('breaker', 1)
+
+    sim.failure_rate = 1
+    for _ in xrange(2):
+        try:
+            client.project_get('breaker')
+        except restapi.ZnstorBadRequest:
+            pass
+    assert client.rest.status()[sim.address]['state'] == breaker.OPEN
+
+    sim.reset_counters()
+    try:
+        client.project_get('breaker')
+        assert False, 'request should fail fast'
+    except breaker.CircuitOpenError:
+        pass
+    assert sim.request_count() == 0
+
+    # daemon is back, probe closes circuit
+    sim.failure_rate = 0
+    time.sleep(0.2)
+    assert client.project_get('breaker')['project'] == 'breaker'
+    assert client.rest.status()[sim.address]['state'] == breaker.CLOSED
+    sim.stop()
+
+
+def test_circuit_breaker_broken_probe():
+    sim = simulator.Simulator().start()
+    client = restapi.Znstor(management_address=sim.address, retries=0,
+                            breaker_threshold=1, breaker_reset=0.1)
+    sim.populate('broken_probe', 1)
+    send = client.rest._send
+
+    # probe fails with error which is neither connection error nor timeout
+    for error in (requests.exceptions.ChunkedEncodingError('broken body'), ValueError('local')):
+        sim.failure_rate = 1
+        try:
+            client.project_get('broken_probe')
+        except restapi.ZnstorBadRequest:
+            pass
+        assert client.rest.status()[sim.address]['state'] == breaker.OPEN
+        sim.failure_rate = 0
+        time.sleep(0.1)
+
+        def broken(*args, **kwargs):
+            raise error
+        client.rest._send = broken
+        try:
+            client.project_get('broken_probe')
+            assert False, 'probe should fail'
+        except type(error):
+            pass
+        client.rest._send = send
+
+        # the next probe is let through and closes circuit
+        time.sleep(0.1)
+        assert client.project_get('broken_probe')['project'] == 'broken_probe'
+        assert client.rest.status()[sim.address]['state'] == breaker.CLOSED
+    sim.stop()
+
+
+def test_failover():
+    sim = simulator.Simulator().start()
+    # nothing listens on port of closed socket
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    dead = '127.0.0.1:%d' % sock.getsockname()[1]
+    sock.close()
+
+    client = restapi.Znstor(management_address='%s,%s' % (dead, sim.address), breaker_reset=60)
+    sim.populate('failover', 2)
+
+    started = time.time()
+    # mutation is moved to the next node because the first one refused connection
+    client.volume_create('failover', alias='vol_failover', volsize=1024 ** 2)
+    status = client.rest.status()
+    assert status[sim.address]['active'] and not status[dead]['active']
+
+    for _ in xrange(10):
+        assert client.volume_count('failover') == 3
+    assert time.time() - started < 5
+    sim.stop()
+
+
+def test_job_polled_on_accepting_node():
+    first = simulator.Simulator().start()
+    second = simulator.Simulator().start()
+    client = restapi.Znstor(management_address='%s,%s' % (first.address, second.address))
+    first.populate('jobs', 1)
+    second.populate('jobs', 1)
+
+    for i in xrange(4):
+        # mutations go to active node, status reads would be spread over both nodes
+        volume = client.volume_create('jobs', alias='vol_job_%d' % i, volsize=1024 ** 2)['id']
+        client.volume_create_snapshot('jobs', volume, 'snap')
+        future = client.volume_destroy_snapshot('jobs', volume, 'snap', wait=False)
+        assert future.node == first.address
+        assert client.job_progress('jobs', future.job, node=future.node) == {}
+        client.job_wait(future)
+        client.volume_destroy('jobs', volume)
+    assert client.volume_count('jobs') == 1
+    first.stop()
+    second.stop()
+
+
+def _tracker(statuses, **kwargs):
+    """JobTracker polling job statuses from dict, job -> list of statuses returned one by one"""
+    polls = []
+
+    def poll(project, job, node):
+        polls.append(job)
+        status = statuses[job]
+        if isinstance(status, Exception):
+            raise status
+        return status.pop(0) if len(status) > 1 else status[0]
+    kwargs.setdefault('min_interval', 0.01)
+    kwargs.setdefault('max_interval', 0.04)
+    return jobs.JobTracker(poll, 'done', 'running', **kwargs), polls
+
+
+def test_job_tracker():
+    statuses = {'short': ['done'], 'long': ['running'] * 5 + ['done']}
+    tracker, polls = _tracker(statuses)
+    called = []
+    short = tracker.submit('project', 'short')
+    long = tracker.submit('project', 'long')
+    long.add_done_callback(lambda f: called.append(f))
+
+    assert short.result(5) == 'done'
+    assert long.result(5) == 'done' and not long.expired
+    assert polls.count('short') == 1 and polls.count('long') == 6
+    # interval grows up to max_interval, 5 polls of running job take 0.01 + 0.02 + 3 * 0.04
+    assert time.time() - long.submitted >= 0.15
+    deadline = time.time() + 5
+    while not called and time.time() < deadline:
+        time.sleep(0.01)
+    assert called == [long]
+    assert tracker.pending() == []
+
+    # callback of finished future is called at once
+    long.add_done_callback(lambda f: called.append(f))
+    assert called == [long, long]
+
+
+def test_job_tracker_timeout_and_failures():
+    error = restapi.ZnstorBadRequest(object='job', status=404)
+    statuses = {'stuck': ['running'], 'failed': ['Failed'], 'lost': error}
+    tracker, _ = _tracker(statuses, timeout=0.1)
+
+    stuck = tracker.submit('project', 'stuck')
+    assert stuck.result(5) == 'running' and stuck.expired
+    # per job timeout overrides tracker timeout
+    started = time.time()
+    assert tracker.submit('project', 'stuck', timeout=0.3).result(5) == 'running'
+    assert time.time() - started >= 0.3
+
+    failed = tracker.submit('project', 'failed')
+    assert failed.result(5) == 'Failed' and failed.status == 'Failed'
+    try:
+        storage.job_wait(failed, object='failed')
+        assert False, 'failed job should raise'
+    except restapi.ZnstorBadRequest as e:
+        assert e.debug == 'Failed'
+
+    lost = tracker.submit('project', 'lost')
+    assert lost.exception(5) is error
+    try:
+        lost.result()
+        assert False, 'poll error should be raised'
+    except restapi.ZnstorBadRequest as e:
+        assert e is error
+    assert tracker.pending() == []
+
+
+def test_job_tracker_callback_submits_job():
+    statuses = {'first': ['running', 'done'], 'second': ['running', 'done']}
+    tracker, _ = _tracker(statuses)
+    results = []
+
+    def chain(future):
+        # polling thread keeps running while callback waits for another job
+        results.append(tracker.submit('project', 'second').result(5))
+    first = tracker.submit('project', 'first')
+    first.add_done_callback(chain)
+    assert first.result(5) == 'done'
+    deadline = time.time() + 5
+    while not results and time.time() < deadline:
+        time.sleep(0.01)
+    assert results == ['done']
+
+
+def test_delete_reaper():
+    statuses = {'vol-1': ['running'] * 3 + ['done'], 'vol-2': ['Failed'], 'vol-2-retry': ['running', 'done'],
+                'vol-3': ['Failed'], 'snap': ['running'] * 8 + ['done']}
+    tracker, polls = _tracker(statuses, timeout=0.05)
+    reaper = jobs.DeleteReaper(tracker, retries=2)
+    retries = []
+
+    def retry(job):
+        def submit():
+            retries.append(job)
+            return tracker.submit('project', job)
+        return submit
+    reaper.track('vol-1', tracker.submit('project', 'vol-1'), retry('vol-1'), size=10)
+    reaper.track('vol-2', tracker.submit('project', 'vol-2'), retry('vol-2-retry'), size=20)
+    reaper.track('vol-3', tracker.submit('project', 'vol-3'), retry('vol-3'), size=30)
+    reaper.track('other@snap', tracker.submit('project', 'snap'), retry('snap'))
+    assert reaper.pending() == (4, 60)
+
+    # failed destroy is retried, wait returns after retried destroy is finished
+    assert _finishes(lambda: reaper.wait('vol-'))
+    assert reaper.pending()[0] <= 1
+    assert retries.count('vol-2-retry') == 1
+    assert statuses['vol-2-retry'] == ['done']
+    # failed retries are given up after retries attempts
+    assert retries.count('vol-3') == 2
+
+    # stuck job is watched again instead of being retried
+    assert _finishes(lambda: reaper.wait('other@'))
+    assert 'snap' not in retries and polls.count('snap') == 9
+    assert reaper.pending() == (0, 0)
+
+    # wait gives up after timeout
+    statuses['slow'] = ['running']
+    reaper.track('slow', tracker.submit('project', 'slow', timeout=60), retry('slow'))
+    started = time.time()
+    reaper.wait('slow', timeout=0.1)
+    assert 0.1 <= time.time() - started < 1 and reaper.pending() == (1, 0)
+
+
+def _concurrently(calls):
+    """Run callables in threads started at once, return their results or exceptions"""
+    results = [None] * len(calls)
+
+    def run(index):
+        try:
+            results[index] = calls[index]()
+        except Exception as e:
+            results[index] = e
+    threads = [threading.Thread(target=run, args=(index,)) for index in xrange(len(calls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_coalescer_batches():
+    coalescer = coalesce.Coalescer(window=0.2)
+    prepared = []
+    running = threading.Event()
+    release = threading.Event()
+
+    def call(key, value):
+        def fn():
+            if value is None:
+                raise ValueError(key)
+            return value
+        return lambda: coalescer.run(key, fn, prepare=lambda: prepared.append(key))
+
+    def blocking():
+        running.set()
+        release.wait(5)
+        return 0
+    # lone call is not delayed by window
+    started = time.time()
+    assert call('host-1', 1)() == 1 and time.time() - started < 0.2
+
+    # calls made while batch of the key is running are collected into the next batch
+    first = threading.Thread(target=lambda: coalescer.run('host-1', blocking))
+    first.start()
+    assert running.wait(5)
+    threading.Timer(0.05, release.set).start()
+    results = _concurrently([call('host-1', 1), call('host-1', 2), call('host-1', None),
+                             call('host-2', 3)])
+    first.join(5)
+    # every caller gets result of its own call, failed call does not fail others
+    assert results[:2] == [1, 2] and results[3] == 3
+    assert isinstance(results[2], ValueError)
+    # prepare is run once per batch
+    assert sorted(prepared) == ['host-1', 'host-1', 'host-2']
+
+    # without window calls are not coalesced
+    assert coalesce.Coalescer(window=0).run('host-1', lambda: 4, prepare=lambda: prepared.append('now')) == 4
+    assert prepared[-1] == 'now'
+
+
+def test_coalescer_prepare_error():
+    coalescer = coalesce.Coalescer(window=0.2)
+    error = restapi.ZnstorBadRequest(object='hostgroup')
+    called = []
+
+    prepared = []
+
+    def prepare():
+        prepared.append(1)
+        raise error
+    # running batch makes the next callers wait for each other
+    first = threading.Thread(target=lambda: coalescer.run('host', lambda: time.sleep(0.1)))
+    first.start()
+    time.sleep(0.02)
+    results = _concurrently([lambda: coalescer.run('host', lambda: called.append(1), prepare=prepare)
+                             for _ in xrange(3)])
+    first.join(5)
+    # every call of batch fails with exception of prepare, calls are not run
+    assert results == [error] * 3 and called == [] and prepared == [1]
+    # the next batch is prepared again
+    assert coalescer.run('host', lambda: 5) == 5
+
+
+def test_async_znstor():
+    client = asyncapi.AsyncZnstor(storage, concurrency=3)
+    project_name = str(uuid.uuid4())
+    client.project_create(project_name, quota=500 * 1024 ** 3).result(5)
+    futures = [client.volume_create(project_name, alias='vol_async_%d' % i, volsize=1024 ** 2)
+               for i in xrange(6)]
+    volumes = client.gather(futures)
+    assert len(set(volume['id'] for volume in volumes)) == 6
+    # attributes which are not methods are not wrapped
+    assert client.job_completed == storage.job_completed
+
+    count, missing = client.call([('volume_count', (project_name,)),
+                                  ('project_get', (str(uuid.uuid4()),))], return_exceptions=True)
+    assert count == 6 and isinstance(missing, restapi.ZnstorBadRequest)
+    try:
+        client.call([('project_get', (str(uuid.uuid4()),))])
+        assert False, 'error of call should be raised'
+    except restapi.ZnstorBadRequest:
+        pass
+
+    client.gather([client.volume_destroy(project_name, volume['id']) for volume in volumes])
+    client.project_destroy(project_name).result(5)
+    assert len(client._workers) <= 3
+
+
+def test_async_znstor_concurrency():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    class Slow(object):
+        def fetch(self, value):
+            with lock:
+                running.append(value)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(value)
+            return value
+    client = asyncapi.AsyncZnstor(Slow(), concurrency=2)
+    started = time.time()
+    assert client.gather([client.fetch(i) for i in xrange(6)]) == range(6)
+    # 6 calls run 2 at once
+    assert max(peak) == 2 and time.time() - started >= 0.15
+    # idle workers are reused
+    assert client.gather([client.fetch(i) for i in xrange(2)]) == [0, 1]
+    assert len(client._workers) == 2
+
+
+def test_volume_index_lookup():
+    index = cache.VolumeIndex(ttl=300)
+    listing = [{'Alias': 'vol-1', 'LUName': 'lu-1'}]
+    lookups = []
+
+    def lookup(project, alias):
+        lookups.append(alias)
+        return {'Alias': alias, 'LUName': 'lu-' + alias} if alias == 'vol-2' else None
+    assert index.get('project', 'vol-1', lambda project: listing, lookup)['LUName'] == 'lu-1'
+    # volume created by another client since listing was loaded is looked up and indexed
+    assert index.get('project', 'vol-2', lambda project: listing, lookup)['LUName'] == 'lu-vol-2'
+    assert index.get('project', 'vol-2', lambda project: listing, lookup)['LUName'] == 'lu-vol-2'
+    # missing volume is not cached as missing
+    assert index.get('project', 'vol-3', lambda project: listing, lookup) is None
+    assert index.get('project', 'vol-3', lambda project: listing, lookup) is None
+    assert lookups == ['vol-2', 'vol-3', 'vol-3']
+
+
+def test_volume_index_changes_during_reload():
+    index = cache.VolumeIndex(ttl=300)
+    loading = threading.Event()
+    release = threading.Event()
+
+    def loader(project):
+        # listing is taken before changes below are made
+        listing = [{'Alias': 'vol-1', 'LUName': 'lu-1'}, {'Alias': 'vol-2', 'LUName': 'lu-2'}]
+        loading.set()
+        release.wait(5)
+        return listing
+    found = []
+    thread = threading.Thread(target=lambda: found.append(index.get('project', 'vol-3', loader)))
+    thread.start()
+    assert loading.wait(5)
+    index.add('project', {'lu': {'Alias': 'vol-3', 'LUName': 'lu-3'}})
+    index.discard('project', 'lu-2')
+    release.set()
+    thread.join(5)
+
+    assert found == [{'Alias': 'vol-3', 'LUName': 'lu-3'}]
+    never = lambda project: [][0]
+    assert index.get('project', 'vol-1', never)['LUName'] == 'lu-1'
+    assert index.get('project', 'vol-2', never) is None
+
+    # listing invalidated while being loaded is not cached
+    loading.clear()
+    release.clear()
+    index.invalidate('project')
+    thread = threading.Thread(target=lambda: found.append(index.get('project', 'vol-1', loader)))
+    thread.start()
+    assert loading.wait(5)
+    index.invalidate()
+    release.set()
+    thread.join(5)
+    assert found[-1]['LUName'] == 'lu-1'
+    assert index.get('project', 'vol-1', lambda project: []) is None
+
+
+def test_clone_snapshot_lifecycle():
+    project_name = str(uuid.uuid4())
+    storage.project_create(project_name, quota=500 * 1024 ** 3)
+    src = storage.volume_create(project_name, alias="vol_src", volsize=1024 ** 2)['id']
+    storage.volume_create_snapshot(project_name, src, 'clone-1')
+    clone = storage.volume_create_from_snapshot(project_name, src, 'clone-1', 'vol_clone')
+    storage.volume_resize(project_name, clone['id'], 2 * 1024 ** 2)
+
+    snapshots = storage.volume_list_snapshot(project_name, src)
+    assert [restapi.snapshot_name(snap) for snap in snapshots] == ['clone-1']
+    try:
+        storage.volume_destroy(project_name, src)
+        assert False, 'volume with snapshots should not be destroyed'
+    except restapi.ZnstorBadRequest:
+        pass
+
+    storage.volume_destroy(project_name, clone['id'])
+    storage.volume_destroy_snapshot(project_name, src, 'clone-1')
+    storage.volume_destroy(project_name, src)
+    storage.project_destroy(project_name)
+
+
+def _finishes(fn, timeout=5):
+    """Run fn in thread and check it does not hang"""
+    thread = threading.Thread(target=fn)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+def test_async_delete_clone():
+    project_name = str(uuid.uuid4())
+    storage.project_create(project_name, quota=500 * 1024 ** 3)
+    src = storage.volume_create(project_name, alias="vol_async_src", volsize=1024 ** 2)['id']
+    other = storage.volume_create(project_name, alias="vol_async_other", volsize=1024 ** 2)['id']
+    storage.volume_create_snapshot(project_name, src, 'clone-1')
+    clone = storage.volume_create_from_snapshot(project_name, src, 'clone-1', 'vol_async_clone')
+    reaper = jobs.DeleteReaper(storage.jobs)
+
+    def release(future):
+        # callbacks may wait for other jobs, they are not run by the polling thread
+        storage.volume_destroy_snapshot(project_name, src, 'clone-1')
+    job = storage.volume_destroy(project_name, clone['id'], wait=False)
+    reaper.track(clone['id'], job, lambda: storage.volume_destroy(project_name, clone['id'], wait=False))
+    job.add_done_callback(release)
+
+    assert _finishes(lambda: reaper.wait(clone['id']))
+    assert _finishes(lambda: storage.volume_destroy(project_name, other))
+    deadline = time.time() + 5
+    while storage.volume_list_snapshot(project_name, src) and time.time() < deadline:
+        time.sleep(0.05)
+    assert _finishes(lambda: storage.volume_destroy(project_name, src))
+    assert reaper.pending() == (0, 0)
+    storage.project_destroy(project_name)
+
+
+def test_pools():
+    parsed = pools.parse_pools(['openstack', ' fast/db ', ''], 'tank')
+    assert [(p.name, p.zpool, p.project) for p in parsed] == [
+        ('openstack', 'tank', 'openstack'), ('fast/db', 'fast', 'db')]
+    for projects in (['tank/'], ['db', 'db']):
+        try:
+            pools.parse_pools(projects, 'tank')
+            assert False, projects
+        except ValueError:
+            pass
+
+    collector = stats.StatsCollector(lambda: {'a': {'volumes': 1}, 'b': {'volumes': 5}})
+    collector.refresh(wait=True)
+    collector.adjust('a', volumes=2)
+    collector.adjust('missing', volumes=1)
+    collected, meta = collector.get()
+    assert collected == {'a': {'volumes': 3}, 'b': {'volumes': 5}}
+
+
+def test_project_snapshot():
+    project_name = str(uuid.uuid4())
+    storage.project_create(project_name, quota=500 * 1024 ** 3)
+    volumes = [storage.volume_create(project_name, alias="vol_%d" % i, volsize=1024 ** 2)['id']
+               for i in xrange(3)]
+
+    snapshots = storage.project_create_snapshot(project_name, 'group-1', volumes)
+    assert len(snapshots) == 3
+    assert len(set(snap['creation'] for snap in snapshots)) == 1
+    for volume in volumes:
+        names = [restapi.snapshot_name(snap) for snap in storage.volume_list_snapshot(project_name, volume)]
+        assert names == ['group-1']
+
+    clone = storage.volume_create_from_snapshot(project_name, volumes[0], 'group-1', 'vol_clone')
+    try:
+        storage.project_destroy_snapshot(project_name, 'group-1', volumes)
+        assert False, 'snapshot with clones should not be destroyed'
+    except restapi.ZnstorBadRequest as e:
+        assert e.status == 400
+
+    storage.volume_destroy(project_name, clone['id'])
+    storage.project_destroy_snapshot(project_name, 'group-1', volumes)
+    for volume in volumes:
+        assert storage.volume_list_snapshot(project_name, volume) == []
+        storage.volume_destroy(project_name, volume)
+    storage.project_destroy(project_name)
+
+
+def test_rollback_newer_snapshots():
+    project_name = str(uuid.uuid4())
+    storage.project_create(project_name, quota=500 * 1024 ** 3)
+    volume = storage.volume_create(project_name, alias="vol_revert", volsize=1024 ** 2)['id']
+    storage.volume_create_snapshot(project_name, volume, 'snap-1')
+    storage.volume_create_snapshot(project_name, volume, 'clone-1')
+    try:
+        storage.volume_rollback_snapshot(project_name, volume, 'snap-1')
+        assert False, 'rollback should fail while newer snapshots exist'
+    except restapi.ZnstorBadRequest:
+        pass
+
+    storage.volume_destroy_snapshot(project_name, volume, 'clone-1')
+    storage.volume_rollback_snapshot(project_name, volume, 'snap-1')
+    storage.volume_destroy_snapshot(project_name, volume, 'snap-1')
+    storage.volume_destroy(project_name, volume)
+    storage.project_destroy(project_name)
+
+
+def test_send_snapshot():
+    source = str(uuid.uuid4())
+    target = str(uuid.uuid4())
+    storage.project_create(source, quota=500 * 1024 ** 3)
+    storage.project_create(target, quota=500 * 1024 ** 3)
+    volume = storage.volume_create(source, alias="vol_send", volsize=1024 ** 2)['id']
+    destination = {'domain': 'default', 'pool': 'tank', 'project': target, 'alias': 'vol_send'}
+
+    storage.volume_create_snapshot(source, volume, 'migrate-1')
+    job = storage.volume_send_snapshot(source, volume, 'migrate-1', destination, timeout=600)
+    storage.job_wait(job)
+    assert storage.job_progress(source, job.job)['bytes'] == 1024 ** 2
+
+    storage.volume_create_snapshot(source, volume, 'migrate-2')
+    job = storage.volume_send_snapshot(source, volume, 'migrate-2', destination, base='migrate-1')
+    storage.job_wait(job)
+
+    received = storage.volume_get_by_alias(target, 'vol_send', refresh=True)
+    names = [restapi.snapshot_name(snap) for snap in storage.volume_list_snapshot(target, received['LUName'])]
+    assert names == ['migrate-1', 'migrate-2']
+
+    try:
+        storage.volume_send_snapshot(source, volume, 'migrate-2', destination, base='missing')
+        assert False, 'incremental send should require base snapshot'
+    except restapi.ZnstorBadRequest:
+        pass
+
+    for project, vol in ((source, volume), (target, received['LUName'])):
+        for name in ('migrate-1', 'migrate-2'):
+            storage.volume_destroy_snapshot(project, vol, name)
+        storage.volume_destroy(project, vol)
+        storage.project_destroy(project)
+
+
+def test_send_snapshot_consistent():
+    if sim is None:
+        # volume data is written by simulator only
+        return
+    source = str(uuid.uuid4())
+    target = str(uuid.uuid4())
+    storage.project_create(source, quota=500 * 1024 ** 3)
+    storage.project_create(target, quota=500 * 1024 ** 3)
+    volume = storage.volume_create(source, alias="vol_send_once", volsize=1024 ** 2)['id']
+    destination = {'domain': 'default', 'pool': 'tank', 'project': target, 'alias': 'vol_send_once'}
+    sim.write(source, volume, 0, b'a' * 4096)
+
+    # single pass sends snapshot, writes made while it runs are not received
+    storage.volume_create_snapshot(source, volume, 'migrate-1')
+    job = storage.volume_send_snapshot(source, volume, 'migrate-1', destination)
+    sim.write(source, volume, 0, b'b' * 4096)
+    storage.job_wait(job)
+
+    received = storage.volume_get_by_alias(target, 'vol_send_once', refresh=True)
+    extents = [(offset, data) for offset, _, data in
+               storage.volume_diff_snapshot(target, received['LUName'], 'migrate-1') if data is not None]
+    assert extents == [(0, b'a' * 4096)]
+
+    for project, vol in ((source, volume), (target, received['LUName'])):
+        storage.volume_destroy_snapshot(project, vol, 'migrate-1')
+        storage.volume_destroy(project, vol)
+        storage.project_destroy(project)
+
+
+def test_thin_volume_space():
+    if sim is None:
+        # volume data is written by simulator only
+        return
+    project = str(uuid.uuid4())
+    storage.project_create(project, quota=500 * 1024 ** 3)
+    thick = storage.volume_create(project, alias="vol_thick", volsize=1024 ** 2, thin=False)
+    thin = storage.volume_create(project, alias="vol_thin", volsize=1024 ** 2, thin=True)
+    # thick volume reserves its size, thin one takes nothing until it is written
+    assert thick['vol']['options']['used'] == 1024 ** 2 and thin['vol']['options']['used'] == 0
+    sim.write(project, thin['id'], 0, b'a' * 8192)
+    assert storage.project_get(project)['options']['used'] == 1024 ** 2 + 8192
+
+    storage.volume_create_snapshot(project, thin['id'], 'clone-1')
+    clone = storage.volume_create_from_snapshot(project, thin['id'], 'clone-1', 'vol_clone')
+    # clone references data of snapshot, but takes only blocks written to it
+    assert clone['vol']['options']['used'] == 0 and clone['vol']['options']['referenced'] == 8192
+    sim.write(project, clone['id'], 4096, b'b' * 4096)
+    assert storage.volume_get(project, clone['id'])['vol']['options']['used'] == 4096
+
+    storage.volume_destroy(project, clone['id'])
+    storage.volume_destroy_snapshot(project, thin['id'], 'clone-1')
+    for volume in (thick, thin):
+        storage.volume_destroy(project, volume['id'])
+    storage.project_destroy(project)
+
+
+def test_snapshot_diff():
+    if sim is None:
+        # volume data is written by simulator only
+        return
+    project = str(uuid.uuid4())
+    storage.project_create(project, quota=500 * 1024 ** 3)
+    volume = storage.volume_create(project, alias="vol_diff", volsize=1024 ** 2)['id']
+    sim.write(project, volume, 0, b'a' * 8192)
+    sim.write(project, volume, 65536 + 100, b'b' * 10)
+
+    storage.volume_create_snapshot(project, volume, 'backup-1')
+    extents = list(storage.volume_diff_snapshot(project, volume, 'backup-1', align=32768,
+                                                piece_size=16384))
+    # the whole volume is covered, unwritten ranges are holes
+    assert [(offset, length, data is None) for offset, length, data in extents] == [
+        (0, 16384, False), (16384, 16384, False), (32768, 32768, True),
+        (65536, 16384, False), (81920, 16384, False), (98304, 1024 ** 2 - 98304, True)]
+    data = b''.join(data for _, _, data in extents if data is not None)
+    assert data[:8192] == b'a' * 8192 and data[8192:32768] == b'\0' * 24576
+    assert data[32768 + 100:32768 + 110] == b'b' * 10
+
+    sim.write(project, volume, 65536, b'c' * 4096)
+    storage.volume_create_snapshot(project, volume, 'backup-2')
+    extents = list(storage.volume_diff_snapshot(project, volume, 'backup-2', base='backup-1'))
+    assert extents == [(65536, 4096, b'c' * 4096)]
+    assert list(storage.volume_diff_snapshot(project, volume, 'backup-2', base='backup-2')) == []
+
+    try:
+        list(storage.volume_diff_snapshot(project, volume, 'backup-1', base='backup-2'))
+        assert False, 'base snapshot should be older'
+    except restapi.ZnstorBadRequest:
+        pass
+
+    for name in ('backup-1', 'backup-2'):
+        storage.volume_destroy_snapshot(project, volume, name)
+    storage.volume_destroy(project, volume)
+    storage.project_destroy(project)
@@ -3,9 +3,22 @@
 """
 
 import sys
+import json
+import time
+import random
+import codecs
 import logging
+import threading
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
 import requests
+try:
+    from urllib3.exceptions import NewConnectionError
+except ImportError:
+    from requests.packages.urllib3.exceptions import NewConnectionError
+
+from metrics import Metrics, url_template, STATUS_ERROR
+from breaker import CircuitBreaker, CircuitOpenError
 
 # TODO: set debug level from cinder driver
 LOGLEVEL = logging.ERROR
@@ -17,25 +30,170 @@ LOG.addHandler(out_hdlr)
 LOG.setLevel(LOGLEVEL)
 
 
+def iter_json_array(response, chunk_size=65536):
+    """Decode JSON array from response stream element by element.
+    Only current element is kept in memory. If document is not an array,
+    document itself is yielded, null yields nothing.
+    :param response: response of request made with stream=True
+    :param chunk_size: size of chunk read from socket
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = u''
+    array = None
+    chunks = response.iter_content(chunk_size)
+    for chunk in chunks:
+        buf += utf8.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in u' \t\r\n,':
+                pos += 1
+            if pos == len(buf):
+                break
+            if array is None:
+                if buf[pos] != u'[':
+                    # not an array, decode document at once
+                    array = False
+                    break
+                array = True
+                pos += 1
+                continue
+            if buf[pos] == u']':
+                return
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # element is not fully received yet
+                break
+            yield obj
+        buf = buf[pos:]
+        if array is False:
+            buf += u''.join(utf8.decode(chunk) for chunk in chunks)
+            break
+
+    buf = buf.strip()
+    if array:
+        raise ValueError('unexpected end of JSON array: %r' % buf[:100])
+    if buf:
+        obj = json.loads(buf)
+        if obj is not None:
+            yield obj
+
+
+def iter_extents(response, piece_size=4 * 1024 ** 2, chunk_size=65536):
+    """Decode extent stream of snapshot diff.
+    Every extent is JSON header line {"offset": <bytes>, "length": <bytes>, "hole": <bool>}
+    followed by length bytes of data unless extent is a hole. Data is yielded in pieces,
+    so at most one piece is kept in memory.
+    :param response: response of request made with stream=True
+    :param piece_size: max size of yielded data
+    :param chunk_size: size of chunk read from socket
+    :return: generator of (offset, length, data), data is None for holes
+    """
+    buf = bytearray()
+    # [offset, remaining length] of extent which data is being read
+    extent = None
+    for chunk in response.iter_content(chunk_size):
+        buf += chunk
+        while True:
+            if extent is None:
+                end = buf.find(b'\n')
+                if end < 0:
+                    break
+                line = bytes(buf[:end]).strip()
+                del buf[:end + 1]
+                if not line:
+                    continue
+                header = json.loads(line.decode('utf-8'))
+                offset, length = int(header['offset']), int(header['length'])
+                if header.get('hole'):
+                    yield offset, length, None
+                elif length:
+                    extent = [offset, length]
+                continue
+            size = min(extent[1], piece_size)
+            if len(buf) < size:
+                break
+            yield extent[0], size, bytes(buf[:size])
+            del buf[:size]
+            extent[0] += size
+            extent[1] -= size
+            if not extent[1]:
+                extent = None
+
+    if extent is not None or bytes(buf).strip():
+        raise ValueError('unexpected end of extent stream')
+
+
+def parse_addresses(management_address):
+    """Split comma separated list of management addresses"""
+    if isinstance(management_address, (list, tuple)):
+        return list(management_address)
+    return [address.strip() for address in management_address.split(',') if address.strip()]
+
+
+def _not_sent(e):
+    """Check if failed request did not reach daemon and can be sent to another node"""
+    if isinstance(e, (CircuitOpenError, requests.exceptions.ConnectTimeout)):
+        return True
+    reason = e.args[0] if e.args else None
+    return isinstance(getattr(reason, 'reason', reason), NewConnectionError)
+
+
+class _Node(object):
+    """management address of znstor cluster"""
+
+    def __init__(self, address, prefix, breaker):
+        self.address = address
+        self.prefix = prefix
+        self.breaker = breaker
+
+    def __repr__(self):
+        return '<Node %s: %s>' % (self.address, self.breaker.state)
+
+
 class RestClientURL(object):
     """znstor rest client"""
 
     def __init__(self, **kwargs):
         """Initialize a REST client
-        :key management_address: Storage management interface (ip or dns)
+        :key management_address: Storage management interface (ip or dns). Comma separated list
+        or list of addresses of cluster nodes: reads are spread across healthy nodes, mutations
+        are sent to the active node, which is switched to the next healthy node on failure.
         :key api_version: Storage RestApi version (only v1 supported)
         :key pool: zpoolID
         :key domain: znstor domainID, actually is first level dataset in pool.
-        :key timeout: request timeout. Default is 180 seconds.
+        :key timeout: read timeout of request. Default is 180 seconds.
+        :key connect_timeout: connect timeout of request. Default is 5 seconds.
+        :key failover_connect_timeout: connect timeout used when there are several
+        management addresses, so dead node is skipped quickly. Default is 0.5 seconds.
+        :key retries: number of times failed idempotent request is retried. Default is 3.
+        :key retry_backoff: first retry delay in seconds, doubled with every retry,
+        actual delay is random up to it. Default is 0.2.
+        :key breaker_threshold: consecutive failures making client fail fast, 0 disables breaker. Default is 5.
+        :key breaker_reset: seconds before failing client probes daemon again. Default is 30.
         :key user: znstor user
         :key passwd: znstor password
+        :key pool_size: max number of keep-alive connections to the daemon.
+        Should match the number of greenthreads issuing requests. Default is 10.
+        :key pool_block: block when pool is exhausted instead of opening
+        throwaway connections. Default is False.
+        :key idle_timeout: close pooled connections that were not used for
+        this number of seconds. Default is 60 seconds, 0 disables reaping.
+        :key metrics: Metrics instance requests are accounted in. Default is in-memory only.
         """
 
         self.management_address = kwargs.get('management_address', '127.0.0.1:10987')
+        self.addresses = parse_addresses(self.management_address)
         self.api_version = kwargs.get('api_version', 'v1')
         self.pool = kwargs.get('pool', 'tank')
         self.domain = kwargs.get('domain', 'default')
         self.timeout = kwargs.get('timeout', 180)
+        self.connect_timeout = kwargs.get('connect_timeout', 5)
+        if len(self.addresses) > 1:
+            self.connect_timeout = min(self.connect_timeout, kwargs.get('failover_connect_timeout', 0.5))
+        self.retries = kwargs.get('retries', 3)
+        self.retry_backoff = kwargs.get('retry_backoff', 0.2)
         self.mng_user = kwargs.get('user', 'znstor')
         self.mng_passwd = kwargs.get('passwd', 'nevada')
         self.basic_auth = HTTPBasicAuth(self.mng_user, self.mng_passwd)
@@ -44,56 +202,226 @@ class RestClientURL(object):
         self.headers = {'Content-Type': 'application/json',
                         'User-Agent': 'znstor-RESTClient'}
 
+        self.pool_size = kwargs.get('pool_size', 10)
+        self.pool_block = kwargs.get('pool_block', False)
+        self.idle_timeout = kwargs.get('idle_timeout', 60)
+
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._last_used = 0
+        self.metrics = kwargs.get('metrics') or Metrics()
+
+        self._nodes = [_Node(address,
+                             '%s%s' % (self.schema, address),
+                             CircuitBreaker(address,
+                                            failure_threshold=kwargs.get('breaker_threshold', 5),
+                                            reset_timeout=kwargs.get('breaker_reset', 30)))
+                       for address in self.addresses]
+        # node mutations are sent to
+        self._active = 0
+        # round robin position of reads
+        self._next = 0
+        self._nodes_lock = threading.Lock()
+
+        self._base_paths = {
+            'projects': "/api/{version}/storage/domains/{domain}/pools/{pool}/projects".format(
+                version=self.api_version,
+                domain=self.domain,
+                pool=self.pool
+            ),
+            'hosts': "/api/{version}/storage/hosts".format(version=self.api_version),
+            'targets': "/api/{version}/storage/targets".format(version=self.api_version),
+        }
+        # endpoint name -> url template with base path
+        self._urls = {}
+
+    def _new_session(self):
+        """create keep-alive session with connection pool"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self._nodes),
+                              pool_maxsize=self.pool_size,
+                              pool_block=self.pool_block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(self.headers)
+        session.auth = self.basic_auth
+        return session
+
+    def session(self):
+        """Return pooled session.
+        Connections idle for more than idle_timeout are dropped before reuse,
+        daemon side usually closes them anyway and first request would fail.
+        """
+        with self._session_lock:
+            now = time.time()
+            if self._session is not None and self.idle_timeout and \
+                    now - self._last_used > self.idle_timeout:
+                LOG.debug('closing idle connections to %s', self.management_address)
+                self._session.close()
+                self._session = None
+            if self._session is None:
+                self._session = self._new_session()
+            self._last_used = now
+            return self._session
+
+    def close(self):
+        """close all pooled connections"""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def status(self):
+        """Return state of management addresses"""
+        with self._nodes_lock:
+            active = self._nodes[self._active]
+        return dict((node.address, dict(node.breaker.status(), active=node is active))
+                    for node in self._nodes)
+
+    def _pick(self, idempotent, tried):
+        """Choose node for request
+        :param idempotent: reads are spread across healthy nodes, mutations go to the active node
+        :param tried: nodes request already failed on
+        """
+        with self._nodes_lock:
+            healthy = [node for node in self._nodes if node not in tried and node.breaker.available()]
+            active = self._nodes[self._active]
+            if not healthy:
+                # nothing to choose from, breaker of the active node fails request
+                return active
+            if idempotent:
+                self._next = (self._next + 1) % len(healthy)
+                return healthy[self._next]
+            if active in healthy:
+                return active
+            LOG.warning('znstord %s is unavailable, switching to %s', active.address, healthy[0].address)
+            self._active = self._nodes.index(healthy[0])
+            return healthy[0]
+
     def projects_base_path(self):
-        """build rest url path"""
-        return """{protocol}{management_address}/api/{version}\
-/storage/domains/{domain}/pools/{pool}/projects""".format(
-            protocol=self.schema,
-            management_address=self.management_address,
-            version=self.api_version,
-            domain=self.domain,
-            pool=self.pool
-        )
+        """rest url path of projects"""
+        return self._base_paths['projects']
 
     def hosts_base_path(self):
-        """build rest url path"""
-        return "{protocol}{management_address}/api/{version}/storage/hosts".format(
-            protocol=self.schema,
-            management_address=self.management_address,
-            version=self.api_version,
-        )
+        """rest url path of hostgroups"""
+        return self._base_paths['hosts']
 
     def targets_base_path(self):
-        """build rest url path"""
-        return "{protocol}{management_address}/api/{version}/storage/targets".format(
-            protocol=self.schema,
-            management_address=self.management_address,
-            version=self.api_version,
-        )
-
-    def request(self, path, method, body=None):
+        """rest url path of targets"""
+        return self._base_paths['targets']
+
+    def url(self, endpoint, **kwargs):
+        """Build url of endpoint
+        :param endpoint: endpoints.Endpoint
+        :param kwargs: path arguments
+        """
+        template = self._urls.get(endpoint.name)
+        if template is None:
+            template = self._urls[endpoint.name] = self._base_paths[endpoint.base] + endpoint.path
+        return template.format(**kwargs) if kwargs else template
+
+    def request(self, path, method, body=None, params=None, stream=False, template=None,
+                timeout=None, idempotent=False, node=None):
         """Make an HTTP request and return the result
-        :param path: Path used with the initialized URL to make a request
+        :param path: path relative to management address, see url()
         :param method: HTTP request type (GET, POST, PUT, DELETE)
         :param body: HTTP body of request
+        :param params: query string parameters
+        :param stream: do not read response body. Response must be closed by caller.
+        :param template: endpoint template request is accounted under, derived from path if omitted
+        :param timeout: read timeout, client timeout if omitted
+        :param idempotent: request may be repeated, it is retried on connection errors,
+        timeouts and 5xx responses
+        :param node: address request is pinned to, ex: node which accepted the job being polled.
+        Response has address of node which served it in node attribute.
         """
 
-        HTTPBasicAuth(self.mng_user, self.mng_passwd)
+        LOG.debug('PATH: %s, METHOD: %s, BODY: %s, PARAMS: %s', path, method, body, params)
 
-        LOG.debug('PATH: %s, METHOD: %s, BODY: %s' % (path, method, body))
+        endpoint = '%s %s' % (method, template or url_template(path))
+        pinned = None
+        if node is not None:
+            pinned = [n for n in self._nodes if n.address == node]
+            if not pinned:
+                raise ValueError('unknown management address %s' % node)
+            pinned = pinned[0]
+        # nodes request may be sent to
+        count = 1 if pinned else len(self._nodes)
+        # mutations are sent to another node only if they did not reach the daemon
+        attempts = 1 + self.retries if idempotent else count
+        tried = set()
+        for attempt in range(attempts):
+            last = attempt + 1 == attempts
+            node = pinned or self._pick(idempotent, tried)
+            try:
+                node.breaker.before()
+                response = self._send(node, endpoint, path, method, body, params, stream, timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                opened = isinstance(e, CircuitOpenError)
+                if not opened:
+                    node.breaker.failure()
+                tried.add(node)
+                if last or not (idempotent or _not_sent(e)):
+                    raise
+                if len(tried) == count:
+                    if opened:
+                        # all nodes are unavailable, fail fast
+                        raise
+                    tried.clear()
+                else:
+                    # failover to another node right away
+                    LOG.warning('%s failed on %s, trying another node. Err: %s', endpoint, node.address, e)
+                    continue
+                LOG.warning('%s failed, retrying. Err: %s', endpoint, e)
+            except requests.exceptions.RequestException:
+                # broken response body, decoding errors: daemon misbehaves, not retried
+                node.breaker.failure()
+                raise
+            except Exception:
+                # local failure, breaker probe must not stay in flight
+                node.breaker.cancel()
+                raise
+            else:
+                response.node = node.address
+                if response.status_code < 500:
+                    node.breaker.success()
+                    return response
+                node.breaker.failure()
+                if last or not idempotent:
+                    return response
+                LOG.warning('%s failed on %s with %d, retrying', endpoint, node.address, response.status_code)
+                response.close()
+                tried.add(node)
+                if len(tried) < count:
+                    continue
+                tried.clear()
+            time.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
 
-        response = requests.request(method=method,
-                                    url=path,
-                                    timeout=self.timeout,
-                                    json=body,
-                                    headers=self.headers,
-                                    auth=self.basic_auth)
+    def _send(self, node, endpoint, path, method, body, params, stream, timeout):
+        self.metrics.start(endpoint)
+        started = time.time()
+        try:
+            response = self.session().request(method=method,
+                                              url=node.prefix + path,
+                                              timeout=(self.connect_timeout, timeout or self.timeout),
+                                              json=body,
+                                              params=params,
+                                              stream=stream)
+        except Exception:
+            self.metrics.finish(endpoint, STATUS_ERROR, time.time() - started)
+            raise
 
+        if stream:
+            bytes_in = int(response.headers.get('Content-Length') or 0)
+        else:
+            bytes_in = len(response.content)
+        self.metrics.finish(endpoint, response.status_code, time.time() - started,
+                            bytes_out=len(response.request.body or ''), bytes_in=bytes_in)
         return response
 
-    def get(self, path):
+    def get(self, path, params=None, stream=False):
         """get method"""
-        return self.request(path, 'GET', '')
+        return self.request(path, 'GET', '', params=params, stream=stream)
 
     def put(self, path, body=''):
         """put method"""
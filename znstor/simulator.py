@@ -0,0 +1,767 @@
+# -*- coding: utf-8 -*-
+"""In-process znstord simulator.
+
+Implements the subset of znstord REST API used by restapi module, so the
+client and cinder driver can be tested and benchmarked without an array:
+
+    sim = Simulator(latency=0.002, job_duration=0.05).start()
+    storage = restapi.Znstor(management_address=sim.address)
+    ...
+    sim.stop()
+
+or standalone: python simulator.py --port 10987 --latency 0.002
+"""
+
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+JOB_INPROGRESS = "In Progress"
+JOB_COMPLETED = "Completed Successfully"
+JOB_FAILED = "Failed"
+
+# granularity of simulated volume data
+BLOCK_SIZE = 4096
+
+
+class SimulatorError(Exception):
+    def __init__(self, code, message):
+        super(SimulatorError, self).__init__(message)
+        self.code = code
+        self.message = message
+
+
+def _not_found(kind, name):
+    return SimulatorError(404, '%s %s not found' % (kind, name))
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(raw.decode('utf-8')) if raw.strip() else None
+        except ValueError:
+            body = None
+        code, payload = self.server.simulator.dispatch(self.command, self.path, body)
+        if isinstance(payload, _Raw):
+            data, content_type = payload.data, 'application/octet-stream'
+        else:
+            data, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class Simulator(object):
+    """znstord stand-in serving REST API from memory"""
+
+    def __init__(self, host='127.0.0.1', port=0, **kwargs):
+        """
+        :param host: listen address
+        :param port: listen port, 0 - pick free port
+        :key latency: seconds added to every request. Default is 0.
+        :key jitter: random seconds added to latency. Default is 0.
+        :key job_duration: seconds destroy job stays in progress. Default is 0.05.
+        :key failure_rate: share of requests failed with 500. Default is 0.
+        :key job_failure_rate: share of destroy jobs finished with failure. Default is 0.
+        :key paging: support offset/limit/alias/count parameters of volume listing. Default is True.
+        :key seed: random seed for reproducible failures
+        """
+        self.host = host
+        self.port = port
+        self.latency = kwargs.get('latency', 0)
+        self.jitter = kwargs.get('jitter', 0)
+        self.job_duration = kwargs.get('job_duration', 0.05)
+        self.failure_rate = kwargs.get('failure_rate', 0)
+        self.job_failure_rate = kwargs.get('job_failure_rate', 0)
+        self.paging = kwargs.get('paging', True)
+        self.random = random.Random(kwargs.get('seed'))
+
+        self.lock = threading.RLock()
+        self.projects = {}
+        self.hostgroups = {}
+        self.targetgroups = {}
+        self.tpgs = {}
+        self.jobs = {}
+        # "METHOD route" -> number of requests
+        self.requests = {}
+
+        self._server = None
+        self._thread = None
+        self._routes = [(method, re.compile('^' + pattern + '$'), getattr(self, handler))
+                        for method, pattern, handler in self.ROUTES]
+
+    ROUTES = [
+        ('GET', r'/projects', 'project_list'),
+        ('POST', r'/projects/(?P<project>[^/]+)', 'project_create'),
+        ('GET', r'/projects/(?P<project>[^/]+)', 'project_get'),
+        ('PUT', r'/projects/(?P<project>[^/]+)', 'project_set'),
+        ('DELETE', r'/projects/(?P<project>[^/]+)', 'project_destroy'),
+        ('GET', r'/projects/(?P<project>[^/]+)/exists', 'project_exists'),
+        ('GET', r'/projects/(?P<project>[^/]+)/volumes', 'volume_list'),
+        ('POST', r'/projects/(?P<project>[^/]+)/volumes', 'volume_create'),
+        ('GET', r'/projects/(?P<project>[^/]+)/volumes/job/(?P<job>[^/]+)', 'job_status'),
+        ('GET', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)', 'volume_get'),
+        ('DELETE', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)', 'volume_destroy'),
+        ('PUT', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/resize', 'volume_resize'),
+        ('PUT', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/compression/(?P<compression>[^/]+)',
+         'volume_compression'),
+        ('PUT', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/export', 'volume_export'),
+        ('PUT', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/unexport', 'volume_unexport'),
+        ('GET', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/exports', 'volume_exports'),
+        ('GET', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/snapshots', 'snapshot_list'),
+        ('POST', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/snapshots/(?P<snapshot>[^/]+)',
+         'snapshot_create'),
+        ('GET', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/snapshots/(?P<snapshot>[^/]+)',
+         'snapshot_get'),
+        ('DELETE', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/snapshots/(?P<snapshot>[^/]+)',
+         'snapshot_destroy'),
+        ('POST', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/snapshots/(?P<snapshot>[^/]+)/clone',
+         'snapshot_clone'),
+        ('PUT', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/snapshots/(?P<snapshot>[^/]+)/rollback',
+         'snapshot_rollback'),
+        ('POST', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/snapshots/(?P<snapshot>[^/]+)/send',
+         'snapshot_send'),
+        ('GET', r'/projects/(?P<project>[^/]+)/volumes/(?P<volume>[^/]+)/snapshots/(?P<snapshot>[^/]+)/diff',
+         'snapshot_diff'),
+        ('POST', r'/projects/(?P<project>[^/]+)/snapshots/(?P<snapshot>[^/]+)', 'project_snapshot_create'),
+        ('DELETE', r'/projects/(?P<project>[^/]+)/snapshots/(?P<snapshot>[^/]+)', 'project_snapshot_destroy'),
+        ('GET', r'/hosts', 'hostgroup_list'),
+        ('POST', r'/hosts/(?P<hostgroup>[^/]+)', 'hostgroup_create'),
+        ('GET', r'/hosts/(?P<hostgroup>[^/]+)', 'hostgroup_get'),
+        ('DELETE', r'/hosts/(?P<hostgroup>[^/]+)', 'hostgroup_delete'),
+        ('PUT', r'/hosts/(?P<hostgroup>[^/]+)/add/(?P<member>[^/]+)', 'hostgroup_add_member'),
+        ('PUT', r'/hosts/(?P<hostgroup>[^/]+)/add/(?P<member>[^/]+)/force', 'hostgroup_add_member'),
+        ('PUT', r'/hosts/(?P<hostgroup>[^/]+)/remove/(?P<member>[^/]+)', 'hostgroup_remove_member'),
+        ('GET', r'/targets/tg', 'targetgroup_list'),
+        ('POST', r'/targets/tg/(?P<targetgroup>[^/]+)', 'targetgroup_create'),
+        ('GET', r'/targets/tg/(?P<targetgroup>[^/]+)', 'targetgroup_get'),
+        ('DELETE', r'/targets/tg/(?P<targetgroup>[^/]+)', 'targetgroup_delete'),
+        ('PUT', r'/targets/tg/(?P<targetgroup>[^/]+)/add/(?P<member>[^/]+)', 'targetgroup_add_member'),
+        ('PUT', r'/targets/tg/(?P<targetgroup>[^/]+)/remove/(?P<member>[^/]+)', 'targetgroup_remove_member'),
+        ('POST', r'/targets/tpg/(?P<tpg>[^/]+)', 'targetportgroup_create'),
+        ('DELETE', r'/targets/tpg/(?P<tpg>[^/]+)', 'targetportgroup_delete'),
+    ]
+
+    # server
+
+    @property
+    def address(self):
+        """management address for restapi client"""
+        return '%s:%d' % (self.host, self.port)
+
+    def start(self):
+        """Start serving in background thread"""
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.simulator = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='znstor-simulator')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def request_count(self):
+        """Return total number of served requests"""
+        with self.lock:
+            return sum(self.requests.values())
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests.clear()
+
+    def dispatch(self, method, path, body):
+        """Route request to handler
+        :return: (status code, payload)
+        """
+        url = urlparse(path)
+        query = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        route = re.sub(r'^/api/v1/storage(/domains/[^/]+/pools/[^/]+)?', '', url.path)
+
+        delay = self.latency + (self.random.random() * self.jitter if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        for route_method, pattern, handler in self._routes:
+            if route_method != method:
+                continue
+            match = pattern.match(route)
+            if match is None:
+                continue
+            with self.lock:
+                key = '%s %s' % (method, handler.__name__)
+                self.requests[key] = self.requests.get(key, 0) + 1
+                if self.failure_rate and self.random.random() < self.failure_rate:
+                    return 500, {'message': 'injected failure'}
+                self._finish_jobs()
+                try:
+                    return 200, handler(body=body or {}, query=query, **match.groupdict())
+                except SimulatorError as e:
+                    return e.code, {'message': e.message}
+                except _Accepted as e:
+                    return 202, {'message': e.job}
+        return 404, {'message': 'no route %s %s' % (method, url.path)}
+
+    # state helpers
+
+    def _project(self, name):
+        if name not in self.projects:
+            raise _not_found('project', name)
+        return self.projects[name]
+
+    def _volume(self, project, volume):
+        volumes = self._project(project)['volumes']
+        if volume not in volumes:
+            raise _not_found('volume', volume)
+        return volumes[volume]
+
+    def _snapshot(self, project, volume, snapshot):
+        snapshots = self._volume(project, volume)['snapshots']
+        if snapshot not in snapshots:
+            raise _not_found('snapshot', snapshot)
+        return snapshots[snapshot]
+
+    @staticmethod
+    def _used(project, vol):
+        """space taken by volume: thick volume reserves volsize, thin volume and clone
+        take blocks written to them"""
+        if not vol['origin'] and vol['options'].get('thin') is False:
+            return vol['volsize']
+        shared = {}
+        if vol['origin']:
+            parent, snapshot = vol['origin']
+            origin = project['volumes'].get(parent, {}).get('snapshots', {}).get(snapshot)
+            shared = origin['blocks'] if origin else {}
+        return BLOCK_SIZE * sum(1 for index, block in vol['blocks'].items() if shared.get(index) != block)
+
+    def _project_view(self, project):
+        used = sum(self._used(project, vol) for vol in project['volumes'].values())
+        options = dict(project['options'])
+        options.update(used=used, available=max(options.get('quota', 0) - used, 0))
+        return {'project': project['name'], 'alias': project.get('alias'), 'options': options}
+
+    @staticmethod
+    def _lu(vol):
+        return {'LUName': vol['id'], 'Alias': vol['alias'],
+                'SerialNum': vol['serial'], 'Size': vol['volsize']}
+
+    def _list_entry(self, vol):
+        entry = self._lu(vol)
+        entry.update(id=vol['id'], alias=vol['alias'])
+        return entry
+
+    def _volume_view(self, project, vol):
+        options = dict(vol['options'], volsize=vol['volsize'], used=self._used(project, vol),
+                       referenced=BLOCK_SIZE * len(vol['blocks']))
+        if vol.get('origin'):
+            options['origin'] = vol['origin']
+        return {
+            'id': vol['id'],
+            'alias': vol['alias'],
+            'vol': {'dataset': '%s/%s' % (project['dataset'], vol['id']), 'options': options},
+            'lu': self._lu(vol),
+            'views': list(vol['views']),
+        }
+
+    def _snapshot_view(self, project, vol, name):
+        snap = vol['snapshots'][name]
+        return {'dataset': '%s/%s@%s' % (project['dataset'], vol['id'], name),
+                'creation': snap['creation'], 'clones': sorted(snap['clones'])}
+
+    def _new_volume(self, project, alias, volsize, options, origin=None):
+        guid = uuid.uuid4().hex.upper()
+        vol = {'id': guid, 'alias': alias, 'serial': guid[:16].lower(), 'volsize': int(volsize),
+               'options': options, 'origin': origin, 'views': [], 'snapshots': {},
+               'destroying': False, 'blocks': {}}
+        project['volumes'][guid] = vol
+        return vol
+
+    @staticmethod
+    def _new_snapshot(vol, creation=None):
+        """snapshot keeps blocks of volume at the moment it was taken"""
+        return {'creation': creation or time.time(), 'clones': set(), 'blocks': dict(vol['blocks'])}
+
+    def _submit_job(self, project, action, total=None):
+        job = uuid.uuid4().hex
+        failed = self.job_failure_rate and self.random.random() < self.job_failure_rate
+        now = time.time()
+        self.jobs[job] = {'project': project, 'started_at': now, 'finish_at': now + self.job_duration,
+                          'action': action, 'status': JOB_FAILED if failed else JOB_INPROGRESS,
+                          'total': total}
+        raise _Accepted(job)
+
+    def _finish_jobs(self):
+        now = time.time()
+        for job in self.jobs.values():
+            if job['status'] == JOB_INPROGRESS and job['finish_at'] <= now:
+                job['action']()
+                job['status'] = JOB_COMPLETED
+
+    def populate(self, project, count, volsize=1024 ** 3, prefix='volume-'):
+        """Create project with count volumes without going through REST"""
+        with self.lock:
+            if project not in self.projects:
+                self.project_create(project=project, body={'quota': count * volsize * 2}, query={})
+            proj = self.projects[project]
+            return [self._list_entry(self._new_volume(proj, '%s%d' % (prefix, index), volsize, {}))
+                    for index in range(count)]
+
+    def write(self, project, volume, offset, data):
+        """Write data to volume without going through REST, like initiator would"""
+        with self.lock:
+            vol = self._volume(project, volume)
+            if offset < 0 or offset + len(data) > vol['volsize']:
+                raise SimulatorError(400, 'write beyond end of volume')
+            end = offset + len(data)
+            while offset < end:
+                index, start = divmod(offset, BLOCK_SIZE)
+                size = min(BLOCK_SIZE - start, end - offset)
+                block = bytearray(vol['blocks'].get(index, b'\0' * BLOCK_SIZE))
+                block[start:start + size] = data[:size]
+                vol['blocks'][index] = bytes(block)
+                data = data[size:]
+                offset += size
+
+    # projects
+
+    def project_list(self, body, query):
+        return [self._project_view(p) for p in self.projects.values()]
+
+    def project_create(self, project, body, query):
+        if project in self.projects:
+            raise SimulatorError(400, 'project %s already exists' % project)
+        options = dict((k, v) for k, v in body.items() if k != 'alias')
+        self.projects[project] = {'name': project, 'alias': body.get('alias'), 'options': options,
+                                  'dataset': 'tank/default/%s' % project, 'volumes': {}}
+        return self._project_view(self.projects[project])
+
+    def project_get(self, project, body, query):
+        return self._project_view(self._project(project))
+
+    def project_set(self, project, body, query):
+        proj = self._project(project)
+        if 'alias' in body:
+            proj['alias'] = body.pop('alias')
+        proj['options'].update(body)
+        return self._project_view(proj)
+
+    def project_destroy(self, project, body, query):
+        if self._project(project)['volumes']:
+            raise SimulatorError(400, 'project %s is not empty' % project)
+        del self.projects[project]
+        return {}
+
+    def project_exists(self, project, body, query):
+        self._project(project)
+        return {}
+
+    # volumes
+
+    def volume_list(self, project, body, query):
+        volumes = [vol for vol in self._project(project)['volumes'].values() if not vol['destroying']]
+        if not self.paging:
+            return [self._list_entry(vol) for vol in volumes]
+        if 'alias' in query:
+            volumes = [vol for vol in volumes if vol['alias'] == query['alias']]
+        if query.get('count') == 'true':
+            return {'count': len(volumes)}
+        volumes.sort(key=lambda vol: vol['id'])
+        offset = int(query.get('offset', 0))
+        if 'limit' in query:
+            volumes = volumes[offset:offset + int(query['limit'])]
+        return [self._list_entry(vol) for vol in volumes]
+
+    def volume_create(self, project, body, query):
+        proj = self._project(project)
+        if not body.get('alias') or not body.get('volsize'):
+            raise SimulatorError(400, 'alias and volsize are required')
+        options = dict(body.get('options') or {})
+        for key in ('volblocksize', 'reservation', 'dedup', 'thin'):
+            if key in body:
+                options[key] = body[key]
+        vol = self._new_volume(proj, body['alias'], body['volsize'], options)
+        return self._volume_view(proj, vol)
+
+    def volume_get(self, project, volume, body, query):
+        return self._volume_view(self._project(project), self._volume(project, volume))
+
+    def volume_destroy(self, project, volume, body, query):
+        proj = self._project(project)
+        vol = self._volume(project, volume)
+        if vol['snapshots']:
+            raise SimulatorError(400, 'volume %s has snapshots' % volume)
+
+        def destroy():
+            proj['volumes'].pop(volume, None)
+            if vol['origin']:
+                parent, snapshot = vol['origin']
+                snap = proj['volumes'].get(parent, {}).get('snapshots', {}).get(snapshot)
+                if snap is not None:
+                    snap['clones'].discard(volume)
+        vol['destroying'] = True
+        self._submit_job(project, destroy)
+
+    def job_status(self, project, job, body, query):
+        if job not in self.jobs:
+            raise _not_found('job', job)
+        job = self.jobs[job]
+        status = {'message': job['status']}
+        if job['total'] is not None:
+            done = 1.0 if job['status'] == JOB_COMPLETED else min(
+                (time.time() - job['started_at']) / (self.job_duration or 1), 1.0)
+            status['progress'] = {'bytes': int(job['total'] * done), 'total': job['total']}
+        return status
+
+    def volume_resize(self, project, volume, body, query):
+        vol = self._volume(project, volume)
+        vol['volsize'] = int(body['volsize'])
+        last = (vol['volsize'] + BLOCK_SIZE - 1) // BLOCK_SIZE
+        vol['blocks'] = dict((index, block) for index, block in vol['blocks'].items() if index < last)
+        return self._volume_view(self._project(project), vol)
+
+    def volume_compression(self, project, volume, compression, body, query):
+        vol = self._volume(project, volume)
+        vol['options']['compression'] = compression
+        return self._volume_view(self._project(project), vol)
+
+    def volume_export(self, project, volume, body, query):
+        vol = self._volume(project, volume)
+        hostgroup, targetgroup = body.get('hostgroup'), body.get('targetgroup')
+        if hostgroup not in self.hostgroups:
+            raise _not_found('hostgroup', hostgroup)
+        for view in vol['views']:
+            if view['HostGroup'] == hostgroup and view['TargetGroup'] == targetgroup:
+                raise SimulatorError(400, 'view already exists')
+        lun = body.get('lun', -1)
+        if lun is None or lun < 0:
+            used = set(view['LUN'] for proj in self.projects.values()
+                       for other in proj['volumes'].values() for view in other['views']
+                       if view['HostGroup'] == hostgroup)
+            lun = 0
+            while lun in used:
+                lun += 1
+        vol['views'].append({'HostGroup': hostgroup, 'TargetGroup': targetgroup, 'LUN': lun})
+        return self._volume_view(self._project(project), vol)
+
+    def volume_unexport(self, project, volume, body, query):
+        vol = self._volume(project, volume)
+        views = [view for view in vol['views']
+                 if not (view['HostGroup'] == body.get('hostgroup') and
+                         view['TargetGroup'] == body.get('targetgroup'))]
+        if len(views) == len(vol['views']):
+            raise SimulatorError(400, 'view does not exist')
+        vol['views'] = views
+        return self._volume_view(self._project(project), vol)
+
+    def volume_exports(self, project, volume, body, query):
+        return list(self._volume(project, volume)['views'])
+
+    # snapshots
+
+    def snapshot_list(self, project, volume, body, query):
+        vol = self._volume(project, volume)
+        names = sorted(vol['snapshots'], key=lambda name: vol['snapshots'][name]['creation'])
+        return [self._snapshot_view(self._project(project), vol, name) for name in names]
+
+    def snapshot_create(self, project, volume, snapshot, body, query):
+        vol = self._volume(project, volume)
+        if snapshot in vol['snapshots']:
+            raise SimulatorError(400, 'snapshot %s already exists' % snapshot)
+        vol['snapshots'][snapshot] = self._new_snapshot(vol)
+        return self._snapshot_view(self._project(project), vol, snapshot)
+
+    def snapshot_get(self, project, volume, snapshot, body, query):
+        self._snapshot(project, volume, snapshot)
+        return self._snapshot_view(self._project(project), self._volume(project, volume), snapshot)
+
+    def snapshot_destroy(self, project, volume, snapshot, body, query):
+        vol = self._volume(project, volume)
+        if self._snapshot(project, volume, snapshot)['clones']:
+            raise SimulatorError(400, 'snapshot %s has dependent clones' % snapshot)
+        self._submit_job(project, lambda: vol['snapshots'].pop(snapshot, None))
+
+    def snapshot_clone(self, project, volume, snapshot, body, query):
+        proj = self._project(project)
+        vol = self._volume(project, volume)
+        snap = self._snapshot(project, volume, snapshot)
+        if not body.get('alias'):
+            raise SimulatorError(400, 'alias is required')
+        clone = self._new_volume(proj, body['alias'], vol['volsize'], dict(vol['options']),
+                                 origin=(volume, snapshot))
+        snap['clones'].add(clone['id'])
+        clone['blocks'] = dict(snap['blocks'])
+        view = self._volume_view(proj, clone)
+        view['vol']['options']['origin'] = '%s/%s@%s' % (proj['dataset'], volume, snapshot)
+        return view
+
+    def snapshot_rollback(self, project, volume, snapshot, body, query):
+        vol = self._volume(project, volume)
+        snap = self._snapshot(project, volume, snapshot)
+        newer = [name for name, other in vol['snapshots'].items() if other['creation'] > snap['creation']]
+        if newer:
+            raise SimulatorError(400, 'more recent snapshots exist: %s' % ', '.join(sorted(newer)))
+        vol['blocks'] = dict(snap['blocks'])
+        return self._volume_view(self._project(project), vol)
+
+    def snapshot_send(self, project, volume, snapshot, body, query):
+        vol = self._volume(project, volume)
+        snap = self._snapshot(project, volume, snapshot)
+        # domains and zpools are not simulated, project names are global
+        target = self._project(body.get('project'))
+        alias = body.get('alias')
+        if not alias:
+            raise SimulatorError(400, 'alias is required')
+        received = [other for other in target['volumes'].values() if other['alias'] == alias]
+        base = body.get('base')
+        if base is None:
+            if received:
+                raise SimulatorError(400, 'volume %s already exists' % alias)
+            # full stream carries all volume blocks
+            total = vol['volsize']
+        else:
+            if not received or base not in received[0]['snapshots']:
+                raise SimulatorError(400, 'base snapshot %s is not received by %s' % (base, alias))
+            self._snapshot(project, volume, base)
+            # incremental stream carries blocks changed since base, no data is simulated
+            total = vol['volsize'] // 100
+
+        def receive():
+            dest = received[0] if received else self._new_volume(
+                target, alias, vol['volsize'], dict(vol['options']))
+            dest['volsize'] = vol['volsize']
+            dest['blocks'] = dict(snap['blocks'])
+            dest['snapshots'][snapshot] = self._new_snapshot(dest)
+        self._submit_job(project, receive, total=total)
+
+    def snapshot_diff(self, project, volume, snapshot, body, query):
+        vol = self._volume(project, volume)
+        snap = self._snapshot(project, volume, snapshot)
+        blocks = snap['blocks']
+        align = int(query.get('align') or BLOCK_SIZE)
+        if align <= 0 or align % BLOCK_SIZE:
+            raise SimulatorError(400, 'align must be multiple of %d' % BLOCK_SIZE)
+        unit = align // BLOCK_SIZE
+        base = query.get('base')
+        if base is None:
+            # full stream covers the whole volume, unwritten ranges are holes
+            units = set(index // unit for index in blocks)
+        else:
+            old = self._snapshot(project, volume, base)
+            if old['creation'] > snap['creation']:
+                raise SimulatorError(400, 'base snapshot %s is newer than %s' % (base, snapshot))
+            changed = set(blocks) | set(old['blocks'])
+            units = set(index // unit for index in changed if blocks.get(index) != old['blocks'].get(index))
+
+        volsize = vol['volsize']
+        # [offset, end, hole] of merged extents
+        extents = []
+        for index in sorted(units):
+            start, end = index * align, min((index + 1) * align, volsize)
+            hole = not any(block in blocks for block in range(index * unit, (index + 1) * unit))
+            last = extents[-1][1] if extents else 0
+            if base is None and last < start:
+                extents.append([last, start, True])
+            if extents and extents[-1][1] == start and extents[-1][2] == hole:
+                extents[-1][1] = end
+            else:
+                extents.append([start, end, hole])
+        if base is None and (extents[-1][1] if extents else 0) < volsize:
+            extents.append([extents[-1][1] if extents else 0, volsize, True])
+
+        zero = b'\0' * BLOCK_SIZE
+        stream = []
+        for start, end, hole in extents:
+            header = {'offset': start, 'length': end - start, 'hole': hole}
+            stream.append(json.dumps(header).encode('utf-8') + b'\n')
+            if not hole:
+                data = b''.join(blocks.get(index, zero) for index in
+                                range(start // BLOCK_SIZE, (end + BLOCK_SIZE - 1) // BLOCK_SIZE))
+                stream.append(data[:end - start])
+        return _Raw(b''.join(stream))
+
+    def project_snapshot_create(self, project, snapshot, body, query):
+        proj = self._project(project)
+        volumes = [self._volume(project, volume) for volume in body.get('volumes') or []]
+        if not volumes:
+            raise SimulatorError(400, 'volumes are required')
+        for vol in volumes:
+            if snapshot in vol['snapshots']:
+                raise SimulatorError(400, 'snapshot %s of %s already exists' % (snapshot, vol['id']))
+        # all snapshots share creation time like zfs snapshot of several datasets
+        creation = time.time()
+        for vol in volumes:
+            vol['snapshots'][snapshot] = self._new_snapshot(vol, creation)
+        return [self._snapshot_view(proj, vol, snapshot) for vol in volumes]
+
+    def project_snapshot_destroy(self, project, snapshot, body, query):
+        volumes = [self._volume(project, volume) for volume in body.get('volumes') or []]
+        for vol in volumes:
+            if self._snapshot(project, vol['id'], snapshot)['clones']:
+                raise SimulatorError(400, 'snapshot %s of %s has dependent clones' % (snapshot, vol['id']))
+
+        def destroy():
+            for vol in volumes:
+                vol['snapshots'].pop(snapshot, None)
+        self._submit_job(project, destroy)
+
+    # hostgroups
+
+    def _hostgroup(self, hostgroup):
+        if hostgroup not in self.hostgroups:
+            raise _not_found('hostgroup', hostgroup)
+        return {'HostGroup': hostgroup, 'Members': sorted(self.hostgroups[hostgroup])}
+
+    def hostgroup_list(self, body, query):
+        return [self._hostgroup(name) for name in sorted(self.hostgroups)]
+
+    def hostgroup_create(self, hostgroup, body, query):
+        if hostgroup in self.hostgroups:
+            raise SimulatorError(400, 'hostgroup %s already exists' % hostgroup)
+        self.hostgroups[hostgroup] = set()
+        return self._hostgroup(hostgroup)
+
+    def hostgroup_get(self, hostgroup, body, query):
+        return self._hostgroup(hostgroup)
+
+    def hostgroup_delete(self, hostgroup, body, query):
+        self._hostgroup(hostgroup)
+        del self.hostgroups[hostgroup]
+        return {}
+
+    def hostgroup_add_member(self, hostgroup, member, body, query):
+        self._hostgroup(hostgroup)
+        if member in self.hostgroups[hostgroup]:
+            raise SimulatorError(400, 'member %s already exists' % member)
+        self.hostgroups[hostgroup].add(member)
+        return self._hostgroup(hostgroup)
+
+    def hostgroup_remove_member(self, hostgroup, member, body, query):
+        self._hostgroup(hostgroup)
+        if member not in self.hostgroups[hostgroup]:
+            raise _not_found('member', member)
+        self.hostgroups[hostgroup].discard(member)
+        return self._hostgroup(hostgroup)
+
+    # targetgroups
+
+    def _targetgroup(self, targetgroup):
+        if targetgroup not in self.targetgroups:
+            raise _not_found('targetgroup', targetgroup)
+        return {'TargetGroup': targetgroup, 'Members': sorted(self.targetgroups[targetgroup])}
+
+    def targetgroup_list(self, body, query):
+        return [self._targetgroup(name) for name in sorted(self.targetgroups)]
+
+    def targetgroup_create(self, targetgroup, body, query):
+        if targetgroup in self.targetgroups:
+            raise SimulatorError(400, 'targetgroup %s already exists' % targetgroup)
+        self.targetgroups[targetgroup] = set()
+        return self._targetgroup(targetgroup)
+
+    def targetgroup_get(self, targetgroup, body, query):
+        return self._targetgroup(targetgroup)
+
+    def targetgroup_delete(self, targetgroup, body, query):
+        self._targetgroup(targetgroup)
+        del self.targetgroups[targetgroup]
+        return {}
+
+    def targetgroup_add_member(self, targetgroup, member, body, query):
+        self._targetgroup(targetgroup)
+        self.targetgroups[targetgroup].add(member)
+        return self._targetgroup(targetgroup)
+
+    def targetgroup_remove_member(self, targetgroup, member, body, query):
+        self._targetgroup(targetgroup)
+        self.targetgroups[targetgroup].discard(member)
+        return self._targetgroup(targetgroup)
+
+    def targetportgroup_create(self, tpg, body, query):
+        if tpg in self.tpgs:
+            raise SimulatorError(400, 'target port group %s already exists' % tpg)
+        self.tpgs[tpg] = body or []
+        return {'TargetPortGroup': tpg, 'Members': self.tpgs[tpg]}
+
+    def targetportgroup_delete(self, tpg, body, query):
+        if tpg not in self.tpgs:
+            raise _not_found('target port group', tpg)
+        del self.tpgs[tpg]
+        return {}
+
+
+class _Raw(object):
+    """payload of handler sent as is instead of JSON"""
+
+    def __init__(self, data):
+        self.data = data
+
+
+class _Accepted(Exception):
+    """raised by handlers which started background job"""
+
+    def __init__(self, job):
+        super(_Accepted, self).__init__(job)
+        self.job = job
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='znstord simulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=10987)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--job-duration', type=float, default=0.05)
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--job-failure-rate', type=float, default=0)
+    parser.add_argument('--no-paging', action='store_true')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    sim = Simulator(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                    job_duration=args.job_duration, failure_rate=args.failure_rate,
+                    job_failure_rate=args.job_failure_rate, paging=not args.no_paging,
+                    seed=args.seed).start()
+    sys.stdout.write('znstor simulator listening on %s\n' % sim.address)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sim.stop()
+
+
+if __name__ == '__main__':
+    main()
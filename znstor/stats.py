@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Background collector of backend statistics.
+"""
+
+import sys
+import time
+import logging
+import threading
+
+LOG = logging.getLogger(__name__)
+out_hdlr = logging.StreamHandler(sys.stdout)
+out_hdlr.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+LOG.addHandler(out_hdlr)
+LOG.setLevel(logging.ERROR)
+
+
+class StatsCollector(object):
+    """Refreshes statistics in background and answers from the last snapshot.
+    Changes made by driver operations between refreshes are applied to the
+    snapshot incrementally with adjust(). Snapshot is either a dict of numeric
+    statistics or a dict pool -> dict of numeric statistics.
+    """
+
+    def __init__(self, collect, interval=60):
+        """
+        :param collect: callable() returning dict of numeric statistics or dict of them by pool
+        :param interval: seconds between refreshes
+        """
+        self.collect = collect
+        self.interval = interval
+
+        self._snapshot = None
+        self._updated_at = None
+        self._error = None
+        # list of (time, pool, key, delta) made after snapshot was requested
+        self._deltas = []
+        self._lock = threading.Lock()
+        self._kick = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start background refresh"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='znstor-stats')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def refresh(self, wait=False):
+        """Request refresh
+        :param wait: wait until statistics are collected at least once
+        """
+        self._kick.set()
+        self.start()
+        if wait:
+            self._ready.wait(self.interval)
+
+    def adjust(self, pool=None, **deltas):
+        """Apply change made by driver operation, ex: adjust(volumes=1)
+        :param pool: pool statistics belong to, None if statistics are not split by pool
+        """
+        now = time.time()
+        with self._lock:
+            for key, delta in deltas.items():
+                self._deltas.append((now, pool, key, delta))
+
+    def get(self):
+        """Return last statistics with applied changes.
+        :return: (statistics dict or None, metadata dict)
+        """
+        with self._lock:
+            snapshot = None
+            if self._snapshot is not None:
+                snapshot = dict(self._snapshot)
+                for _, pool, key, delta in self._deltas:
+                    if pool is None:
+                        snapshot[key] = snapshot.get(key, 0) + delta
+                    elif pool in snapshot:
+                        stats = snapshot[pool] = dict(snapshot[pool])
+                        stats[key] = stats.get(key, 0) + delta
+            meta = {
+                'updated_at': self._updated_at,
+                'age': None if self._updated_at is None else time.time() - self._updated_at,
+                'error': self._error,
+            }
+        return snapshot, meta
+
+    def _refresh(self):
+        started = time.time()
+        try:
+            snapshot = self.collect()
+        except Exception as e:
+            LOG.error('statistics refresh failed, keep previous. Err: %s', e)
+            with self._lock:
+                self._error = str(e)
+            return
+        with self._lock:
+            self._snapshot = snapshot
+            self._updated_at = time.time()
+            self._error = None
+            # changes made before refresh was started are part of the new snapshot
+            self._deltas = [d for d in self._deltas if d[0] >= started]
+        self._ready.set()
+
+    def _run(self):
+        while True:
+            self._kick.clear()
+            self._refresh()
+            self._kick.wait(self.interval)
@@ -3,9 +3,24 @@ from oslo_log import log
 from oslo_utils import units
 from cinder import exception
 from cinder import interface
+from cinder.objects import fields
 from cinder.volume import driver
+from cinder.volume import volume_types
+from cinder.volume import utils as volume_utils
 from cinder.volume.drivers.znstor import restapi as znstor_restapi
+from cinder.volume.drivers.znstor import restclient as znstor_restclient
+from cinder.volume.drivers.znstor import jobs as znstor_jobs
+from cinder.volume.drivers.znstor import stats as znstor_stats
+from cinder.volume.drivers.znstor import coalesce as znstor_coalesce
+from cinder.volume.drivers.znstor import asyncapi as znstor_asyncapi
+from cinder.volume.drivers.znstor import metrics as znstor_metrics
+from cinder.volume.drivers.znstor import imagecache as znstor_imagecache
+from cinder.volume.drivers.znstor import pools as znstor_pools
+from collections import OrderedDict
+import re
 import math
+import time
+import threading
 
 CONF = cfg.CONF
 LOG = log.getLogger(__name__)
@@ -17,6 +32,9 @@ OPTS = [
                help='zpool id.'),
     cfg.StrOpt('znstor_project',
                help='project'),
+    cfg.ListOpt('znstor_projects', default=[],
+                help='projects reported as separate cinder pools: "project" in znstor_pool '
+                     'or "zpool/project". Empty - single znstor_project pool.'),
     cfg.IntOpt('quota',
                help='project quota in gb.'),
     cfg.BoolOpt('thin_volumes', default=True,
@@ -26,7 +44,8 @@ OPTS = [
     cfg.StrOpt('oversubs_ratio',
                help='oversubscription ratio.'),
     cfg.StrOpt('management_addr',
-               help='znstor cluster resource group management address.'),
+               help='znstor cluster resource group management address. Comma separated list '
+                    'of node addresses enables read balancing and failover of mutations.'),
     cfg.StrOpt('portal_addr', default='',
                help='ISCSI Target Portal'),
     cfg.StrOpt('portal_iqn', default='',
@@ -34,11 +53,123 @@ OPTS = [
     cfg.StrOpt('target_group', default='tg-openstack',
                help='TargetGroup'),
     cfg.StrOpt('znstor_user', help='username'),
-    cfg.StrOpt('znstor_password', help='password')
+    cfg.StrOpt('znstor_password', help='password'),
+    cfg.IntOpt('znstor_connection_pool_size', default=10,
+               help='keep-alive connections to management address. '
+                    'Should match cinder-volume greenthread concurrency.'),
+    cfg.IntOpt('znstor_connection_idle_timeout', default=60,
+               help='drop pooled connections idle for this many seconds, 0 - never.'),
+    cfg.IntOpt('znstor_volume_index_ttl', default=300,
+               help='reload alias to volume index after this many seconds, 0 - disable index.'),
+    cfg.BoolOpt('znstor_async_delete', default=False,
+                help='return from delete_volume/delete_snapshot as soon as znstor accepted '
+                     'destroy job, completion is checked in background.'),
+    cfg.IntOpt('znstor_async_delete_retries', default=3,
+               help='number of times failed background destroy is retried.'),
+    cfg.IntOpt('znstor_list_page_size', default=500,
+               help='number of volumes requested at once while listing project.'),
+    cfg.IntOpt('znstor_stats_interval', default=60,
+               help='seconds between background refreshes of backend statistics.'),
+    cfg.FloatOpt('znstor_attach_batch_window', default=0.05,
+                 help='seconds to collect attach/detach requests of the host with running batch '
+                      'into one batch, 0 - disable batching.'),
+    cfg.StrOpt('znstor_statsd_address', default='',
+               help='send znstord request metrics to statsd at host:port, empty - disabled.'),
+    cfg.StrOpt('znstor_prometheus_textfile', default='',
+               help='write znstord request metrics in prometheus text format to this file, '
+                    'empty - disabled.'),
+    cfg.IntOpt('znstor_connect_timeout', default=5,
+               help='seconds to wait for connection to management address.'),
+    cfg.FloatOpt('znstor_failover_connect_timeout', default=0.5,
+                 help='connect timeout used when management_addr lists several nodes, '
+                      'so unavailable node is skipped in less than a second.'),
+    cfg.IntOpt('znstor_request_timeout', default=180,
+               help='seconds to wait for znstord response, short reads use smaller timeouts.'),
+    cfg.IntOpt('znstor_request_retries', default=3,
+               help='number of times failed read request or job poll is retried.'),
+    cfg.IntOpt('znstor_breaker_threshold', default=5,
+               help='consecutive znstord failures after which requests fail immediately, '
+                    '0 - disable circuit breaker.'),
+    cfg.IntOpt('znstor_breaker_reset', default=30,
+               help='seconds before znstord is probed again after circuit was opened.'),
+    cfg.BoolOpt('znstor_image_cache', default=True,
+                help='create volumes from images as clones of cached image snapshot.'),
+    cfg.IntOpt('znstor_image_cache_max_count', default=10,
+               help='max number of cached images, least recently used are evicted, 0 - unlimited.'),
+    cfg.IntOpt('znstor_image_cache_max_size_gb', default=0,
+               help='max total size of cached images in gb, 0 - unlimited.'),
+    cfg.IntOpt('znstor_migration_timeout', default=86400,
+               help='seconds to wait for send job of backend-assisted volume migration.'),
+    cfg.BoolOpt('znstor_revert_destroy_newer_snapshots', default=False,
+                help='destroy snapshots newer than the one volume is reverted to. False - revert '
+                     'by copying snapshot data when such snapshots exist. Hidden clone and backup snapshots '
+                     'without clones are always destroyed.'),
 ]
 
 CONF.register_opts(OPTS)
 
+# hidden snapshot volume clones are created from
+CLONE_SNAPSHOT_PREFIX = 'clone-'
+
+# hidden snapshot "backup-<backup id>" the next incremental backup is diffed against
+BACKUP_SNAPSHOT_PREFIX = 'backup-'
+
+# snapshots which are not cinder snapshots, they are destroyed when they are in the way
+HIDDEN_SNAPSHOT_PREFIXES = (CLONE_SNAPSHOT_PREFIX, BACKUP_SNAPSHOT_PREFIX)
+
+# snapshot of all volumes of consistency group
+GROUP_SNAPSHOT_PREFIX = 'group-snapshot-'
+
+# snapshot "migrate-<volume id>" volume is sent to another project with
+MIGRATION_SNAPSHOT_PREFIX = 'migrate-'
+
+# seconds between progress reports of migration pass
+MIGRATION_PROGRESS_INTERVAL = 10
+
+# volume type extra specs: "znstor:<option>" -> allowed values, None - size, bool - boolean
+EXTRA_SPECS = {
+    'thin': bool,
+    'volblocksize': None,
+    'reservation': None,
+    'compression': ['on', 'off', 'lz4', 'lzjb', 'zle', 'gzip'] + ['gzip-%d' % level for level in range(1, 10)],
+    'logbias': ['latency', 'throughput'],
+    'sync': ['standard', 'always', 'disabled'],
+    'primarycache': ['all', 'none', 'metadata'],
+    'secondarycache': ['all', 'none', 'metadata'],
+}
+
+_SIZE_UNITS = {'': 1, 'k': units.Ki, 'm': units.Mi, 'g': units.Gi, 't': units.Ti}
+
+
+def parse_size(value):
+    """Parse zfs size (8192, 8k, 128K, 10G) into bytes"""
+    match = re.match(r'^\s*(\d+)\s*([kmgt]?)i?b?\s*$', str(value), re.IGNORECASE)
+    if match is None:
+        raise ValueError('invalid size %r' % value)
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).lower()]
+
+
+def make_client(config, zpool, metrics, domain=None):
+    """Build znstord client of zpool from backend configuration"""
+    return znstor_restapi.Znstor(
+        management_address=config.management_addr,
+        pool=zpool,
+        domain=domain or config.znstor_domain,
+        user=config.znstor_user,
+        passwd=config.znstor_password,
+        pool_size=config.znstor_connection_pool_size,
+        idle_timeout=config.znstor_connection_idle_timeout,
+        index_ttl=config.znstor_volume_index_ttl,
+        page_size=config.znstor_list_page_size,
+        timeout=config.znstor_request_timeout,
+        connect_timeout=config.znstor_connect_timeout,
+        failover_connect_timeout=config.znstor_failover_connect_timeout,
+        retries=config.znstor_request_retries,
+        breaker_threshold=config.znstor_breaker_threshold,
+        breaker_reset=config.znstor_breaker_reset,
+        metrics=metrics,
+    )
+
 
 @interface.volumedriver
 class ZNSTORISCSIDriver(driver.ISCSIDriver):
@@ -54,283 +185,881 @@ class ZNSTORISCSIDriver(driver.ISCSIDriver):
         self.configuration.append_config_values(OPTS)
         self.lcfg = self.configuration
 
-        self.storage = znstor_restapi.Znstor(
-            management_address=self.lcfg.management_addr,
-            pool=self.lcfg.znstor_pool,
-            domain=self.lcfg.znstor_domain,
-            user=self.lcfg.znstor_user,
-            passwd=self.lcfg.znstor_password,
-        )
+        try:
+            pools = znstor_pools.parse_pools(
+                self.lcfg.znstor_projects or [self.lcfg.znstor_project], self.lcfg.znstor_pool)
+        except ValueError as e:
+            raise exception.InvalidConfigurationValue(option='znstor_projects', value=str(e))
+        # cinder pool name -> Pool, the first one receives volumes without pool in host
+        self.pools = OrderedDict((pool.name, pool) for pool in pools)
+        self.default_pool = pools[0]
+
+        # one client per zpool, all clients account requests in the same metrics
+        metrics = znstor_metrics.Metrics(znstor_metrics.make_sinks(
+            statsd_address=self.lcfg.znstor_statsd_address,
+            prometheus_textfile=self.lcfg.znstor_prometheus_textfile))
+        self.clients = OrderedDict()
+        for pool in pools:
+            if pool.zpool not in self.clients:
+                self.clients[pool.zpool] = self._make_client(pool.zpool, metrics)
+            pool.storage = self.clients[pool.zpool]
+            pool.reaper = znstor_jobs.DeleteReaper(
+                pool.storage.jobs, retries=self.lcfg.znstor_async_delete_retries)
+            pool.image_cache = znstor_imagecache.ImageCache(
+                max_count=self.lcfg.znstor_image_cache_max_count,
+                max_size=self.lcfg.znstor_image_cache_max_size_gb * units.Gi or None)
+        # hostgroups and targets are not bound to zpool, they are managed by the default client
+        self.storage = self.default_pool.storage
+
+        self.async_storage = znstor_asyncapi.AsyncZnstor(
+            self.storage, concurrency=self.lcfg.znstor_connection_pool_size)
+        self.stats_collector = znstor_stats.StatsCollector(
+            self._collect_stats, interval=self.lcfg.znstor_stats_interval)
+        self.attach_batches = znstor_coalesce.Coalescer(self.lcfg.znstor_attach_batch_window)
+        # (domain, zpool) -> client of migration destinations outside of configured pools
+        self._remote_clients = {}
+        # volume id -> progress of running migration
+        self.migrations = {}
+
+    def _make_client(self, zpool, metrics, domain=None):
+        """Build znstord client of zpool"""
+        return make_client(self.lcfg, zpool, metrics, domain=domain)
 
     def do_setup(self, context):
-        """Setup project"""
-        if self.lcfg.znstor_project not in [project['project'] for project in self.storage.project_list()]:
-            try:
-                self.storage.project_create(
-                    self.lcfg.znstor_project, quota=int(self.lcfg.quota * units.Gi))
-            except znstor_restapi.ZnstorBadRequest as e:
-                LOG.error(e)
+        """Setup projects"""
+        projects = {}
+        for zpool, storage in self.clients.items():
+            projects[zpool] = [project['project'] for project in storage.project_list()]
+
+        for pool in self.pools.values():
+            if pool.project not in projects[pool.zpool]:
+                try:
+                    pool.storage.project_create(pool.project, quota=int(self.lcfg.quota * units.Gi))
+                except znstor_restapi.ZnstorBadRequest as e:
+                    LOG.error(e)
+                    raise exception.VolumeBackendAPIException(
+                        data="ZNSTOR. backend initialization failed. Err: %s" % str(e)
+                    )
+                except Exception as e:
+                    LOG.error(e)
+                    raise exception.VolumeBackendAPIException(
+                        data="ZNSTOR. unknown exception. Err: %s" % str(e)
+                    )
+
+            # get current project property
+            project = pool.storage.project_get(pool.project)
+
+            # check quota properties
+            pool.storage.project_set(project['project'], quota=int(self.lcfg.quota * units.Gi))
+            pool.storage.project_set(project['project'], compression=self.lcfg.compression)
+
+            if self.lcfg.znstor_image_cache:
+                self._load_image_cache(pool)
+
+    def check_for_setup_error(self):
+        """Check if setup ended successfully"""
+        for pool in self.pools.values():
+            project = pool.storage.project_get(pool.project)
+            if project['project'] != pool.project:
+                LOG.error('ZNSTOR. Project is not initialize. check_for_setup failed.')
                 raise exception.VolumeBackendAPIException(
-                    data="ZNSTOR. backend initialization failed. Err: %s" % str(e)
+                    data="ZNSTOR. Project is not initialize. Project is %s" % str(project)
                 )
+
+    def _collect_stats(self):
+        """fetch statistics of all projects concurrently, called by stats collector in background
+        :return: dict pool name -> statistics, pools which failed are omitted
+        """
+        futures = []
+        for pool in self.pools.values():
+            futures.append(self.async_storage.submit(pool.storage.project_get, pool.project))
+            futures.append(self.async_storage.submit(pool.storage.volume_count, pool.project))
+        results = self.async_storage.gather(futures, return_exceptions=True)
+
+        collected = {}
+        error = None
+        for index, pool in enumerate(self.pools.values()):
+            project, volumes = results[2 * index], results[2 * index + 1]
+            try:
+                collected[pool.name] = self._pool_stats(project, volumes)
             except Exception as e:
-                LOG.error(e)
-                raise exception.VolumeBackendAPIException(
-                    data="ZNSTOR. unknown exception. Err: %s" % str(e)
-                )
+                LOG.error('ZNSTOR. Statistics of pool %s are not collected. Err: %s', pool.name, e)
+                error = e
+        if not collected:
+            raise error
+        return collected
 
-        # get current project property
-        project = self.storage.project_get(self.lcfg.znstor_project)
+    @staticmethod
+    def _pool_stats(project, volumes):
+        """statistics of pool from project_get and volume_count results"""
+        if isinstance(project, Exception):
+            raise project
 
-        # check quota properties
-        self.storage.project_set(project['project'], quota=int(self.lcfg.quota * units.Gi))
-        self.storage.project_set(project['project'], compression=self.lcfg.compression)
+        collected = {
+            'quota': project['options']['quota'],
+            'available': project['options']['available'],
+            'used': project['options']['used'],
+            'volumes': 0,
+        }
 
-    def check_for_setup_error(self):
-        """Check if setup ended successfully"""
-        project = self.storage.project_get(self.lcfg.znstor_project)
-        if project['project'] != self.lcfg.znstor_project:
-            LOG.error('ZNSTOR. Project is not initialize. check_for_setup failed.')
-            raise exception.VolumeBackendAPIException(
-                data="ZNSTOR. Project is not initialize. Project is %s" % str(project)
-            )
+        # add volume count information
+        if isinstance(volumes, Exception):
+            raise volumes
+        collected['volumes'] = volumes
+        return collected
+
+    def get_volume_stats(self, refresh=False):
+        """Get backend statistics.
+        Statistics are refreshed in background and returned immediately from the last
+        snapshot. refresh=True requests background refresh and waits only if
+        statistics were never collected.
+        """
+        if refresh:
+            self.stats_collector.refresh(wait=True)
+        self._update_volume_stats()
+        return self._stats
 
     # noinspection PyArgumentList,PyArgumentList
     def _update_volume_stats(self):
         """update backend statistics"""
-        project = self.storage.project_get(self.lcfg.znstor_project)
+        collected, meta = self.stats_collector.get()
+        if collected is None:
+            LOG.warning('ZNSTOR. Backend statistics are not collected yet. Err: %s', meta['error'])
+            return
 
         data = {}
         data['vendor_name'] = self.vendor_name
         data['volume_backend_name'] = 'znstor'
         data['driver_version'] = self.driver_version
         data['storage_protocol'] = 'iscsi'
+        data['znstor_stats_updated_at'] = meta['updated_at']
+        data['znstor_stats_age'] = int(meta['age'])
+        data['znstor_stats_error'] = meta['error']
+        # requests made to znstord: totals and endpoints which took most of the time
+        data['znstor_rest'] = self.storage.rest.metrics.summary()
+        data['znstor_circuit'] = dict((zpool, storage.rest.status()) for zpool, storage in self.clients.items())
+        data['znstor_migrations'] = [dict(progress) for progress in list(self.migrations.values())]
         data['pools'] = []
 
-        single_pool = {}
-        # noinspection PyArgumentList
-        single_pool.update(
-            pool_name=project['project'],
-            total_capacity_gb=project['options']['quota'] / units.Gi,
-            free_capacity_gb=project['options']['available'] / units.Gi,
-            location_info='None',
-            QoS_support=False,
-            provisioned_capacity_gb=project['options']['used'] / units.Gi,
-            max_over_subscription_ratio=int(self.lcfg.oversubs_ratio),
-            thin_provisioning_support=True,
-            thick_provisioning_support=True,
-            total_volumes=0,
-            multiattach=True,
-        )
+        for pool in self.pools.values():
+            stats = collected.get(pool.name)
+            if stats is None:
+                continue
+            # space of volumes which destroy jobs are not finished yet
+            _, pending_delete = pool.reaper.pending()
 
-        # add volume count information
-        try:
-            vols_list = self.storage.volume_list(project['project'])
             # noinspection PyArgumentList
-            # TODO: must return empty array if no one volume exist
-            single_pool.update(total_volumes=len(vols_list))
-        except znstor_restapi.ZnstorObjectNotFound as e:
-            # TODO: remove this exception
-            # There is no project within the project.
-            pass
-
-        data['pools'].append(single_pool)
+            data['pools'].append(dict(
+                pool_name=pool.name,
+                total_capacity_gb=stats['quota'] / units.Gi,
+                free_capacity_gb=(stats['available'] + pending_delete) / units.Gi,
+                location_info=self._location_info(pool),
+                QoS_support=False,
+                provisioned_capacity_gb=max(stats['used'] - pending_delete, 0) / units.Gi,
+                pending_delete_gb=pending_delete / units.Gi,
+                max_over_subscription_ratio=int(self.lcfg.oversubs_ratio),
+                thin_provisioning_support=True,
+                thick_provisioning_support=True,
+                total_volumes=max(stats['volumes'], 0),
+                multiattach=True,
+                consistent_group_snapshot_enabled=True,
+            ))
         self._stats = data
 
+    def _location_info(self, pool):
+        """Location of pool, volumes are migrated by backend between locations of the same cluster"""
+        return '%s:%s:%s:%s:%s' % (self.__class__.__name__, self.lcfg.management_addr,
+                                   self.lcfg.znstor_domain, pool.zpool, pool.project)
+
+    def _parse_location(self, location_info):
+        """Parse location_info of pool
+        :return: (management addresses, domain, zpool, project) or None if pool is not znstor one
+        """
+        driver, _, location = (location_info or '').partition(':')
+        if driver != self.__class__.__name__:
+            return None
+        # management address contains colons, fields are taken from the right
+        parts = location.rsplit(':', 3)
+        if len(parts) != 4 or not all(parts):
+            return None
+        return znstor_restclient.parse_addresses(parts[0]), parts[1], parts[2], parts[3]
+
+    def _pool(self, volume):
+        """Return pool of volume, volumes without pool in host belong to the default pool"""
+        name = volume_utils.extract_host(volume['host'], 'pool') if volume.get('host') else None
+        if name is None:
+            return self.default_pool
+        pool = self.pools.get(name)
+        if pool is None:
+            raise exception.VolumeBackendAPIException(
+                data="ZNSTOR. Pool %s of volume %s is not configured" % (name, volume['name']))
+        return pool
+
+    def _snapshot_pool(self, snapshot):
+        """Return pool of snapshot parent volume"""
+        volume = snapshot.get('volume')
+        if volume is None:
+            return self.default_pool
+        return self._pool(volume)
+
+    def _check_same_pool(self, pool, volume):
+        """Clones can be created only in the project of their origin"""
+        target = self._pool(volume)
+        if target is not pool:
+            raise exception.VolumeBackendAPIException(
+                data="ZNSTOR. Volume %s in pool %s can not be cloned from pool %s" % (
+                    volume['name'], target.name, pool.name))
+
+    def _get_lu(self, pool, volume):
+        """Return znstor logical unit of cinder volume.
+        provider_id is saved on volume creation, alias lookup is needed only for
+        volumes created by previous driver versions.
+        :return: dict with LUName and SerialNum or None if volume not found. SerialNum
+        is None if volume has no provider_location, it is resolved by _serial_number.
+        """
+        if volume.get('provider_id'):
+            return {'LUName': volume['provider_id'],
+                    'SerialNum': volume.get('provider_location') or None}
+        return pool.storage.volume_get_by_alias(pool.project, volume['name'])
+
+    def _get_snapshot_lu(self, pool, snapshot):
+        """Return znstor logical unit of snapshot parent volume"""
+        volume = snapshot.get('volume')
+        if volume is not None:
+            return self._get_lu(pool, volume)
+        return pool.storage.volume_get_by_alias(pool.project, snapshot['volume_name'])
+
+    def _model_update(self, pool, volume, created):
+        """Build provider_id/provider_location model update for created volume"""
+        lu = znstor_restapi.volume_lu(created)
+        if lu is None or 'SerialNum' not in lu:
+            lu = pool.storage.volume_get_by_alias(pool.project, volume['name'])
+        if lu is None:
+            LOG.warning('ZNSTOR. Volume %s not found after creation.', volume['name'])
+            return None
+        return {'provider_id': lu['LUName'],
+                'provider_location': lu['SerialNum']}
+
+    def update_provider_info(self, volumes, snapshots):
+        """Backfill provider_id of volumes created by previous driver versions.
+        Called by volume manager once on startup right after do_setup.
+        """
+        volume_updates = []
+        for volume in volumes:
+            if volume.get('provider_id'):
+                continue
+            pool = self._pool(volume)
+            lu = pool.storage.volume_get_by_alias(pool.project, volume['name'])
+            if lu is None:
+                LOG.warning('ZNSTOR. Volume %s not found on backend.', volume['name'])
+                continue
+            volume_updates.append({'id': volume['id'],
+                                   'provider_id': lu['LUName'],
+                                   'provider_location': lu['SerialNum']})
+        return volume_updates, None
+
+    def _volume_options(self, volume=None):
+        """zfs options of created volume.
+        Defaults are thin_volumes and compression options, they are overridden by
+        "znstor:<option>" extra specs of volume type, ex: znstor:volblocksize=8k,
+        znstor:compression=off. provisioning:type=thick makes volume thick.
+        """
+        options = {
+            'thin': self.lcfg.thin_volumes,
+            'compression': self.lcfg.compression,
+        }
+        specs = self._extra_specs(volume)
+        if specs.get('provisioning:type') in ('thin', 'thick'):
+            options['thin'] = specs['provisioning:type'] == 'thin'
+
+        for key, value in specs.items():
+            scope, _, name = key.partition(':')
+            if scope != 'znstor':
+                continue
+            if name not in EXTRA_SPECS:
+                raise exception.InvalidInput(reason='ZNSTOR. unknown extra spec %s' % key)
+            allowed = EXTRA_SPECS[name]
+            value = str(value).strip()
+            if allowed is bool:
+                value = value.lower().replace('<is>', '').strip()
+                if value not in ('true', 'false'):
+                    raise exception.InvalidInput(reason='ZNSTOR. %s should be True or False, got %s' % (key, value))
+                value = value == 'true'
+            elif allowed is None:
+                if name == 'reservation' and value.lower() == 'none':
+                    options[name] = 'none'
+                    continue
+                try:
+                    value = parse_size(value)
+                except ValueError:
+                    raise exception.InvalidInput(reason='ZNSTOR. %s should be size, got %s' % (key, value))
+                if name == 'volblocksize' and (value < 512 or value > units.Mi or value & (value - 1)):
+                    raise exception.InvalidInput(
+                        reason='ZNSTOR. %s should be power of 2 from 512 to 1M, got %s' % (key, value))
+            elif value.lower() not in allowed:
+                raise exception.InvalidInput(
+                    reason='ZNSTOR. %s should be one of %s, got %s' % (key, ', '.join(allowed), value))
+            else:
+                value = value.lower()
+            options[name] = value
+        return options
+
+    @staticmethod
+    def _extra_specs(volume):
+        """extra specs of volume type"""
+        type_id = volume.get('volume_type_id') if volume is not None else None
+        if not type_id:
+            return {}
+        return volume_types.get_volume_type_extra_specs(type_id) or {}
+
+    @staticmethod
+    def _allocated(size, thin, vol=None):
+        """Space volume takes from pool used statistics: thick volume reserves its size,
+        thin volume and clone take space of data written to them
+        :param size: volume size in bytes
+        :param thin: volume is thin
+        :param vol: znstor volume object with used or referenced option, thin volume
+        without it is accounted as empty until statistics are refreshed
+        :return: bytes
+        """
+        if not thin:
+            return size
+        options = ((vol or {}).get('vol') or {}).get('options') or {}
+        for key in ('used', 'referenced'):
+            if options.get(key) is not None:
+                return parse_size(options[key])
+        return 0
+
+    def _thin(self, volume):
+        """volume reserves no space: it is created thin or as clone, clones are thin"""
+        if volume.get('source_volid') or volume.get('snapshot_id'):
+            return True
+        return self._volume_options(volume)['thin']
+
+    def _apply_clone_options(self, pool, volume, vol):
+        """Apply options of volume type which can be changed after creation to clone.
+        Clone inherits options of its origin, only compression can be changed by znstor.
+        """
+        compression = self._extra_specs(volume).get('znstor:compression')
+        if compression:
+            pool.storage.volume_compression(pool.project, vol['provider_id'],
+                                            self._volume_options(volume)['compression'])
+
     def create_volume(self, volume):
         """create volume"""
+        pool = self._pool(volume)
         volsize = volume['size'] * units.Gi
         volalias = volume['name']
 
+        options = self._volume_options(volume)
         try:
-            self.storage.volume_create(self.lcfg.znstor_project, alias=volalias, volsize=volsize,
-                                       options={
-                                           "thin": True,
-                                           "compression": 'lz4'
-                                       })
+            created = pool.storage.volume_create(pool.project, alias=volalias, volsize=volsize,
+                                                 options=options)
         except znstor_restapi.ZnstorBadRequest as e:
             LOG.error(e)
             raise exception.VolumeBackendAPIException(message=
                                                       "ZNSTOR. delete volume failed with error. Err: %s" % str(e))
+        self.stats_collector.adjust(pool.name, volumes=1,
+                                    used=self._allocated(volsize, options['thin'], created))
+        return self._model_update(pool, volume, created)
 
     def delete_volume(self, volume):
         """delete volume"""
-        alias = volume['name']
+        pool = self._pool(volume)
         try:
-            lu_uuid = self.storage.volume_get_by_alias(self.lcfg.znstor_project, alias)['LUName']
-            self.storage.volume_destroy(self.lcfg.znstor_project, lu_uuid)
+            vol = self._get_lu(pool, volume)
+            if vol is None:
+                LOG.warning('ZNSTOR. Volume %s not found, nothing to delete.', volume['name'])
+                return
+            # snapshots destroyed in background must be gone before volume
+            pool.reaper.wait(vol['LUName'] + '@')
+            try:
+                job = self._destroy_volume(pool, volume, vol)
+            except znstor_restapi.ZnstorObjectNotFound:
+                raise
+            except znstor_restapi.ZnstorBadRequest:
+                # hidden snapshots left by deleted clones and backups keep the volume
+                if not self._destroy_clone_snapshots(pool, vol, backups=True):
+                    raise
+                job = self._destroy_volume(pool, volume, vol)
+        except znstor_restapi.ZnstorObjectNotFound as e:
+            # provider_id of volume destroyed outside of cinder
+            LOG.warning('ZNSTOR. Volume %s not found, nothing to delete. Err: %s', volume['name'], e)
+            return
         except znstor_restapi.ZnstorBadRequest as e:
             LOG.error(e)
             raise exception.VolumeIsBusy(
                 message="Err: %s. Volume: %s" % (str(e), volume['name']))
 
-    def initialize_connection(self, volume, connector):
-        alias = volume['name']
+        if volume.get('source_volid'):
+            if job is None:
+                self._release_clone_snapshot(pool, volume)
+            else:
+                # callback does not block on jobs, snapshot destroy is confirmed by reaper.
+                # Clone destroy retried by reaper leaves snapshot to be destroyed with source.
+                job.add_done_callback(
+                    lambda f: f.exception() is None and f.status == pool.storage.job_completed
+                    and self._release_clone_snapshot(pool, volume, wait=False))
+
+    def _destroy_volume(self, pool, volume, vol):
+        """destroy volume
+        :return: JobFuture if volume is destroyed in background
+        """
+        # space of thin volume is known from backend only, it is read before destroy is submitted
+        thin = self._thin(volume)
+        allocated = self._allocated(volume['size'] * units.Gi, thin,
+                                    pool.storage.volume_get(pool.project, vol['LUName']) if thin else None)
+        if not self.lcfg.znstor_async_delete:
+            pool.storage.volume_destroy(pool.project, vol['LUName'])
+            self.stats_collector.adjust(pool.name, volumes=-1, used=-allocated)
+            return None
 
+        def destroy():
+            return pool.storage.volume_destroy(
+                pool.project, vol['LUName'], wait=False)
+
+        def retry():
+            # destroy job fails when hidden snapshots keep the volume. Reaper retries
+            # in job callback thread, which may wait for snapshot destroy jobs.
+            self._destroy_clone_snapshots(pool, vol, backups=True)
+            return destroy()
+        job = destroy()
+        if job is not None:
+            # space is accounted by reaper until job is finished
+            pool.reaper.track(vol['LUName'], job, retry, size=allocated)
+            self.stats_collector.adjust(pool.name, volumes=-1)
+        return job
+
+    def initialize_connection(self, volume, connector):
         # get volume that should be exported to host
+        pool = self._pool(volume)
         try:
-            vol = self.storage.volume_get_by_alias(
-                self.lcfg.znstor_project, alias)
+            vol = self._get_lu(pool, volume)
         except znstor_restapi.ZnstorBadRequest as e:
             LOG.debug("ZNSTOR. Can't export volume. Err: %s" % str(e))
             raise exception.VolumeBackendAPIException(
                 message="Volume export failed: %s" % volume['name'])
+        if vol is None:
+            raise exception.VolumeNotFound(volume_id=volume['id'])
+
+        # concurrent attaches to the same host are batched: hostgroup is checked once
+        # and exports are issued back-to-back
+        return self.attach_batches.run(
+            ('attach', connector['host']),
+            lambda: self._export(pool, volume, vol, connector),
+            prepare=lambda: self._ensure_hostgroup(connector))
 
-        # ensure that initiator host is present on storage
+    def _ensure_hostgroup(self, connector):
+        """ensure that initiator host is present on storage"""
         initiator_iqn = connector['initiator']
         initiator_host = connector['host']
 
         try:
-            hostgroups = self.storage.hostgroup_list()
-            if initiator_host not in [hg['HostGroup'] for hg in hostgroups]:
-                self.storage.hostgroup_create(initiator_host)
-                self.storage.hostgroup_add_member(initiator_host, initiator_iqn)
+            others = self.storage.hostgroup_ensure(initiator_host, initiator_iqn)
+            if others:
+                # members are not removed: they may be other paths of the host
+                LOG.info('ZNSTOR. Initiator %s added to hostgroup %s, which also has %s',
+                         initiator_iqn, initiator_host, ', '.join(others))
         except znstor_restapi.ZnstorBadRequest as e:
             LOG.debug("ZNSTOR. Can't check/create hostgroup")
-            raise exception.VolumeBackendAPIException(message="Volume export failed: %s" % volume['name'])
+            raise exception.VolumeBackendAPIException(message="Hostgroup check failed: %s" % initiator_host)
+
+    def _export(self, pool, volume, vol, connector):
+        """export volume to connector host and return connection info"""
+        initiator_host = connector['host']
 
-        iscsi_properties = {}
-        # check if volume already exported to client
-
-        views = self.storage.volume_exports(self.lcfg.znstor_project, vol['LUName'])
-
-        if len(views) > 0:
-            for view in views:
-                if view['HostGroup'] == initiator_host and view['TargetGroup'] == self.lcfg.target_group:
-                    iscsi_properties['target_discovered'] = False
-                    iscsi_properties['target_portal'] = self.lcfg.portal_addr
-                    iscsi_properties['target_iqn'] = self.lcfg.portal_iqn
-                    iscsi_properties['target_lun'] = view['LUN']
-                    iscsi_properties['volume_id'] = vol['SerialNum']
-                    iscsi_properties['discard'] = True
-                    return {
-                        'driver_volume_type': 'iscsi',
-                        'data': iscsi_properties
-                    }
-
-        self.storage.volume_export(
-            self.lcfg.znstor_project, vol['LUName'], initiator_host, self.lcfg.target_group, -1)
-
-        views = self.storage.volume_exports(self.lcfg.znstor_project, vol['LUName'])
-        for view in views:
-            if view['HostGroup'] == initiator_host and view['TargetGroup'] == self.lcfg.target_group:
-                iscsi_properties['target_discovered'] = False
-                iscsi_properties['target_portal'] = self.lcfg.portal_addr
-                iscsi_properties['target_iqn'] = self.lcfg.portal_iqn
-                iscsi_properties['target_lun'] = view['LUN']
-                iscsi_properties['volume_id'] = vol['SerialNum']
-                iscsi_properties['discard'] = True
-                return {
-                    'driver_volume_type': 'iscsi',
-                    'data': iscsi_properties
-                }
+        # in the common case volume is not exported yet and export response contains
+        # assigned LUN, so attach costs one request. Repeated attach fails to add
+        # existing view and the view is read from exports.
+        def export():
+            return pool.storage.volume_export(
+                pool.project, vol['LUName'], initiator_host, self.lcfg.target_group, -1,
+                readback=False)
+
+        view = None
+        exported = None
+        export_error = None
+        try:
+            try:
+                exported = export()
+            except znstor_restapi.ZnstorObjectNotFound as e:
+                # hostgroup deleted outside of driver is still cached as existing
+                LOG.info('ZNSTOR. Export of %s to %s not found, rechecking hostgroup. Err: %s',
+                         volume['name'], initiator_host, e)
+                self.storage.hostgroups.invalidate()
+                self._ensure_hostgroup(connector)
+                exported = export()
+            view = znstor_restapi.find_view(exported, initiator_host, self.lcfg.target_group)
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.debug("ZNSTOR. Export of %s failed, checking existing views. Err: %s",
+                      volume['name'], e)
+            export_error = e
+
+        if view is None:
+            try:
+                view = znstor_restapi.find_view(
+                    pool.storage.volume_exports(pool.project, vol['LUName']),
+                    initiator_host, self.lcfg.target_group)
+            except znstor_restapi.ZnstorBadRequest as e:
+                LOG.debug("ZNSTOR. Views of %s are not available. Err: %s", volume['name'], e)
+        if view is None:
+            LOG.error("ZNSTOR. Can't export volume %s. Err: %s", volume['name'], export_error)
+            raise exception.VolumeBackendAPIException(
+                message="Volume export failed: %s" % volume['name'])
+
+        try:
+            serial = self._serial_number(pool, vol, exported)
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.error("ZNSTOR. Serial number of volume %s is not available. Err: %s", volume['name'], e)
+            raise exception.VolumeBackendAPIException(
+                message="Volume export failed: %s" % volume['name'])
+
+        return {
+            'driver_volume_type': 'iscsi',
+            'data': self._iscsi_properties(serial, view)
+        }
+
+    def _serial_number(self, pool, vol, exported=None):
+        """SerialNum of logical unit. Volumes saved without provider_location take it
+        from export response, or from backend if export did not return volume.
+        """
+        if vol.get('SerialNum'):
+            return vol['SerialNum']
+        lu = znstor_restapi.volume_lu(exported)
+        if lu is None or not lu.get('SerialNum'):
+            lu = znstor_restapi.volume_lu(pool.storage.volume_get(pool.project, vol['LUName']))
+        vol['SerialNum'] = lu['SerialNum']
+        return vol['SerialNum']
+
+    def _iscsi_properties(self, serial, view):
+        """Build connection properties of exported volume"""
+        return {
+            'target_discovered': False,
+            'target_portal': self.lcfg.portal_addr,
+            'target_iqn': self.lcfg.portal_iqn,
+            'target_lun': view['LUN'],
+            'volume_id': serial,
+            'discard': True,
+        }
 
     def terminate_connection(self, volume, connector, **kwargs):
         """Driver entry point to terminate connection for a volume"""
-        alias = volume['name']
+        pool = self._pool(volume)
         try:
-            vol = self.storage.volume_get_by_alias(self.lcfg.znstor_project, alias)
+            vol = self._get_lu(pool, volume)
         except znstor_restapi.ZnstorBadRequest as e:
             LOG.debug("ZNSTOR. Can't export volume. Err: %s" % str(e))
             raise exception.VolumeBackendAPIException(message="Volume export failed: %s" % volume['name'])
 
-        initiator_iqn = connector['initiator']
+        self.attach_batches.run(
+            ('detach', connector['host']),
+            lambda: self._unexport(pool, volume, vol, connector))
+
+    def _unexport(self, pool, volume, vol, connector):
+        """remove view of volume for connector host"""
         initiator_host = connector['host']
-        views = self.storage.volume_exports(self.lcfg.znstor_project, vol['LUName'])
-        if len(views) > 0:
-            for view in views:
-                if view['HostGroup'] == initiator_host and view['TargetGroup'] == self.lcfg.target_group:
-                    self.storage.volume_unexport(
-                        self.lcfg.znstor_project, vol['LUName'], initiator_host, self.lcfg.target_group, -1)
-
-    def clone_image(self, volume, image_location, image_id, image_meta, image_service):
-        # TODO: need to implements
-        pass
+        try:
+            pool.storage.volume_unexport(
+                pool.project, vol['LUName'], initiator_host, self.lcfg.target_group, -1,
+                readback=False)
+        except znstor_restapi.ZnstorBadRequest as e:
+            # nothing to do if volume is not exported to the host
+            views = pool.storage.volume_exports(pool.project, vol['LUName'])
+            if znstor_restapi.find_view(views, initiator_host, self.lcfg.target_group) is not None:
+                LOG.error("ZNSTOR. Can't unexport volume %s. Err: %s", volume['name'], e)
+                raise exception.VolumeBackendAPIException(
+                    message="Volume unexport failed: %s" % volume['name'])
+
+    @staticmethod
+    def _snapshot_name(snapshot):
+        """znstor name of snapshot, snapshots of group share the name saved as provider_id"""
+        return snapshot.get('provider_id') or snapshot['name']
 
     def create_volume_from_snapshot(self, volume, snapshot):
         new_vol_alias = volume['name']
-        parent_vol_alias = snapshot['volume_name']
-        snapname = snapshot['name']
+        snapname = self._snapshot_name(snapshot)
+        pool = self._snapshot_pool(snapshot)
+        self._check_same_pool(pool, volume)
 
         try:
-            parent_vol = self.storage.volume_get_by_alias(self.lcfg.znstor_project, parent_vol_alias)
-            self.storage.volume_create_from_snapshot(
-                self.lcfg.znstor_project, parent_vol['LUName'], snapname, new_vol_alias)
+            parent_vol = self._get_snapshot_lu(pool, snapshot)
+            clone = pool.storage.volume_create_from_snapshot(
+                pool.project, parent_vol['LUName'], snapname, new_vol_alias)
+            model_update = self._model_update(pool, volume, clone)
+            if model_update is not None:
+                self._apply_clone_options(pool, volume, model_update)
         except znstor_restapi.ZnstorBadRequest as e:
             LOG.error(e)
             raise exception.VolumeBackendAPIException(
                 message="ZNSTOR. delete volume failed with error. Err: %s" % str(e))
+        self.stats_collector.adjust(pool.name, volumes=1,
+                                    used=self._allocated(volume['size'] * units.Gi, True, clone))
+        return model_update
 
     def delete_snapshot(self, snapshot):
-        alias = snapshot['volume_name']
-        snapshot_name = snapshot['name']
+        snapshot_name = self._snapshot_name(snapshot)
+        pool = self._snapshot_pool(snapshot)
         try:
-            vol = self.storage.volume_get_by_alias(self.lcfg.znstor_project, alias)
-            self.storage.volume_destroy_snapshot(self.lcfg.znstor_project, vol['LUName'], snapshot_name)
+            vol = self._get_snapshot_lu(pool, snapshot)
+            if not self.lcfg.znstor_async_delete:
+                pool.storage.volume_destroy_snapshot(pool.project, vol['LUName'], snapshot_name)
+                return
+
+            def destroy():
+                return pool.storage.volume_destroy_snapshot(
+                    pool.project, vol['LUName'], snapshot_name, wait=False)
+            job = destroy()
+            if job is not None:
+                pool.reaper.track('%s@%s' % (vol['LUName'], snapshot_name), job, destroy)
         except znstor_restapi.ZnstorBadRequest as e:
             LOG.error('Snapshot %s: has clones. Err: %s' % (snapshot['name'], e))
             raise exception.SnapshotIsBusy(snapshot_name=snapshot['name'])
 
     def create_snapshot(self, snapshot):
-        alias = snapshot['volume_name']
         snapname = snapshot['name']
+        pool = self._snapshot_pool(snapshot)
 
         try:
-            vol = self.storage.volume_get_by_alias(self.lcfg.znstor_project, alias)
-            self.storage.volume_create_snapshot(self.lcfg.znstor_project, vol['LUName'], snapname)
+            vol = self._get_snapshot_lu(pool, snapshot)
+            pool.storage.volume_create_snapshot(pool.project, vol['LUName'], snapname)
         except znstor_restapi.ZnstorBadRequest as e:
             LOG.error(e)
             raise exception.VolumeBackendAPIException(
                 message="ZNSTOR. delete volume failed with error. Err: %s" % str(e))
 
     def extend_volume(self, volume, new_size):
+        pool = self._pool(volume)
         try:
-            alias = volume['name']
-            vol = self.storage.volume_get_by_alias(self.lcfg.znstor_project, alias)
-            self.storage.volume_resize(self.lcfg.znstor_project, vol['LUName'], new_size * units.Gi)
+            vol = self._get_lu(pool, volume)
+            pool.storage.volume_resize(pool.project, vol['LUName'], new_size * units.Gi)
         except znstor_restapi.ZnstorBadRequest as e:
             LOG.error(e)
             raise exception.VolumeBackendAPIException(
                 message="ZNSTOR. delete volume failed with error. Err: %s" % str(e))
+        if not self._thin(volume):
+            self.stats_collector.adjust(pool.name, used=(new_size - volume['size']) * units.Gi)
 
-    def clone_image(self, context, volume,
-                    image_location, image_meta,
-                    image_service):
-        """Create a volume efficiently from an existing image.
-        Verify the image ID being used:
-        (1) If there is no existing cache volume, create one and transfer
-        image data to it. Take a snapshot.
-        (2) If a cache volume already exists, verify if it is either alternated
-        or updated. If so try to remove it, raise exception if removal fails.
-        Create a new cache volume as in (1).
-        Clone a volume from the cache volume and returns it to Cinder.
-        A file lock is placed on this method to prevent:
-        (a) a race condition when a cache volume has been verified, but then
-        gets deleted before it is cloned.
-        (b) failure of subsequent clone_image requests if the first request is
-        still pending.
+    def revert_to_snapshot(self, context, volume, snapshot):
+        """Revert volume to snapshot with zfs rollback.
+        Rollback is possible only to the latest snapshot: newer hidden clone and backup snapshots without
+        clones are destroyed, other newer snapshots are destroyed if
+        znstor_revert_destroy_newer_snapshots is set. Otherwise NotImplementedError makes
+        cinder revert by copying snapshot data.
         """
+        pool = self._pool(volume)
+        snapname = self._snapshot_name(snapshot)
+        vol = self._get_lu(pool, volume)
+        if vol is None:
+            raise exception.VolumeNotFound(volume_id=volume['id'])
+        # snapshots destroyed in background must be gone before rollback
+        pool.reaper.wait(vol['LUName'] + '@')
 
-        LOG.debug('Cloning image %(image)s to volume %(volume)s',
-                  {'image': image_meta['id'], 'volume': volume['name']})
+        try:
+            newer = self._newer_snapshots(pool, vol, snapname)
+            for snap in newer:
+                name = znstor_restapi.snapshot_name(snap)
+                hidden = name.startswith(HIDDEN_SNAPSHOT_PREFIXES)
+                if snap.get('clones') or not (hidden or self.lcfg.znstor_revert_destroy_newer_snapshots):
+                    LOG.info('ZNSTOR. Volume %s has snapshot %s newer than %s, reverting by copy.',
+                             volume['name'], name, snapname)
+                    raise NotImplementedError()
+            for snap in newer:
+                name = znstor_restapi.snapshot_name(snap)
+                LOG.info('ZNSTOR. Destroying snapshot %s of volume %s newer than %s.',
+                         name, volume['name'], snapname)
+                pool.storage.volume_destroy_snapshot(pool.project, vol['LUName'], name)
+            pool.storage.volume_rollback_snapshot(pool.project, vol['LUName'], snapname)
+            # volume extended after snapshot was taken keeps its size
+            if volume['size'] > snapshot['volume_size']:
+                pool.storage.volume_resize(pool.project, vol['LUName'], volume['size'] * units.Gi)
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.error(e)
+            raise exception.VolumeBackendAPIException(
+                message="ZNSTOR. revert of volume %s to snapshot %s failed. Err: %s" % (
+                    volume['name'], snapshot['name'], e))
 
+    def _newer_snapshots(self, pool, vol, snapname):
+        """Return snapshots of volume taken after snapname, the latest first"""
+        snapshots = pool.storage.volume_list_snapshot(pool.project, vol['LUName']) or []
+        snapshots = sorted(snapshots, key=lambda snap: snap.get('creation') or 0)
+        names = [znstor_restapi.snapshot_name(snap) for snap in snapshots]
+        if snapname not in names:
+            raise exception.SnapshotNotFound(snapshot_id=snapname)
+        return list(reversed(snapshots[names.index(snapname) + 1:]))
 
-        cachevol_size = image_meta['size']
-        if 'virtual_size' in image_meta and image_meta['virtual_size']:
-            cachevol_size = image_meta['virtual_size']
+    def clone_image(self, context, volume, image_location, image_meta, image_service):
+        """Create volume as a clone of cached image.
+        Image is copied to cache volume "image-<image id>" once and snapshotted under its
+        checksum, volumes are created as clones of the snapshot. Changed image is copied
+        to the same cache volume again and snapshotted under the new checksum, clones of
+        the previous snapshot keep using it.
+        :return: (model update, True) or (None, False) if volume should be created from image
+        without cache
+        """
+        if not self.lcfg.znstor_image_cache:
+            return None, False
 
-        cachevol_size_gb = int(math.ceil(float(cachevol_size) / units.Gi))
+        pool = self._pool(volume)
+        image_id = image_meta['id']
+        image_size = image_meta.get('virtual_size') or image_meta['size']
+        cache_size_gb = max(int(math.ceil(float(image_size) / units.Gi)), 1)
+        if cache_size_gb > volume['size']:
+            LOG.warning('ZNSTOR. Image %s size %dGb is larger than volume %s size %dGb.',
+                        image_id, cache_size_gb, volume['name'], volume['size'])
+            return None, False
 
-        # Make sure that volume is big enough since adds extra metadata.
-        if cachevol_size_gb % units.Gi == 0:
-            cachevol_size_gb += 1
+        LOG.debug('Cloning image %(image)s to volume %(volume)s',
+                  {'image': image_id, 'volume': volume['name']})
+        # clone is made under image lock, so image can not be evicted or refilled meanwhile
+        with pool.image_cache.lock(image_id):
+            entry = None
+            try:
+                entry = self._image_cache_entry(pool, context, image_meta, image_service, cache_size_gb)
+                clone = pool.storage.volume_create_from_snapshot(
+                    pool.project, entry.lu['LUName'], entry.snapshot, volume['name'])
+            except Exception as e:
+                # any failure of copy or clone leaves volume to be created without cache
+                LOG.warning('ZNSTOR. Image %s cache failed, volume %s is created without cache. Err: %s',
+                            image_id, volume['name'], e)
+                if entry is not None:
+                    self._destroy_failed_clone(pool, volume)
+                return None, False
 
-        if cachevol_size_gb > volume['size']:
-            exception_msg = ('Image size %(img_size)Gb is large'
-                             'than volume size %(vol_size)Gb.',
-                             {'img_size': cachevol_size_gb, 'vol_size': volume['size']})
-            LOG.error(exception_msg)
+        try:
+            model_update = self._model_update(pool, volume, clone)
+            if model_update is None:
+                raise exception.VolumeBackendAPIException(
+                    data="ZNSTOR. Clone %s of image %s is not found" % (volume['name'], image_id))
+            if volume['size'] * units.Gi > entry.size:
+                pool.storage.volume_resize(
+                    pool.project, model_update['provider_id'], volume['size'] * units.Gi)
+            self._apply_clone_options(pool, volume, model_update)
+        except Exception as e:
+            LOG.warning('ZNSTOR. Volume %s cloned from image %s can not be updated. Err: %s',
+                        volume['name'], image_id, e)
+            self._destroy_failed_clone(pool, volume)
             return None, False
+        self.stats_collector.adjust(pool.name, volumes=1,
+                                    used=self._allocated(volume['size'] * units.Gi, True, clone))
+        return model_update, True
+
+    def _load_image_cache(self, pool):
+        """Find cache volumes of pool left by previous runs"""
+        entries = []
+        for vol in pool.storage.volume_iter(pool.project):
+            if vol['Alias'].startswith(znstor_imagecache.ALIAS_PREFIX):
+                entries.append(znstor_imagecache.CacheEntry(
+                    vol['Alias'][len(znstor_imagecache.ALIAS_PREFIX):],
+                    {'LUName': vol['LUName'], 'SerialNum': vol['SerialNum']},
+                    vol['Size']))
+        pool.image_cache.load(entries)
+
+    def _image_snapshot(self, pool, entry, name):
+        """Return name if cache volume has such snapshot, name of the latest snapshot otherwise"""
+        snapshots = pool.storage.volume_list_snapshot(pool.project, entry.lu['LUName']) or []
+        names = [znstor_restapi.snapshot_name(snap) for snap in snapshots]
+        if name in names:
+            return name
+        return names[-1] if names else None
+
+    def _image_cache_entry(self, pool, context, image_meta, image_service, size_gb):
+        """Return cache entry of image, fill cache volume if image is not cached or changed.
+        Called with image lock held.
+        """
+        image_id = image_meta['id']
+        snapshot = image_meta.get('checksum') or 'cache'
+
+        entry = pool.image_cache.get(image_id)
+        if entry is not None and entry.snapshot is None:
+            entry.snapshot = self._image_snapshot(pool, entry, snapshot)
+        if entry is not None and entry.snapshot == snapshot:
+            return entry
+
+        created = entry is None
+        if created:
+            self._evict_images(pool, size_gb * units.Gi)
+            cache_volume = pool.storage.volume_create(
+                pool.project, alias=znstor_imagecache.image_alias(image_id),
+                volsize=size_gb * units.Gi, options=self._volume_options())
+            lu = znstor_restapi.volume_lu(cache_volume)
+            if lu is None or 'SerialNum' not in lu:
+                lu = pool.storage.volume_get_by_alias(
+                    pool.project, znstor_imagecache.image_alias(image_id))
+            entry = znstor_imagecache.CacheEntry(
+                image_id, {'LUName': lu['LUName'], 'SerialNum': lu['SerialNum']}, size_gb * units.Gi)
+            self.stats_collector.adjust(pool.name, volumes=1, used=self._allocated(
+                entry.size, self.lcfg.thin_volumes, cache_volume))
+        elif entry.size < size_gb * units.Gi:
+            pool.storage.volume_resize(pool.project, entry.lu['LUName'], size_gb * units.Gi)
+            entry.size = size_gb * units.Gi
+
+        LOG.info('ZNSTOR. Copying image %s to cache volume %s', image_id, entry.lu['LUName'])
+        stale = entry.snapshot
+        try:
+            self.copy_image_to_volume(context, {
+                'id': image_id,
+                'name': znstor_imagecache.image_alias(image_id),
+                'host': '%s#%s' % (self.host, pool.name),
+                'size': entry.size // units.Gi,
+                'provider_id': entry.lu['LUName'],
+                'provider_location': entry.lu['SerialNum'],
+            }, image_service, image_id)
+            pool.storage.volume_create_snapshot(pool.project, entry.lu['LUName'], snapshot)
+        except Exception:
+            if created:
+                LOG.error('ZNSTOR. Copy of image %s to cache failed, removing cache volume.', image_id)
+                pool.storage.volume_destroy(pool.project, entry.lu['LUName'])
+                self.stats_collector.adjust(pool.name, volumes=-1, used=-self._allocated(
+                    entry.size, self.lcfg.thin_volumes))
+            raise
+        entry.snapshot = snapshot
+        pool.image_cache.put(entry)
+
+        if stale is not None:
+            # clones of previous image content keep the snapshot
+            try:
+                pool.storage.volume_destroy_snapshot(pool.project, entry.lu['LUName'], stale)
+            except znstor_restapi.ZnstorBadRequest as e:
+                LOG.info('ZNSTOR. Snapshot %s of image %s is still in use. Err: %s', stale, image_id, e)
+        return entry
+
+    def _evict_images(self, pool, size):
+        """Evict least recently used images until image of size fits into cache"""
+        busy = set()
+        while True:
+            victims = pool.image_cache.victims(size, busy)
+            if not victims:
+                return
+            for entry in victims:
+                if not self._evict_image(pool, entry):
+                    busy.add(entry.image_id)
+
+    def _evict_image(self, pool, entry):
+        """Destroy cache volume of image unless volumes cloned from it still exist
+        :return: True if image is evicted
+        """
+        lock = pool.image_cache.lock(entry.image_id)
+        if not lock.acquire(False):
+            return False
+        try:
+            snapshots = pool.storage.volume_list_snapshot(pool.project, entry.lu['LUName']) or []
+            if any(snap.get('clones') for snap in snapshots):
+                return False
+            for snap in snapshots:
+                pool.storage.volume_destroy_snapshot(
+                    pool.project, entry.lu['LUName'], znstor_restapi.snapshot_name(snap))
+            pool.storage.volume_destroy(pool.project, entry.lu['LUName'])
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.info('ZNSTOR. Cached image %s is in use, not evicted. Err: %s', entry.image_id, e)
+            entry.snapshot = None
+            return False
+        finally:
+            lock.release()
+        LOG.info('ZNSTOR. Cached image %s evicted', entry.image_id)
+        pool.image_cache.remove(entry.image_id)
+        self.stats_collector.adjust(pool.name, volumes=-1,
+                                    used=-self._allocated(entry.size, self.lcfg.thin_volumes))
+        return True
 
     def create_export(self, context, volume, connector):
         pass
@@ -342,8 +1071,446 @@ class ZNSTORISCSIDriver(driver.ISCSIDriver):
         pass
 
     def create_cloned_volume(self, volume, src_vref):
-        pass
+        """Create clone of volume.
+        Clone is made from hidden snapshot "clone-<volume id>" of the source volume, which
+        is destroyed when the clone is deleted.
+        """
+        snapname = CLONE_SNAPSHOT_PREFIX + volume['id']
+        pool = self._pool(src_vref)
+        self._check_same_pool(pool, volume)
+        src = self._get_lu(pool, src_vref)
+        if src is None:
+            raise exception.VolumeNotFound(volume_id=src_vref['id'])
+
+        try:
+            pool.storage.volume_create_snapshot(pool.project, src['LUName'], snapname)
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.error(e)
+            raise exception.VolumeBackendAPIException(
+                message="ZNSTOR. clone of volume %s failed. Err: %s" % (src_vref['name'], e))
+
+        try:
+            model_update = self._clone_volume(pool, volume, src, snapname, src_vref['size'])
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.error(e)
+            try:
+                pool.storage.volume_destroy_snapshot(pool.project, src['LUName'], snapname)
+            except znstor_restapi.ZnstorBadRequest as cleanup_error:
+                LOG.error('ZNSTOR. Cleanup of failed clone %s failed. Err: %s', volume['name'], cleanup_error)
+            raise exception.VolumeBackendAPIException(
+                message="ZNSTOR. clone of volume %s failed. Err: %s" % (src_vref['name'], e))
+        return model_update
+
+    def _clone_volume(self, pool, volume, src, snapname, src_size):
+        """Create volume as clone of snapshot of src, resize it to volume size.
+        Clone is destroyed if it can not be finished.
+        :param src: logical unit of source volume
+        :param src_size: size of source volume in gb
+        :return: model update
+        """
+        clone = None
+        try:
+            clone = pool.storage.volume_create_from_snapshot(
+                pool.project, src['LUName'], snapname, volume['name'])
+            model_update = self._model_update(pool, volume, clone)
+            if model_update is not None and volume['size'] > src_size:
+                pool.storage.volume_resize(
+                    pool.project, model_update['provider_id'], volume['size'] * units.Gi)
+            if model_update is not None:
+                self._apply_clone_options(pool, volume, model_update)
+        except znstor_restapi.ZnstorBadRequest:
+            if clone is not None:
+                self._destroy_failed_clone(pool, volume)
+            raise
+        self.stats_collector.adjust(pool.name, volumes=1,
+                                    used=self._allocated(volume['size'] * units.Gi, True, clone))
+        return model_update
+
+    def _destroy_failed_clone(self, pool, volume):
+        """destroy clone which can not be finished, it is looked up by alias
+        as the clone request may fail after volume is created"""
+        try:
+            lu = pool.storage.volume_get_by_alias(pool.project, volume['name'], refresh=True)
+            if lu is not None:
+                pool.storage.volume_destroy(pool.project, lu['LUName'])
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.error('ZNSTOR. Cleanup of failed clone %s failed. Err: %s', volume['name'], e)
+
+    def _release_clone_snapshot(self, pool, volume, wait=True):
+        """destroy hidden snapshot of source volume deleted clone was created from
+        :param wait: wait for destroy job, otherwise it is tracked by reaper
+        """
+        src = pool.storage.volume_get_by_alias(
+            pool.project, CONF.volume_name_template % volume['source_volid'])
+        if src is None:
+            return
+        # clones of group members share snapshot named after the group
+        names = [CLONE_SNAPSHOT_PREFIX + volume['id']]
+        if volume.get('group_id'):
+            names.append(CLONE_SNAPSHOT_PREFIX + volume['group_id'])
+        for name in names:
+            try:
+                if wait:
+                    pool.storage.volume_destroy_snapshot(pool.project, src['LUName'], name)
+                    return
+
+                def destroy(name=name):
+                    return pool.storage.volume_destroy_snapshot(
+                        pool.project, src['LUName'], name, wait=False)
+                pool.reaper.track('%s@%s' % (src['LUName'], name), destroy(), destroy)
+                return
+            except znstor_restapi.ZnstorBadRequest as e:
+                # volume was not cloned by this driver or snapshot is gone already,
+                # leftovers are destroyed together with source volume
+                LOG.debug('ZNSTOR. Hidden snapshot %s of clone %s is not destroyed. Err: %s',
+                          name, volume['name'], e)
+
+    def _destroy_clone_snapshots(self, pool, vol, backups=False):
+        """destroy hidden clone snapshots of volume which have no clones left
+        :param backups: destroy backup base snapshots without clones too,
+        the next backup of volume is full. Used when volume itself is going away.
+        :return: True if any snapshot is destroyed
+        """
+        destroyed = False
+        for snap in pool.storage.volume_list_snapshot(pool.project, vol['LUName']) or []:
+            name = znstor_restapi.snapshot_name(snap)
+            if not name or snap.get('clones'):
+                continue
+            if name.startswith(BACKUP_SNAPSHOT_PREFIX):
+                if not backups:
+                    continue
+                LOG.info('ZNSTOR. Backup base snapshot %s of volume %s is destroyed, '
+                         'the next backup is full.', name, vol['LUName'])
+            elif not name.startswith(CLONE_SNAPSHOT_PREFIX):
+                continue
+            pool.storage.volume_destroy_snapshot(pool.project, vol['LUName'], name)
+            destroyed = True
+        return destroyed
+
+    def _group_pool(self, volumes):
+        """Return the pool all volumes of consistency group are located in"""
+        found = set(self._pool(volume) for volume in volumes)
+        if len(found) > 1:
+            raise exception.VolumeBackendAPIException(
+                data="ZNSTOR. Volumes of consistency group are in different pools: %s" % ', '.join(
+                    sorted(pool.name for pool in found)))
+        return found.pop() if found else self.default_pool
+
+    def _snapshot_volumes(self, pool, snapname, lunames):
+        """Snapshot volumes at once with batched project snapshot.
+        znstord without batched snapshots gets one snapshot request per volume,
+        snapshots taken before failure are destroyed.
+        """
+        if not lunames:
+            return
+        try:
+            pool.storage.project_create_snapshot(pool.project, snapname, lunames)
+            return
+        except znstor_restapi.ZnstorNotSupported:
+            LOG.warning('ZNSTOR. Batched snapshots are not supported, snapshots %s of %d volumes '
+                        'are taken one by one and are not crash-consistent.', snapname, len(lunames))
+
+        for index, luname in enumerate(lunames):
+            try:
+                pool.storage.volume_create_snapshot(pool.project, luname, snapname)
+            except znstor_restapi.ZnstorBadRequest:
+                self._destroy_snapshots(pool, snapname, lunames[:index])
+                raise
+
+    def _destroy_snapshots(self, pool, snapname, lunames):
+        """Destroy snapshot of volumes, batched if znstord supports it
+        :return: list of errors in order of lunames, None if snapshot is destroyed
+        """
+        if not lunames:
+            return []
+        try:
+            pool.storage.project_destroy_snapshot(pool.project, snapname, lunames)
+            return [None] * len(lunames)
+        except znstor_restapi.ZnstorNotSupported:
+            pass
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.info('ZNSTOR. Batched destroy of snapshots %s failed, destroying one by one. Err: %s',
+                     snapname, e)
+
+        futures = [self.async_storage.submit(pool.storage.volume_destroy_snapshot, pool.project, luname, snapname)
+                   for luname in lunames]
+        errors = []
+        for error in self.async_storage.gather(futures, return_exceptions=True):
+            if isinstance(error, znstor_restapi.ZnstorObjectNotFound):
+                # snapshot is gone already
+                error = None
+            errors.append(error)
+        return errors
+
+    def create_group(self, context, group):
+        """Consistency groups have no backend object, other groups are generic"""
+        if not volume_utils.is_group_a_cg_snapshot_type(group):
+            raise NotImplementedError()
+        return {'status': fields.GroupStatus.AVAILABLE}
+
+    def delete_group(self, context, group, volumes):
+        if not volume_utils.is_group_a_cg_snapshot_type(group):
+            raise NotImplementedError()
+        model_update = {'status': fields.GroupStatus.DELETED}
+        volumes_model_update = []
+        for volume in volumes:
+            try:
+                self.delete_volume(volume)
+                volumes_model_update.append({'id': volume['id'], 'status': 'deleted'})
+            except (exception.VolumeIsBusy, exception.VolumeBackendAPIException) as e:
+                LOG.error('ZNSTOR. Volume %s of group %s is not deleted. Err: %s', volume['name'], group['id'], e)
+                volumes_model_update.append({'id': volume['id'], 'status': 'error_deleting'})
+                model_update['status'] = fields.GroupStatus.ERROR_DELETING
+        return model_update, volumes_model_update
+
+    def update_group(self, context, group, add_volumes=None, remove_volumes=None):
+        """Volumes of consistency group must be in one pool to be snapshotted at once"""
+        if not volume_utils.is_group_a_cg_snapshot_type(group):
+            raise NotImplementedError()
+        pool = self._pool(group)
+        for volume in add_volumes or []:
+            if self._pool(volume) is not pool:
+                raise exception.InvalidGroup(
+                    reason="ZNSTOR. Volume %s is not in pool %s of group" % (volume['name'], pool.name))
+        return None, None, None
+
+    def create_group_snapshot(self, context, group_snapshot, snapshots):
+        """Snapshot all volumes of consistency group with one batched snapshot
+        "group-snapshot-<group snapshot id>", which name is saved as provider_id of snapshots.
+        """
+        if not volume_utils.is_group_a_cg_snapshot_type(group_snapshot):
+            raise NotImplementedError()
+        snapname = GROUP_SNAPSHOT_PREFIX + group_snapshot['id']
+        pool = self._group_pool([snapshot['volume'] for snapshot in snapshots])
+        try:
+            lunames = [self._get_snapshot_lu(pool, snapshot)['LUName'] for snapshot in snapshots]
+            self._snapshot_volumes(pool, snapname, lunames)
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.error(e)
+            raise exception.VolumeBackendAPIException(
+                message="ZNSTOR. group snapshot %s failed. Err: %s" % (group_snapshot['id'], e))
+
+        snapshots_model_update = [{'id': snapshot['id'],
+                                   'status': fields.SnapshotStatus.AVAILABLE,
+                                   'provider_id': snapname} for snapshot in snapshots]
+        return {'status': fields.GroupSnapshotStatus.AVAILABLE}, snapshots_model_update
+
+    def delete_group_snapshot(self, context, group_snapshot, snapshots):
+        if not volume_utils.is_group_a_cg_snapshot_type(group_snapshot):
+            raise NotImplementedError()
+        pool = self._group_pool([snapshot['volume'] for snapshot in snapshots])
+        model_update = {'status': fields.GroupSnapshotStatus.DELETED}
+        snapshots_model_update = []
+
+        # snapshots taken by generic implementation before group became consistent have own names
+        by_name = {}
+        for snapshot in snapshots:
+            by_name.setdefault(self._snapshot_name(snapshot), []).append(snapshot)
+        for snapname, members in by_name.items():
+            lunames = [self._get_snapshot_lu(pool, snapshot)['LUName'] for snapshot in members]
+            for snapshot, error in zip(members, self._destroy_snapshots(pool, snapname, lunames)):
+                if error is None:
+                    snapshots_model_update.append({'id': snapshot['id'], 'status': fields.SnapshotStatus.DELETED})
+                    continue
+                LOG.error('ZNSTOR. Snapshot %s of group snapshot %s is not deleted. Err: %s',
+                          snapshot['name'], group_snapshot['id'], error)
+                snapshots_model_update.append({'id': snapshot['id'],
+                                               'status': fields.SnapshotStatus.ERROR_DELETING})
+                model_update['status'] = fields.GroupSnapshotStatus.ERROR_DELETING
+        return model_update, snapshots_model_update
+
+    def create_group_from_src(self, context, group, volumes, group_snapshot=None,
+                              snapshots=None, source_group=None, source_vols=None):
+        """Create consistency group from group snapshot or as a clone of group.
+        Volumes of source group are snapshotted at once into hidden snapshot "clone-<group id>",
+        clones of the snapshot are consistent with each other.
+        """
+        if not volume_utils.is_group_a_cg_snapshot_type(group):
+            raise NotImplementedError()
+
+        volumes_model_update = []
+        if group_snapshot is not None:
+            by_id = dict((snapshot['id'], snapshot) for snapshot in snapshots)
+            for volume in volumes:
+                model_update = self.create_volume_from_snapshot(volume, by_id[volume['snapshot_id']])
+                volumes_model_update.append(dict(model_update or {}, id=volume['id'], status='available'))
+            return None, volumes_model_update
+
+        if source_group is None:
+            raise exception.InvalidInput(reason="ZNSTOR. Source group or group snapshot is required")
+
+        pool = self._group_pool(list(source_vols) + list(volumes))
+        by_id = dict((src['id'], src) for src in source_vols)
+        pairs = [(volume, by_id[volume['source_volid']]) for volume in volumes]
+        snapname = CLONE_SNAPSHOT_PREFIX + group['id']
+        try:
+            lus = [self._get_lu(pool, src) for _, src in pairs]
+            self._snapshot_volumes(pool, snapname, [lu['LUName'] for lu in lus])
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.error(e)
+            raise exception.VolumeBackendAPIException(
+                message="ZNSTOR. clone of group %s failed. Err: %s" % (source_group['id'], e))
+
+        try:
+            for (volume, src), lu in zip(pairs, lus):
+                model_update = self._clone_volume(pool, volume, lu, snapname, src['size'])
+                volumes_model_update.append(dict(model_update or {}, id=volume['id'], status='available'))
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.error(e)
+            try:
+                for (volume, _), created in zip(pairs, volumes_model_update):
+                    if created.get('provider_id'):
+                        pool.storage.volume_destroy(pool.project, created['provider_id'])
+                        self.stats_collector.adjust(pool.name, volumes=-1)
+            except znstor_restapi.ZnstorBadRequest as cleanup_error:
+                LOG.error('ZNSTOR. Cleanup of failed group clone %s failed. Err: %s', group['id'], cleanup_error)
+            self._destroy_snapshots(pool, snapname, [lu['LUName'] for lu in lus])
+            raise exception.VolumeBackendAPIException(
+                message="ZNSTOR. clone of group %s failed. Err: %s" % (source_group['id'], e))
+        return None, volumes_model_update
 
     def migrate_volume(self, context, volume, host):
-        # TODO: Need implementation
-        pass
+        """Migrate volume to another project, zpool or domain of the same znstor cluster.
+        Snapshot of volume is sent to destination project by znstord (zfs send/receive job).
+        Only detached volumes are migrated, nothing writes to them, so single pass is consistent.
+        Migration snapshot is destroyed, source volume is destroyed after cutover.
+        :return: (True, model update) or (False, None) if cinder should migrate by host copy
+        """
+        location = self._parse_location(host['capabilities'].get('location_info'))
+        if location is None:
+            return False, None
+        addresses, domain, zpool, project = location
+        pool = self._pool(volume)
+        own = znstor_restclient.parse_addresses(self.lcfg.management_addr)
+        if not set(addresses) & set(own):
+            LOG.debug('ZNSTOR. Destination of volume %s is another znstor cluster %s.',
+                      volume['name'], ','.join(addresses))
+            return False, None
+        if (domain, zpool, project) == (self.lcfg.znstor_domain, pool.zpool, pool.project):
+            return True, None
+        # volume locked by migration is in maintenance, it can not be attached meanwhile
+        status = volume['status']
+        if status == 'maintenance':
+            status = volume.get('previous_status')
+        if status != 'available' or volume.get('attach_status') == 'attached':
+            LOG.debug('ZNSTOR. Volume %s is %s, only detached volumes are migrated by backend.',
+                      volume['name'], volume['status'])
+            return False, None
+
+        vol = self._get_lu(pool, volume)
+        if vol is None:
+            raise exception.VolumeNotFound(volume_id=volume['id'])
+        pool.reaper.wait(vol['LUName'] + '@')
+        target = self._client(domain, zpool)
+        if target.volume_get_by_alias(project, volume['name'], refresh=True) is not None:
+            LOG.error('ZNSTOR. Project %s already has volume %s, it is migrated by host copy.',
+                      project, volume['name'])
+            return False, None
+        # source volume is destroyed after cutover together with its backup base snapshot,
+        # hidden snapshots with clones keep it
+        self._destroy_clone_snapshots(pool, vol, backups=True)
+        if pool.storage.volume_list_snapshot(pool.project, vol['LUName']):
+            LOG.info('ZNSTOR. Volume %s has snapshots, it is migrated by host copy.', volume['name'])
+            return False, None
+        destination = {'domain': domain, 'pool': zpool, 'project': project, 'alias': volume['name']}
+        snapname = MIGRATION_SNAPSHOT_PREFIX + volume['id']
+        created = False
+        try:
+            pool.storage.volume_create_snapshot(pool.project, vol['LUName'], snapname)
+            created = True
+            self._send_snapshot(pool, volume, vol, snapname, destination)
+            received = target.volume_get_by_alias(project, volume['name'], refresh=True)
+            if received is None:
+                raise exception.VolumeBackendAPIException(
+                    data="ZNSTOR. Volume %s is not received by %s" % (volume['name'], project))
+        except (znstor_restapi.ZnstorBadRequest, exception.VolumeBackendAPIException) as e:
+            LOG.error('ZNSTOR. Migration of volume %s to %s failed, falling back to host copy. Err: %s',
+                      volume['name'], host['host'], e)
+            self._cleanup_migration(pool, vol, snapname if created else None, target, project,
+                                    volume['name'])
+            return False, None
+        finally:
+            self.migrations.pop(volume['id'], None)
+
+        for storage, project_id, luname in ((target, project, received['LUName']),
+                                            (pool.storage, pool.project, vol['LUName'])):
+            try:
+                storage.volume_destroy_snapshot(project_id, luname, snapname)
+            except znstor_restapi.ZnstorBadRequest as e:
+                LOG.warning('ZNSTOR. Migration snapshot %s is not destroyed. Err: %s', snapname, e)
+        try:
+            pool.storage.volume_destroy(pool.project, vol['LUName'])
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.error('ZNSTOR. Source of migrated volume %s is not destroyed. Err: %s', volume['name'], e)
+        allocated = self._allocated(volume['size'] * units.Gi, self._thin(volume))
+        self.stats_collector.adjust(pool.name, volumes=-1, used=-allocated)
+        for other in self.pools.values():
+            if (other.zpool, other.project) == (zpool, project) and domain == self.lcfg.znstor_domain:
+                self.stats_collector.adjust(other.name, volumes=1, used=allocated)
+
+        return True, {'provider_id': received['LUName'],
+                      'provider_location': received['SerialNum']}
+
+    def _client(self, domain, zpool):
+        """Return client of zpool, building one for zpools outside of configured pools"""
+        if domain == self.lcfg.znstor_domain and zpool in self.clients:
+            return self.clients[zpool]
+        client = self._remote_clients.get((domain, zpool))
+        if client is None:
+            client = self._remote_clients[(domain, zpool)] = self._make_client(
+                zpool, self.storage.rest.metrics, domain=domain)
+        return client
+
+    def _send_snapshot(self, pool, volume, vol, snapname, destination):
+        """Send snapshot to destination and wait for send job reporting its progress"""
+        future = pool.storage.volume_send_snapshot(
+            pool.project, vol['LUName'], snapname, destination,
+            timeout=self.lcfg.znstor_migration_timeout)
+        progress = self.migrations[volume['id']] = {
+            'volume': volume['name'],
+            'destination': '%(domain)s/%(pool)s/%(project)s' % destination,
+            'bytes': 0,
+            'total': None,
+            'throughput': None,
+            'started_at': time.time(),
+        }
+        done = threading.Event()
+        future.add_done_callback(lambda f: done.set())
+        while not done.wait(MIGRATION_PROGRESS_INTERVAL):
+            try:
+                reported = pool.storage.job_progress(pool.project, future.job, node=future.node)
+            except znstor_restapi.ZnstorBadRequest as e:
+                LOG.debug('ZNSTOR. Progress of migration of %s is not available. Err: %s', volume['name'], e)
+                continue
+            elapsed = time.time() - progress['started_at']
+            progress.update(bytes=reported.get('bytes', 0), total=reported.get('total'),
+                            throughput=reported.get('bytes', 0) / elapsed if elapsed else None)
+            LOG.info('ZNSTOR. Migration of %s: %d of %s bytes, %.1f MB/s',
+                     volume['name'], progress['bytes'], progress['total'],
+                     (progress['throughput'] or 0) / units.Mi)
+
+        pool.storage.job_wait(future)
+        if future.expired:
+            raise exception.VolumeBackendAPIException(
+                data="ZNSTOR. Migration of %s is not finished in %d seconds" % (
+                    volume['name'], self.lcfg.znstor_migration_timeout))
+        LOG.info('ZNSTOR. Migration of %s finished in %.1f seconds',
+                 volume['name'], time.time() - progress['started_at'])
+
+    def _cleanup_migration(self, pool, vol, snapname, target, project, alias):
+        """Destroy partially received volume and migration snapshot of source volume
+        :param snapname: migration snapshot or None if it was not created
+        """
+        try:
+            received = target.volume_get_by_alias(project, alias, refresh=True)
+            if received is not None:
+                if snapname is not None:
+                    try:
+                        target.volume_destroy_snapshot(project, received['LUName'], snapname)
+                    except znstor_restapi.ZnstorBadRequest:
+                        pass
+                target.volume_destroy(project, received['LUName'])
+            if snapname is not None:
+                pool.storage.volume_destroy_snapshot(pool.project, vol['LUName'], snapname)
+        except znstor_restapi.ZnstorBadRequest as e:
+            LOG.error('ZNSTOR. Cleanup of failed migration of %s failed. Err: %s', alias, e)
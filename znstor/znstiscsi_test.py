@@ -0,0 +1,478 @@
+import sys
+import types
+import uuid
+import hashlib
+import logging
+import contextlib
+
+# Driver runs against in-process znstord simulator with small stubs of cinder and oslo
+# interfaces it uses, so it is tested without cinder installed.
+
+
+def _module(name, **attrs):
+    module = sys.modules.get(name)
+    if module is None:
+        module = sys.modules[name] = types.ModuleType(name)
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(_module(parent), child, module)
+    module.__dict__.update(attrs)
+    return module
+
+
+class _Opt(object):
+    def __init__(self, name, default=None, help=None):
+        self.name = name
+        self.default = default
+
+
+class _Conf(object):
+    volume_name_template = 'volume-%s'
+
+    def register_opts(self, opts, group=None):
+        pass
+
+
+class _SaveAndReraiseException(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            # reraise exception handled by caller
+            raise
+        return False
+
+
+class CinderException(Exception):
+    def __init__(self, message=None, **kwargs):
+        super(CinderException, self).__init__(message or kwargs)
+        self.kwargs = kwargs
+
+
+def _exceptions(*names):
+    return dict((name, type(name, (CinderException,), {})) for name in names)
+
+
+def _statuses(*names):
+    return type('Status', (object,), dict((name, name.lower()) for name in names))
+
+
+# config group -> option values
+CONFIG_GROUPS = {}
+
+
+class Configuration(object):
+    """backend configuration: option defaults overridden by values of config group
+    and keyword arguments"""
+
+    def __init__(self, opts, config_group=None, **values):
+        self.config_group = config_group
+        self.append_config_values(opts)
+        self.__dict__.update(CONFIG_GROUPS.get(config_group) or {})
+        self.__dict__.update(values)
+
+    def append_config_values(self, opts):
+        for opt in opts:
+            if opt.name not in self.__dict__:
+                setattr(self, opt.name, opt.default)
+
+
+class ISCSIDriver(object):
+    def __init__(self, *args, **kwargs):
+        self.configuration = kwargs.get('configuration')
+        self.host = kwargs.get('host', 'cinder@znstor')
+
+    def copy_image_to_volume(self, context, volume, image_service, image_id):
+        image_service.download(context, image_id, volume)
+
+
+# backup id -> Backup
+BACKUPS = {}
+
+
+class Backup(object):
+    def __init__(self, volume_id, size=1, parent_id=None, snapshot_id=None):
+        self.id = str(uuid.uuid4())
+        self.volume_id = volume_id
+        self.size = size
+        self.parent_id = parent_id
+        self.snapshot_id = snapshot_id
+        self.status = 'creating'
+        BACKUPS[self.id] = self
+
+    @classmethod
+    def get_by_id(cls, context, backup_id):
+        return BACKUPS[backup_id]
+
+    @contextlib.contextmanager
+    def as_read_deleted(self):
+        yield
+
+    def refresh(self):
+        pass
+
+
+class PosixBackupDriver(object):
+    """chunked driver keeping chunks and sha256 files in memory"""
+
+    def __init__(self, context, db=None):
+        self.context = context
+        self.db = db
+        self.chunk_size_bytes = 128 * 1024
+        self.sha_block_size_bytes = 32 * 1024
+        self.data_block_num = 16
+        # backup id -> offset -> data
+        self.chunks = {}
+        self.sha256files = {}
+        # backups made by reading attached volume
+        self.read = []
+
+    def backup(self, backup, volume_file, backup_metadata=True):
+        self.read.append(backup.id)
+
+    def delete_backup(self, backup):
+        self.chunks.pop(backup.id, None)
+        self.sha256files.pop(backup.id, None)
+
+    def _prepare_backup(self, backup):
+        volume = self.db.volume_get(self.context, backup.volume_id)
+        return {}, {}, {}, 'container', volume['size'] * 1024 ** 3
+
+    def _backup_chunk(self, backup, container, data, offset, object_meta, extra_metadata):
+        self.chunks.setdefault(backup.id, {})[offset] = data
+
+    def _read_sha256file(self, backup):
+        return self.sha256files[backup.id]
+
+    def _finalize_backup(self, backup, container, object_meta, object_sha256):
+        self.sha256files[backup.id] = dict(object_sha256, chunk_size=self.sha_block_size_bytes)
+
+    def _backup_metadata(self, backup, object_meta):
+        pass
+
+    def _send_progress_notification(self, context, backup, object_meta, total_block_sent_num,
+                                    total_volume_size):
+        pass
+
+    def _send_progress_end(self, context, backup, object_meta):
+        pass
+
+
+def _extract_host(host, level='backend'):
+    backend, _, pool = host.partition('#')
+    if level == 'pool':
+        return pool or None
+    return backend
+
+
+# volume type id -> extra specs
+VOLUME_TYPES = {}
+
+_opts = dict((name, _Opt) for name in ('StrOpt', 'ListOpt', 'IntOpt', 'BoolOpt', 'FloatOpt'))
+_module('oslo_config.cfg', CONF=_Conf(), **_opts)
+_module('oslo_log.log', getLogger=logging.getLogger)
+_module('oslo_utils.units', Ki=1024, Mi=1024 ** 2, Gi=1024 ** 3, Ti=1024 ** 4)
+_module('oslo_utils.excutils', save_and_reraise_exception=_SaveAndReraiseException)
+_module('cinder.exception', CinderException=CinderException, **_exceptions(
+    'VolumeBackendAPIException', 'InvalidConfigurationValue', 'InvalidInput', 'InvalidGroup',
+    'InvalidBackup', 'VolumeIsBusy', 'VolumeNotFound', 'SnapshotIsBusy', 'SnapshotNotFound'))
+_module('cinder.interface', volumedriver=lambda cls: cls)
+_module('cinder.objects', Backup=Backup)
+_module('cinder.backup.drivers.posix', PosixBackupDriver=PosixBackupDriver)
+_module('cinder.objects.fields',
+        GroupStatus=_statuses('AVAILABLE', 'DELETED', 'ERROR_DELETING'),
+        GroupSnapshotStatus=_statuses('AVAILABLE', 'DELETED', 'ERROR_DELETING'),
+        SnapshotStatus=_statuses('AVAILABLE', 'DELETED', 'ERROR_DELETING'),
+        BackupStatus=_statuses('CREATING', 'AVAILABLE', 'DELETING', 'DELETED'))
+_module('cinder.volume.driver', ISCSIDriver=ISCSIDriver)
+_module('cinder.volume.configuration', Configuration=Configuration)
+_module('cinder.volume.volume_types',
+        get_volume_type_extra_specs=lambda type_id: VOLUME_TYPES.get(type_id))
+_module('cinder.volume.utils', extract_host=_extract_host,
+        is_group_a_cg_snapshot_type=lambda group: group.get('consistent', True))
+
+import restapi
+import restclient
+import jobs
+import stats
+import coalesce
+import asyncapi
+import metrics
+import imagecache
+import pools
+import simulator
+
+
+def _alias(module):
+    """make driver module importable as cinder.volume.drivers.znstor.<module>"""
+    name = module.__name__.rpartition('.')[2]
+    setattr(_module('cinder.volume.drivers.znstor'), name, module)
+    sys.modules['cinder.volume.drivers.znstor.' + name] = module
+
+
+for _local in (restapi, restclient, jobs, stats, coalesce, asyncapi, metrics, imagecache, pools):
+    _alias(_local)
+import znstiscsi
+_alias(znstiscsi)
+import backup
+from cinder import exception
+
+sim = simulator.Simulator().start()
+
+
+def _driver(**values):
+    """driver of a new project of simulator"""
+    config = Configuration(znstiscsi.OPTS, **dict(dict(
+        management_addr=sim.address,
+        znstor_user='znstor',
+        znstor_password='znstor',
+        znstor_domain='default',
+        znstor_pool='tank',
+        znstor_project=str(uuid.uuid4()),
+        quota=1024,
+        oversubs_ratio='20',
+        portal_addr='127.0.0.1:3260',
+        portal_iqn='iqn.2017-06.znstor.io:01:test',
+        znstor_attach_batch_window=0,
+    ), **values))
+    driver = znstiscsi.ZNSTORISCSIDriver(configuration=config)
+    driver.do_setup(None)
+    return driver
+
+
+def _volume(driver, size=1, pool=None, create=True, **fields):
+    """cinder volume in pool of driver
+    :param create: create volume on backend
+    """
+    volume_id = str(uuid.uuid4())
+    volume = dict({
+        'id': volume_id,
+        'name': 'volume-%s' % volume_id,
+        'size': size,
+        'host': '%s#%s' % (driver.host, pool or driver.default_pool.name),
+        'status': 'available',
+    }, **fields)
+    if create:
+        volume.update(driver.create_volume(volume) or {})
+    return volume
+
+
+def _connector(host=None):
+    host = host or str(uuid.uuid4())
+    return {'host': host, 'initiator': 'iqn.1994-05.com.redhat:%s' % host}
+
+
+def test_export_recreates_deleted_hostgroup():
+    driver = _driver()
+    volume = _volume(driver)
+    other = _volume(driver)
+    connector = _connector()
+    info = driver.initialize_connection(volume, connector)
+    assert info['data']['target_lun'] == 0
+    assert info['data']['volume_id'] == volume['provider_location']
+
+    # hostgroup deleted outside of driver is still cached
+    with sim.lock:
+        del sim.hostgroups[connector['host']]
+    sim.reset_counters()
+    info = driver.initialize_connection(other, connector)
+    assert info['data']['volume_id'] == other['provider_location']
+    assert sim.hostgroups[connector['host']] == set([connector['initiator']])
+    assert sim.requests['PUT volume_export'] == 2 and sim.requests['POST hostgroup_create'] == 1
+
+
+def test_export_keeps_hostgroup_members():
+    driver = _driver()
+    volume = _volume(driver)
+    connector = _connector()
+    driver.initialize_connection(volume, connector)
+
+    # the host attaches through another initiator, the first one is kept
+    second = dict(connector, initiator=connector['initiator'] + ':2')
+    driver.initialize_connection(volume, second)
+    assert sim.hostgroups[connector['host']] == set([connector['initiator'], second['initiator']])
+
+
+def test_export_missing_volume():
+    driver = _driver()
+    volume = _volume(driver)
+    with sim.lock:
+        del sim.projects[driver.default_pool.project]['volumes'][volume['provider_id']]
+    try:
+        driver.initialize_connection(volume, _connector())
+        assert False, 'export of missing volume should fail'
+    except exception.VolumeBackendAPIException:
+        pass
+
+
+def test_delete_missing_volume():
+    for async_delete in (False, True):
+        driver = _driver(znstor_async_delete=async_delete)
+        volume = _volume(driver)
+        with sim.lock:
+            del sim.projects[driver.default_pool.project]['volumes'][volume['provider_id']]
+        driver.delete_volume(volume)
+
+
+def test_volume_keyed_on_provider_id():
+    driver = _driver()
+    volume = _volume(driver)
+    serial = volume.pop('provider_location')
+
+    sim.reset_counters()
+    driver.extend_volume(volume, 2)
+    assert sim.requests == {'PUT volume_resize': 1}
+    assert driver.update_provider_info([volume], []) == ([], None)
+
+    # serial number of volume without provider_location is read once on attach
+    info = driver.initialize_connection(volume, _connector())
+    assert info['data']['volume_id'] == serial
+    assert not [key for key in sim.requests if key.endswith('volume_list')]
+
+
+class _Db(object):
+    def __init__(self, *volumes):
+        self.volumes = dict((volume['id'], volume) for volume in volumes)
+
+    def volume_get(self, context, volume_id):
+        return self.volumes[volume_id]
+
+
+def _backup_driver(driver, volume):
+    """backup driver of volume created by driver"""
+    CONFIG_GROUPS[driver.host.partition('@')[2]] = vars(driver.lcfg)
+    return backup.ZnstorBackupDriver(None, db=_Db(volume))
+
+
+def test_backup_pieces():
+    bdriver = backup.ZnstorBackupDriver(None)
+    chunk = bdriver.chunk_size_bytes
+    pieces = list(bdriver._pieces([(0, 4096, b'a' * 4096), (4096, 2 * chunk + 100, None),
+                                   (2 * chunk + 4196, 10, b'b' * 10)]))
+    assert [(offset, len(data), hole) for offset, data, hole in pieces] == [
+        (0, 4096, False), (4096, chunk, True), (4096 + chunk, chunk, True),
+        (4096 + 2 * chunk, 100, True), (2 * chunk + 4196, 10, False)]
+    assert all(data == b'\0' * len(data) for _, data, hole in pieces if hole)
+
+
+def test_backup_incremental():
+    driver = _driver()
+    volume = _volume(driver)
+    project, luname = driver.default_pool.project, volume['provider_id']
+    bdriver = _backup_driver(driver, volume)
+    block = bdriver.sha_block_size_bytes
+    zero = hashlib.sha256(b'\0' * block).hexdigest()
+
+    sim.write(project, luname, 0, b'a' * 8192)
+    full = Backup(volume['id'])
+    bdriver.backup(full, None)
+    sha256s = bdriver.sha256files[full.id]['sha256s']
+    assert len(sha256s) == volume['size'] * 1024 ** 3 // block
+    assert sha256s[0] == hashlib.sha256(b'a' * 8192 + b'\0' * (block - 8192)).hexdigest()
+    assert set(sha256s[1:]) == set([zero])
+    # holes are backed up as zero chunks
+    assert sum(len(data) for data in bdriver.chunks[full.id].values()) == volume['size'] * 1024 ** 3
+
+    sim.write(project, luname, 5 * block + 10, b'b' * 10)
+    incremental = Backup(volume['id'], parent_id=full.id)
+    bdriver.backup(incremental, None)
+    # only the changed block is sent, hashes of other blocks are taken from parent backup
+    assert bdriver.chunks[incremental.id] == {5 * block: b'\0' * 10 + b'b' * 10 + b'\0' * (block - 20)}
+    merged = bdriver.sha256files[incremental.id]['sha256s']
+    assert merged[:5] == sha256s[:5] and merged[6:] == sha256s[6:]
+    assert merged[5] == hashlib.sha256(bdriver.chunks[incremental.id][5 * block]).hexdigest()
+    # only the latest backup snapshot is kept
+    assert [restapi.snapshot_name(snap) for snap in driver.storage.volume_list_snapshot(project, luname)] == [
+        znstiscsi.BACKUP_SNAPSHOT_PREFIX + incremental.id]
+    assert not bdriver.read
+
+
+def test_backup_without_diff():
+    driver = _driver()
+    volume = _volume(driver)
+    project, luname = driver.default_pool.project, volume['provider_id']
+    bdriver = _backup_driver(driver, volume)
+
+    routes = sim._routes
+    sim._routes = [route for route in routes if route[2].__name__ != 'snapshot_diff']
+    try:
+        full = Backup(volume['id'])
+        bdriver.backup(full, None)
+    finally:
+        sim._routes = routes
+    # znstord without diff endpoint: attached volume is read, snapshot is not left behind
+    assert bdriver.read == [full.id]
+    assert not driver.storage.volume_list_snapshot(project, luname)
+
+
+def test_pending_delete_space():
+    driver = _driver(znstor_async_delete=True)
+    pool = driver.default_pool
+    VOLUME_TYPES['thick'] = {'provisioning:type': 'thick'}
+    thin = _volume(driver)
+    sim.write(pool.project, thin['provider_id'], 0, b'a' * 8192)
+    thick = _volume(driver, size=2, volume_type_id='thick')
+
+    job_duration = sim.job_duration
+    sim.job_duration = 1
+    try:
+        driver.delete_volume(thin)
+        driver.delete_volume(thick)
+        # destroy jobs are running, space they free is known before they finish
+        assert pool.reaper.pending() == (2, 8192 + 2 * 1024 ** 3)
+        driver.stats_collector._refresh()
+        pending = driver.get_volume_stats()['pools'][0]
+        assert pending['pending_delete_gb'] == 2
+    finally:
+        sim.job_duration = job_duration
+
+    pool.reaper.wait(thin['provider_id'])
+    pool.reaper.wait(thick['provider_id'])
+    assert pool.reaper.pending() == (0, 0)
+    driver.stats_collector._refresh()
+    stats = driver.get_volume_stats()['pools'][0]
+    assert pending['free_capacity_gb'] == stats['free_capacity_gb'] == 1024
+    assert pending['provisioned_capacity_gb'] == stats['provisioned_capacity_gb'] == 0
+
+
+class _ImageService(object):
+    def __init__(self, error=None):
+        self.error = error
+        self.downloads = 0
+
+    def download(self, context, image_id, volume):
+        self.downloads += 1
+        if self.error is not None:
+            raise self.error
+
+
+def _aliases(driver):
+    return sorted(vol['alias'] for vol in driver.storage.volume_iter(driver.default_pool.project))
+
+
+def test_clone_image():
+    driver = _driver()
+    image = {'id': str(uuid.uuid4()), 'size': 1024 ** 2, 'checksum': 'c1'}
+    # copy of image to cache fails with anything, volume is created without cache
+    volume = _volume(driver, create=False)
+    assert driver.clone_image(None, volume, None, image, _ImageService(IOError('read failed'))) == (None, False)
+    assert _aliases(driver) == []
+
+    images = _ImageService()
+    clone = _volume(driver, size=2, create=False)
+    model_update, cloned = driver.clone_image(None, clone, None, image, images)
+    assert cloned and images.downloads == 1
+    lu = driver.storage.volume_get(driver.default_pool.project, model_update['provider_id'])
+    assert lu['alias'] == clone['name'] and lu['vol']['options']['volsize'] == 2 * 1024 ** 3
+
+    # clone which is not found after creation is destroyed
+    other = _volume(driver, create=False)
+    model_update = driver._model_update
+    driver._model_update = lambda pool, volume, created: None
+    try:
+        assert driver.clone_image(None, other, None, image, images) == (None, False)
+    finally:
+        driver._model_update = model_update
+    assert images.downloads == 1
+    assert other['name'] not in _aliases(driver)